@@ -1,15 +1,16 @@
-import json
 from urllib.parse import parse_qs
-from urllib.request import urlopen
 
 import httpx
 from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from jose import jwt
 from rest_framework.exceptions import AuthenticationFailed
+from notes.jwks import jwks_store
+from notes.tokens import token_cache
 
 User = get_user_model()
 
@@ -20,19 +21,22 @@ class JWTAuthMiddleware(BaseMiddleware):
         tokens = query_string.get("authToken")
         token = tokens[0] if tokens else None
 
-        if token:
+        cached = token_cache.get(token) if token else None
+
+        if cached:
+            scope["user"] = cached[1]
+        elif token:
             try:
                 # Fetch JWKS and decode JWT
                 rsa_key = await self.get_rsa_key(token)
                 if rsa_key:
-                    payload = jwt.decode(
-                        token,
-                        rsa_key,
-                        algorithms=settings.ALGORITHMS,
-                        audience=settings.API_IDENTIFIER,
-                        issuer=f"https://{settings.AUTH0_DOMAIN}/"
-                    )
-                    scope["user"] = await self.get_user(payload, token)
+                    payload = await self.decode_token(token, rsa_key)
+                    user = await self.get_user(payload, token)
+                    if user.is_active:
+                        scope["user"] = user
+                        token_cache.set(token, payload, user)
+                    else:
+                        scope["user"] = AnonymousUser()
                 else:
                     scope["user"] = AnonymousUser()
             except (jwt.ExpiredSignatureError, jwt.JWTClaimsError, Exception):
@@ -43,22 +47,22 @@ class JWTAuthMiddleware(BaseMiddleware):
         return await super().__call__(scope, receive, send)
 
     async def get_rsa_key(self, token):
-        """Fetches the RSA key needed to decode the JWT."""
+        """Returns the cached RSA key needed to decode the JWT."""
         unverified_header = jwt.get_unverified_header(token)
-        jsonurl = urlopen(f"https://{settings.AUTH0_DOMAIN}/.well-known/jwks.json")
-        jwks = json.loads(jsonurl.read())
-        
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-        return rsa_key
+        return await jwks_store.aget_key(unverified_header.get("kid"))
+
+    async def decode_token(self, token, rsa_key):
+        """
+        Verifies the JWT signature and claims.
+        RS256 verification is CPU bound, so it runs off the event loop.
+        """
+        return await sync_to_async(jwt.decode, thread_sensitive=False)(
+            token,
+            rsa_key,
+            algorithms=settings.ALGORITHMS,
+            audience=settings.API_IDENTIFIER,
+            issuer=f"https://{settings.AUTH0_DOMAIN}/"
+        )
 
     async def get_user(self, payload, token):
         """
@@ -66,15 +70,20 @@ class JWTAuthMiddleware(BaseMiddleware):
         This object will pass the `is_authenticated` check.
         """
         username = payload["sub"]
-        user = await sync_to_async(User.objects.get)(username=username)
+        user = await self.get_user_by_username(username)
         if user:
             return user
 
-       
-        return await self.update_user_info(user, token)
+        return await self.update_user_info(token, username)
 
+    @database_sync_to_async
+    def get_user_by_username(self, username):
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            return None
 
-    async def update_user_info(self, user, token,username):
+    async def update_user_info(self, token, username):
         """
         Fetches user info from Auth0 and updates the User instance.
         """
@@ -86,10 +95,15 @@ class JWTAuthMiddleware(BaseMiddleware):
 
         if response.status_code == 200:
             user_info = response.json()
-            user, created =await sync_to_async(User.objects.get_or_create)(email=user_info.get("email"), username=username)
-            if created:
-                user.username = username
-            await sync_to_async(user.save)()
-            return user
+            return await self.save_user_info(user_info, username)
         else:
             raise AuthenticationFailed("Failed to fetch user info from Auth0")
+
+    @database_sync_to_async
+    def save_user_info(self, user_info, username):
+        user, created = User.objects.get_or_create(
+            email=user_info.get("email"), username=username)
+        if created:
+            user.username = username
+        user.save()
+        return user
@@ -53,6 +53,35 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Deltas received for a note within this many seconds go out as one frame
+NOTE_DELTA_BATCH_WINDOW = 0.02
+# Logged deltas are folded into the note's snapshot after this many operations
+NOTE_SNAPSHOT_EVERY_OPS = 200
+
+# Who is connected to each note, shared by every Daphne worker
+PRESENCE = {
+    'BACKEND': 'notes.presence.RedisPresence',
+}
+PRESENCE_HEARTBEAT_INTERVAL = 30  # seconds between presence refreshes
+PRESENCE_TTL = 75  # a member without a heartbeat for this long is dropped
+PRESENCE_BROADCAST_DELAY = 0.5  # debounce for user count broadcasts
+
+# Seconds a WebSocket access decision for (user or invite, note) is cached
+ACCESS_CACHE_TTL = 30
+
+# Shared by every worker: access decisions and cached responses
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://REDIS_HOST:REDIS_PORT/1',
+    },
+}
+# Seconds a cached note or category response is kept (see notes/caching.py);
+# writes make them unreachable right away regardless
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+# Seconds a scope's version is kept; outlives the values cached under it
+RESPONSE_CACHE_VERSION_TIMEOUT = 2 * RESPONSE_CACHE_TIMEOUT
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -167,8 +196,69 @@ AUTH0_DOMAIN = 'AUTH0_DOMAIN'
 API_IDENTIFIER = 'API_IDENTIFIER'
 ALGORITHMS = []
 
+# Auth0 signing keys are cached in-process (see notes/jwks.py)
+JWKS_CACHE_TTL = 600  # seconds before keys are refreshed in the background
+JWKS_MIN_REFETCH_INTERVAL = 30  # rate limit for refetches on an unknown kid
+JWKS_FETCH_TIMEOUT = 5
+
+# Max number of verified bearer tokens kept in memory (see notes/tokens.py)
+VERIFIED_TOKEN_CACHE_SIZE = 1024
+
+# Valid invite tokens kept in memory (see notes/invites.py). The TTL bounds
+# how long other processes keep accepting a deleted invite
+INVITE_TOKEN_CACHE_SIZE = 4096
+INVITE_TOKEN_CACHE_TTL = 60
+
 OPENAI_API_KEY = 'OPENAI_API_KEY'
 
+# Notes are categorized in the background after they are saved
+AI_CATEGORIZATION_ENABLED = False
+CATEGORIZATION_QUEUE = {
+    'BACKEND': 'notes.categorization.InProcessCategorizationQueue',
+    'WORKERS': 2,
+}
+CATEGORY_CACHE_MAX_ENTRIES = 500  # remembered classifications per user
+CATEGORY_RECLASSIFY_MIN_CHANGE = 0.2  # fraction of words that must change
+CATEGORIZATION_BATCH_NOTE_CHARS = 1000  # per-note text sent in batched requests
+
+# Classifier used for single notes. LocalFirstClassifier answers from a
+# per-user nearest-centroid model and only asks OpenAI when unsure;
+# use notes.classifiers.RemoteClassifier to always go to OpenAI.
+CATEGORY_CLASSIFIER = 'notes.classifiers.LocalFirstClassifier'
+LOCAL_CLASSIFIER_MIN_CONFIDENCE = 0.35
+LOCAL_CLASSIFIER_DIMENSIONS = 4096
+LOCAL_CLASSIFIER_TTL = 300  # seconds before a user's model is rebuilt
+LOCAL_CLASSIFIER_MAX_TRAINING_NOTES = 2000
+
+# Note history (see notes/revisions.py): every save stores a compressed
+# delta, and every NOTE_REVISION_KEYFRAME_INTERVAL-th revision the full
+# content, so rebuilding any revision applies fewer deltas than that
+NOTE_REVISION_KEYFRAME_INTERVAL = 50
+NOTE_REVISION_COMPRESSION_LEVEL = 6
+
+# Note content of at least this many bytes is stored zlib-compressed (see
+# notes/fields.py); None stores new content uncompressed. Matches where
+# Postgres would start TOASTing the row, and the column is kept out of
+# TOAST compression so nothing is compressed twice
+CONTENT_COMPRESSION_THRESHOLD = 2048
+CONTENT_COMPRESSION_LEVEL = 6
+
+# Rows fetched per round trip by streaming exports, and notes per insert
+# by imports (see notes/transfer.py)
+NOTE_EXPORT_BATCH_SIZE = 500
+NOTE_IMPORT_BATCH_SIZE = 500
+# Operations accepted in one notes/batch/ request
+NOTE_BATCH_MAX_OPERATIONS = 1000
+
+# Text search configuration used to build and query note search vectors
+SEARCH_CONFIG = 'english'
+
+# notes/sync/ hands out cursors this many seconds in the past, so changes
+# still being committed when a cursor is issued are picked up next time
+NOTE_SYNC_OVERLAP = 5
+# Deletion tombstones are kept this long; older cursors must reload the list
+NOTE_TOMBSTONE_RETENTION = 60 * 60 * 24 * 30  # seconds
+
 # Anymail settings
 ANYMAIL = {
     'MAILJET_API_KEY': 'MAILJET_API_KEY',
@@ -178,4 +268,21 @@ ANYMAIL = {
 EMAIL_BACKEND = 'anymail.backends.mailjet.EmailBackend'
 DEFAULT_FROM_EMAIL = 'DEFAULT_FROM_EMAIL'
 
-FRONTEND_URL = 'FRONTEND_URL'
\ No newline at end of file
+FRONTEND_URL = 'FRONTEND_URL'
+
+# Invite and share emails go through an outbox table (see notes/outbox.py).
+# The dispatcher is woken when emails are queued and also polls for retries;
+# run `manage.py dispatch_outbox_emails --loop` to drain it out of process.
+EMAIL_OUTBOX = {
+    'BACKEND': 'notes.outbox.InProcessEmailDispatcher',
+    'BATCH_SIZE': 50,  # emails sent per provider connection
+    'POLL_INTERVAL': 30,
+}
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_RETRY_DELAY = 30  # seconds before the first retry, doubled each time
+EMAIL_OUTBOX_MAX_RETRY_DELAY = 60 * 60
+EMAIL_OUTBOX_LEASE = 5 * 60  # claimed emails come due again if their dispatcher dies
+
+# Limits for a single notes/bulk_share/ request
+BULK_SHARE_MAX_NOTES = 50
+BULK_SHARE_MAX_RECIPIENTS = 100
\ No newline at end of file
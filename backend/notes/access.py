@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .invites import invite_cache
+from .models import Note, SharedNote
+
+
+def access_cache_key(note_id, user_id=None, token=None):
+    if token:
+        return f"note-access:{note_id}:token:{token}"
+    return f"note-access:{note_id}:user:{user_id}"
+
+
+def visible_to(user):
+    """
+    Filter for the notes `user` owns or has been shared. The shares are an
+    uncorrelated subquery the database runs once per query; a correlated
+    EXISTS under the OR would be run again for every note row.
+    """
+    return Q(user=user) | Q(pk__in=SharedNote.objects.filter(user=user).values('note'))
+
+
+def has_note_access(note_id, user=None, token=None):
+    """
+    Answers "may this user or invite token open the note?" with at most one
+    query: a valid invite for the note (usually straight from the invite
+    token cache), ownership or a share all grant access.
+    """
+    if token:
+        invite = invite_cache.resolve(token)
+        if invite is not None and str(invite.note_id) == str(note_id):
+            return True
+    if user is None or not user.is_authenticated:
+        return False
+    return Note.objects.filter(visible_to(user), pk=note_id).exists()
+
+
+def check_note_access(note_id, user=None, token=None):
+    """
+    `has_note_access` behind a short-lived cache, one entry per principal
+    (invite token or user). Entries are dropped by the signal handlers in
+    notes/signals.py when the note, its shares or its invites change.
+    """
+    principals = []
+    if token:
+        principals.append((access_cache_key(note_id, token=token), None, token))
+    if user is not None and user.is_authenticated:
+        principals.append((access_cache_key(note_id, user_id=user.id), user, None))
+
+    cached = cache.get_many([key for key, _, _ in principals])
+    for key, principal_user, principal_token in principals:
+        allowed = cached.get(key)
+        if allowed is None:
+            allowed = has_note_access(note_id, principal_user, principal_token)
+            cache.set(key, allowed, settings.ACCESS_CACHE_TTL)
+        if allowed:
+            return True
+    return False
+
+
+def invalidate_note_access(note_id, user_id=None, token=None):
+    cache.delete(access_cache_key(note_id, user_id=user_id, token=token))
+
+
+def invalidate_users_note_access(pairs):
+    """Drops the cached entries for many `(note_id, user_id)` pairs at once."""
+    cache.delete_many([access_cache_key(note_id, user_id=user_id) for note_id, user_id in pairs])
@@ -6,9 +6,9 @@ from django.utils.functional import SimpleLazyObject
 from jose import jwt
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-import json
-from urllib.request import urlopen
 from django.contrib.auth.models import User
+from .jwks import jwks_store
+from .tokens import token_cache
 
 
 class Auth0JSONWebTokenAuthentication(BaseAuthentication):
@@ -28,21 +28,13 @@ class Auth0JSONWebTokenAuthentication(BaseAuthentication):
                 'Authorization header must be Bearer token')
 
         token = parts[1]
+        cached = token_cache.get(token)
+        if cached:
+            return (cached[1], token)
+
         try:
-            jsonurl = urlopen(
-                f"https://{settings.AUTH0_DOMAIN}/.well-known/jwks.json")
-            jwks = json.loads(jsonurl.read())
             unverified_header = jwt.get_unverified_header(token)
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {
-                        "kty": key["kty"],
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "n": key["n"],
-                        "e": key["e"]
-                    }
+            rsa_key = jwks_store.get_key(unverified_header.get("kid"))
             if rsa_key:
                 payload = jwt.decode(
                     token,
@@ -51,7 +43,7 @@ class Auth0JSONWebTokenAuthentication(BaseAuthentication):
                     audience=settings.API_IDENTIFIER,
                     issuer=f"https://{settings.AUTH0_DOMAIN}/"
                 )
-                return (SimpleLazyObject(lambda: self.get_user(payload, token)), token)
+                return (SimpleLazyObject(lambda: self.resolve_user(payload, token)), token)
         except jwt.ExpiredSignatureError:
             raise AuthenticationFailed('Token is expired')
         except jwt.JWTClaimsError:
@@ -62,6 +54,14 @@ class Auth0JSONWebTokenAuthentication(BaseAuthentication):
 
         raise AuthenticationFailed('Unable to find appropriate key')
 
+    def resolve_user(self, payload, token):
+        """Resolves the user and remembers the verified token for next time."""
+        user = self.get_user(payload, token)
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        token_cache.set(token, payload, user)
+        return user
+
     def get_user(self, payload, token):
         """
         Returns a user-like object from the payload.
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .access import visible_to
+from .caching import invalidate_notes
+from .categorization import schedule_categorization
+from .deltas import reset_snapshots
+from .models import Category, Note, NoteRevision
+from .revisions import build_revision, record_revisions
+from .signals import batched_deletions
+
+logger = logging.getLogger(__name__)
+
+CREATE = 'create'
+UPDATE = 'update'
+RECATEGORIZE = 'recategorize'
+DELETE = 'delete'
+OPERATIONS = (CREATE, UPDATE, RECATEGORIZE, DELETE)
+
+# Per-operation statuses reported by `apply_operations`
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+NOT_FOUND = 'not_found'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+# Notes per UPDATE statement when text changes are written back
+UPDATE_BATCH_SIZE = 100
+
+# Tells a field left out of an operation from one given as null
+MISSING = object()
+
+
+class Operation:
+    """One parsed entry of a batch, carrying its result."""
+
+    def __init__(self, index, data):
+        self.index = index
+        self.op = data.get("op")
+        self.note_id = data.get("id")
+        self.title = data.get("title", MISSING)
+        self.content = data.get("content", MISSING)
+        self.category_id = data.get("category_id", MISSING)
+        self.result = {"index": index, "op": self.op}
+        if self.op != CREATE:
+            self.result["id"] = self.note_id
+
+    @property
+    def failed(self):
+        return "status" in self.result
+
+    def succeed(self, status):
+        self.result["status"] = status
+
+    def fail(self, status, message=None):
+        self.result["status"] = status
+        if message:
+            self.result["message"] = message
+
+    def validate(self):
+        if self.op not in OPERATIONS:
+            self.fail(INVALID, f"op must be one of: {', '.join(OPERATIONS)}.")
+        elif self.op != CREATE and not _is_id(self.note_id):
+            self.fail(INVALID, "id must be an integer.")
+        elif self.op in (CREATE, UPDATE) and self.title is not MISSING and not (
+                isinstance(self.title, str) and len(self.title) <= Note._meta.get_field('title').max_length):
+            self.fail(INVALID, "title must be a string of at most 255 characters.")
+        elif self.op in (CREATE, UPDATE) and self.content is not MISSING and not isinstance(self.content, str):
+            self.fail(INVALID, "content must be a string.")
+        elif self.op == RECATEGORIZE and self.category_id is MISSING:
+            self.fail(INVALID, "category_id is required.")
+        elif self.op != DELETE and self.category_id not in (MISSING, None) and not _is_id(self.category_id):
+            self.fail(INVALID, "category_id must be an integer or null.")
+
+    @property
+    def changes_text(self):
+        return self.op in (CREATE, UPDATE) and (self.title is not MISSING or self.content is not MISSING)
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def apply_operations(user, operations):
+    """
+    Applies a batch of note operations for `user` in one transaction:
+    `create` (any of title, content, category_id), `update` (id and any of
+    title, content, category_id), `recategorize` (id and category_id, null
+    dropping the user-picked category) and `delete` (id).
+
+    Access is resolved for every note in one query, with the same rules as
+    the per-note endpoints, and categories must be the user's own. Invalid
+    operations, notes that can't be found and notes appearing twice are
+    reported and skipped. The rest are written with bulk inserts, bulk and
+    queryset updates and a single delete, and once committed each changed
+    note's channel group gets one notification. Returns one result per
+    operation, in order.
+    """
+    batch = [Operation(index, data if isinstance(data, dict) else {}) for index, data in enumerate(operations)]
+    for operation in batch:
+        operation.validate()
+    pending = [operation for operation in batch if not operation.failed]
+
+    note_ids = {operation.note_id for operation in pending if operation.op != CREATE}
+    # Note id -> owner id
+    visible = dict(Note.objects
+                   .filter(visible_to(user), id__in=note_ids)
+                   .values_list('id', 'user_id')) if note_ids else {}
+    category_ids = {operation.category_id for operation in pending if operation.category_id not in (MISSING, None)}
+    categories = ({category.id: category for category in Category.objects.filter(user=user, id__in=category_ids)}
+                  if category_ids else {})
+
+    seen = set()
+    for operation in pending:
+        if operation.op != CREATE:
+            if operation.note_id not in visible:
+                operation.fail(NOT_FOUND)
+                continue
+            if operation.note_id in seen:
+                operation.fail(DUPLICATE, "A note can only appear once per batch.")
+                continue
+            seen.add(operation.note_id)
+        if operation.category_id not in (MISSING, None) and operation.category_id not in categories:
+            operation.fail(INVALID, "Category not found.")
+    pending = [operation for operation in pending if not operation.failed]
+
+    # Note id -> changed fields, or None for a deleted note
+    changes = {}
+    with transaction.atomic():
+        _create(user, [operation for operation in pending if operation.op == CREATE], categories)
+        _update_text([operation for operation in pending if operation.op == UPDATE and operation.changes_text],
+                     categories, changes)
+        _recategorize([operation for operation in pending
+                       if operation.op in (UPDATE, RECATEGORIZE) and not operation.changes_text],
+                      categories, changes)
+        _delete([operation for operation in pending if operation.op == DELETE], changes)
+        # Deletes send signals; nothing else written here does
+        invalidate_notes([note_id for note_id, fields in changes.items() if fields is not None],
+                         {user.id, *(visible[note_id] for note_id in changes)})
+        transaction.on_commit(lambda: notify_note_changes(changes))
+
+    return [operation.result for operation in batch]
+
+
+def _create(user, operations, categories):
+    if not operations:
+        return
+    notes = []
+    for operation in operations:
+        note = Note(user=user, user_updated_category=categories.get(operation.category_id),
+                    title="Untitled" if operation.title is MISSING else operation.title,
+                    content="" if operation.content is MISSING else operation.content)
+        note.fill_derived_fields()
+        notes.append(note)
+    Note.objects.bulk_create(notes)
+    NoteRevision.objects.bulk_create(build_revision(note, None, None) for note in notes)
+
+    for operation, note in zip(operations, notes):
+        operation.result["id"] = note.id
+        operation.succeed(CREATED)
+        if not note.user_updated_category_id:
+            schedule_categorization(note)
+
+
+def _set_category(note, category):
+    # As with a single update, picking a category drops the AI one
+    note.user_updated_category = category
+    if category is not None:
+        note.ai_generated_category = None
+
+
+def _update_text(operations, categories, changes):
+    if not operations:
+        return
+    # Locked, so revisions are numbered and diffed in save order
+    notes = {note.id: note for note in Note.objects
+             .select_for_update()
+             .filter(id__in=[operation.note_id for operation in operations])
+             .defer('search_vector', 'content_delta', 'categorized_text')}
+
+    now = timezone.now()
+    updated, revised, rewritten = [], [], []
+    for operation in operations:
+        note = notes.get(operation.note_id)
+        if note is None:
+            operation.fail(NOT_FOUND)
+            continue
+        previous = (note.title, note.content)
+        fields = []
+        if operation.title is not MISSING:
+            note.title = operation.title
+            fields.append('title')
+        if operation.content is not MISSING:
+            note.content = operation.content
+            fields.append('content')
+        if operation.category_id is not MISSING:
+            _set_category(note, categories.get(operation.category_id))
+            fields.append('category')
+        note.fill_derived_fields()
+        note.updated_at = now
+        updated.append(note)
+        if (note.title, note.content) != previous:
+            revised.append((note, previous[1]))
+        if note.content != previous[1]:
+            rewritten.append(note.id)
+        if operation.content is not MISSING and not note.user_updated_category_id:
+            schedule_categorization(note)
+        changes[note.id] = fields
+        operation.succeed(UPDATED)
+
+    Note.objects.bulk_update(updated, ['title', 'content', 'snippet', 'search_vector', 'user_updated_category',
+                                       'ai_generated_category', 'effective_category', 'updated_at'],
+                             batch_size=UPDATE_BATCH_SIZE)
+    if revised:
+        record_revisions(revised)
+    if rewritten:
+        # As with a single save, the new content replaces the collaborative snapshot
+        reset_snapshots(rewritten)
+
+
+def _recategorize(operations, categories, changes):
+    # One UPDATE per target category; nothing needs loading
+    groups = {}
+    for operation in operations:
+        if operation.category_id is MISSING:
+            operation.succeed(UPDATED)
+        else:
+            groups.setdefault(operation.category_id, []).append(operation)
+
+    now = timezone.now()
+    for category_id, group in groups.items():
+        notes = Note.objects.filter(id__in=[operation.note_id for operation in group])
+        if category_id is None:
+            notes.update(user_updated_category=None, effective_category=F('ai_generated_category'), updated_at=now)
+        else:
+            category = categories[category_id]
+            notes.update(user_updated_category=category, ai_generated_category=None,
+                         effective_category=category, updated_at=now)
+        for operation in group:
+            changes[operation.note_id] = ['category']
+            operation.succeed(UPDATED)
+
+
+def _delete(operations, changes):
+    if not operations:
+        return
+    with batched_deletions():
+        Note.objects.filter(id__in=[operation.note_id for operation in operations]).delete()
+    for operation in operations:
+        changes[operation.note_id] = None
+        operation.succeed(DELETED)
+
+
+def notify_note_changes(changes):
+    """
+    Tells each note's channel group, in one message, which fields changed
+    or that the note is gone. All groups are sent to concurrently.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not changes:
+        return
+
+    async def broadcast():
+        return await asyncio.gather(*(
+            channel_layer.group_send(f'note_{note_id}', {
+                'type': 'note_changed',
+                'note': {'id': note_id, 'deleted': True} if fields is None else {'id': note_id, 'changed': fields},
+            })
+            for note_id, fields in changes.items()
+        ), return_exceptions=True)
+
+    try:
+        failures = [result for result in async_to_sync(broadcast)() if isinstance(result, Exception)]
+    except Exception as e:
+        failures = [e]
+    if failures:
+        logger.error(f"Failed to notify {len(failures)} of {len(changes)} changed notes: {failures[0]}")
@@ -0,0 +1,120 @@
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def note_scope(note_id):
+    return f"note:{note_id}"
+
+
+def user_scope(user_id, name):
+    return f"user:{user_id}:{name}"
+
+
+class VersionedCache:
+    """
+    Read-through cache in the default cache backend (Redis, shared by every
+    worker) whose keys embed the current version of each scope they depend
+    on: a note, or a user's categories or notes.
+
+    Writes don't delete cached values, they drop the scope's version once
+    the transaction commits, and the next read starts a fresh random one.
+    So a value computed from rows read before the commit can only ever be
+    stored under a version nobody reads any more: once a write has
+    returned, no read sees what it replaced.
+    """
+
+    def __init__(self, prefix='notes-cache', timeout=None, version_timeout=None):
+        self.prefix = prefix
+        self.timeout = timeout if timeout is not None else settings.RESPONSE_CACHE_TIMEOUT
+        self.version_timeout = (version_timeout if version_timeout is not None
+                                else settings.RESPONSE_CACHE_VERSION_TIMEOUT)
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def version_key(self, scope):
+        return f"{self.prefix}:version:{scope}"
+
+    def versions(self, scopes):
+        """Current version of each scope, starting one where there is none."""
+        keys = [self.version_key(scope) for scope in scopes]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # Random, so a scope whose version got evicted never comes
+                # back to a version that has values cached under it
+                version = uuid.uuid4().hex[:12]
+                # Versions of scopes nobody reads any more go away as well
+                added = cache.add(key, version, self.version_timeout)
+                versions[key] = version if added else cache.get(key, version)
+        return [versions[key] for key in keys]
+
+    def get(self, kind, scopes):
+        """
+        The cached `kind` value for `scopes` (None if there is none), and a
+        function that stores a value for them, computed after this call,
+        under the versions read here.
+        """
+        versions = self.versions(scopes)
+        key = ":".join([self.prefix, kind, *(f"{scope}@{version}" for scope, version in zip(scopes, versions))])
+        value = cache.get(key)
+        self._count(kind, value is not None)
+
+        def store(value):
+            if value is not None:
+                cache.set(key, value, self.timeout)
+        return value, store
+
+    def get_or_set(self, kind, scopes, compute):
+        """
+        The cached `kind` value for `scopes`, or `compute()` (stored unless
+        it's None).
+        """
+        value, store = self.get(kind, scopes)
+        if value is None:
+            value = compute()
+            store(value)
+        return value
+
+    def invalidate(self, scopes):
+        """Drops the scopes' versions once the current transaction commits."""
+        keys = [self.version_key(scope) for scope in scopes]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    def _count(self, kind, hit):
+        with self._lock:
+            hits, misses = self._counts.get(kind, (0, 0))
+            self._counts[kind] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+    def stats(self):
+        """Hits, misses and hit rate per kind of value, in this process."""
+        with self._lock:
+            return {
+                kind: {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+                for kind, (hits, misses) in self._counts.items()
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+
+response_cache = VersionedCache()
+
+
+def invalidate_notes(note_ids=(), user_ids=()):
+    """
+    Drops the cached copies of `note_ids` and, for `user_ids`, anything
+    derived from all of their notes (per-category counts). For writes that
+    send no signals: queryset updates, bulk_create and bulk_update.
+    """
+    response_cache.invalidate([note_scope(note_id) for note_id in note_ids] +
+                              [user_scope(user_id, 'notes') for user_id in user_ids])
+
+
+def invalidate_categories(user_id):
+    response_cache.invalidate([user_scope(user_id, 'categories')])
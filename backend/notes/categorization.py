@@ -0,0 +1,240 @@
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .caching import invalidate_notes
+from .models import Note
+from .utils import (extract_text_from_rich_content, generate_category_names,
+                    generate_or_get_category_from_content, needs_reclassification,
+                    resolve_categories)
+
+logger = logging.getLogger(__name__)
+
+
+def categorize_note(note_id, content, user_id, categorize=None):
+    """
+    Classifies `content` for the note owner, stores the result as the note's
+    AI category and pushes it to everyone connected to the note.
+
+    A note with an AI category keeps it until its text has drifted far
+    enough from the text that category was assigned for (see
+    `needs_reclassification`), however many saves that takes.
+    """
+    categorize = categorize or generate_or_get_category_from_content
+
+    note = (Note.objects
+            .filter(pk=note_id, user_id=user_id)
+            .select_related('user')
+            .only('ai_generated_category', 'categorized_text', 'user')
+            .first())
+    if note is None:
+        return None
+    plain_text = extract_text_from_rich_content(content)
+    if note.ai_generated_category_id and not needs_reclassification(note.categorized_text, plain_text):
+        return None
+
+    category = categorize(content, note.user)
+    if category is None:
+        # No answer (the model failed or wasn't sure): keep the current category
+        return None
+
+    # A user-picked category always wins, and the note may be gone by now.
+    # updated_at is bumped so conditional GETs and notes/sync/ see the change
+    updated = Note.objects.filter(pk=note_id, user_updated_category__isnull=True).update(
+        ai_generated_category=category, effective_category=category, categorized_text=plain_text,
+        updated_at=timezone.now())
+    if updated:
+        invalidate_notes([note_id], [user_id])
+        notify_category_update(note_id, category)
+    return category
+
+
+def notify_category_update(note_id, category):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            f'note_{note_id}',
+            {
+                'type': 'category_update',
+                'category': {'id': category.id, 'name': category.name} if category else None
+            }
+        )
+    except Exception as e:
+        logger.error(f"Failed to broadcast category for note {note_id}: {e}")
+
+
+def categorize_notes_in_batches(notes, batch_size=20, concurrency=4, classify=None, on_batch=None):
+    """
+    Classifies `notes` with one model request per `batch_size` notes and up
+    to `concurrency` requests in flight. Categories are resolved in bulk per
+    user and each batch is written back with a single bulk_update.
+
+    Notes the model gave no category for (e.g. the request failed) are left
+    as they were. `on_batch(batch, unclassified)` is called after each batch
+    is stored, in input order, with those notes, which makes it a safe place
+    to record a checkpoint.
+    """
+    classify = classify or generate_category_names
+
+    def classify_batch(batch):
+        plain_texts = [extract_text_from_rich_content(note.content) for note in batch]
+        return plain_texts, classify(plain_texts)
+
+    notes = iter(notes)
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            # Keep a bounded window of batches so memory stays flat
+            while len(in_flight) < concurrency * 2:
+                batch = list(islice(notes, batch_size))
+                if not batch:
+                    break
+                in_flight.append((batch, executor.submit(classify_batch, batch)))
+            if not in_flight:
+                break
+
+            batch, future = in_flight.popleft()
+            unclassified = store_batch_categories(batch, *future.result())
+            if on_batch:
+                on_batch(batch, unclassified)
+
+
+def store_batch_categories(batch, plain_texts, category_names):
+    """
+    Stores the AI category named for each note, along with the plain text it
+    was named for, and returns the notes that got no name, which keep the
+    category they had.
+    """
+    classified = [(note, name) for note, name in zip(batch, category_names) if name]
+    texts = dict(zip((note.id for note in batch), plain_texts))
+    names_by_user = {}
+    for note, name in classified:
+        names_by_user.setdefault(note.user_id, set()).add(name)
+
+    categories_by_user = {user_id: resolve_categories(user_id, names)
+                          for user_id, names in names_by_user.items()}
+
+    notes = []
+    for note, name in classified:
+        note.ai_generated_category = categories_by_user[note.user_id][name]
+        note.categorized_text = texts[note.id]
+        note.set_effective_category()
+        notes.append(note)
+    if notes:
+        Note.objects.bulk_update(notes, ['ai_generated_category', 'effective_category', 'categorized_text'])
+        invalidate_notes([note.id for note in notes], names_by_user)
+    return [note for note, name in zip(batch, category_names) if not name]
+
+
+class InProcessCategorizationQueue:
+    """
+    Categorization jobs handled by a pool of daemon threads in this process.
+
+    Jobs are coalesced per note: while a note is waiting (or being
+    classified) newer content simply replaces the pending job, so a burst
+    of autosaves results in one classification of the latest content. A
+    note is never classified by two workers at once, so results can't land
+    out of order.
+    """
+
+    def __init__(self, workers=2, categorize=None):
+        self.workers = workers
+        self.categorize = categorize
+
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._queued = set()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def enqueue(self, note_id, content, user_id):
+        with self._lock:
+            self._pending[note_id] = (content, user_id)
+            if note_id not in self._queued and note_id not in self._running:
+                self._queued.add(note_id)
+                self._queue.put(note_id)
+            self._start_workers()
+
+    def join(self):
+        """Blocks until every queued job has been processed."""
+        self._queue.join()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _start_workers(self):
+        # Called with the lock held
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"categorization-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            note_id = self._queue.get()
+            try:
+                with self._lock:
+                    self._queued.discard(note_id)
+                    job = self._pending.pop(note_id, None)
+                    if job:
+                        self._running.add(note_id)
+                if job:
+                    self._run(note_id, *job)
+            finally:
+                with self._lock:
+                    self._running.discard(note_id)
+                    # Content arrived while we were busy; go again with it
+                    if note_id in self._pending and note_id not in self._queued:
+                        self._queued.add(note_id)
+                        self._queue.put(note_id)
+                self._queue.task_done()
+
+    def _run(self, note_id, content, user_id):
+        close_old_connections()
+        try:
+            categorize_note(note_id, content, user_id, categorize=self.categorize)
+        except Exception as e:
+            logger.error(f"Categorization failed for note {note_id}: {e}")
+        finally:
+            close_old_connections()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_categorization_queue():
+    """Returns the process-wide queue configured by CATEGORIZATION_QUEUE."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            options = dict(getattr(settings, 'CATEGORIZATION_QUEUE', {}))
+            backend = import_string(options.pop(
+                'BACKEND', 'notes.categorization.InProcessCategorizationQueue'))
+            _queue = backend(**{key.lower(): value for key, value in options.items()})
+        return _queue
+
+
+def schedule_categorization(note):
+    """Queues `note` for classification once the current transaction commits."""
+    if not getattr(settings, 'AI_CATEGORIZATION_ENABLED', False):
+        return
+    note_id, content, user_id = note.id, note.content, note.user_id
+    transaction.on_commit(lambda: get_categorization_queue().enqueue(note_id, content, user_id))
@@ -0,0 +1,169 @@
+import logging
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import Note
+from .utils import extract_text_from_rich_content, get_open_ai_client
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class BaseClassifier:
+    """
+    Picks a category name for a note's plain text.
+    `classify` returns `(category_name, confidence)`; the name is None when
+    the classifier has no answer. Confidence is in the 0-1 range.
+    """
+
+    def classify(self, plain_text, user):
+        raise NotImplementedError
+
+
+class RemoteClassifier(BaseClassifier):
+    """Asks the OpenAI chat model for a category."""
+
+    def classify(self, plain_text, user):
+        try:
+            response = get_open_ai_client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant that categorizes note content."},
+                    {"role": "user", "content": f"Categorize the following note content: '{plain_text}'"}
+                ],
+                max_tokens=10,
+                temperature=0.3
+            )
+            return response.choices[0].message.content.strip(), 1.0
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            return None, 0.0
+
+
+def hashed_features(plain_text, dimensions):
+    """L2-normalized, log-scaled hashed bag-of-words vector for `plain_text`."""
+    tokens = TOKEN_RE.findall(plain_text.lower())
+    if not tokens:
+        return None
+    # crc32 rather than hash() so the features are stable across processes
+    buckets = np.fromiter((zlib.crc32(token.encode()) for token in tokens),
+                          dtype=np.uint32, count=len(tokens)) % dimensions
+    vector = np.log1p(np.bincount(buckets, minlength=dimensions).astype(np.float32))
+    return vector / np.linalg.norm(vector)
+
+
+class CentroidModel:
+    def __init__(self, names, centroids):
+        self.names = names
+        self.centroids = centroids
+        self.built_at = time.monotonic()
+
+
+class LocalClassifier(BaseClassifier):
+    """
+    Offline nearest-centroid classifier trained on the user's own notes.
+
+    Every categorized note (a user-picked category wins over the AI one)
+    contributes its hashed bag-of-words vector to its category's centroid.
+    A note is assigned the category whose centroid has the highest cosine
+    similarity; that similarity is the confidence. Models are built per
+    user on first use and rebuilt after `ttl` seconds.
+    """
+
+    def __init__(self, dimensions=None, ttl=None, max_training_notes=None):
+        self.dimensions = dimensions or settings.LOCAL_CLASSIFIER_DIMENSIONS
+        self.ttl = ttl if ttl is not None else settings.LOCAL_CLASSIFIER_TTL
+        self.max_training_notes = max_training_notes or settings.LOCAL_CLASSIFIER_MAX_TRAINING_NOTES
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def classify(self, plain_text, user):
+        model = self.get_model(user)
+        features = hashed_features(plain_text, self.dimensions)
+        if model is None or features is None:
+            return None, 0.0
+
+        scores = model.centroids @ features
+        best = int(np.argmax(scores))
+        return model.names[best], float(scores[best])
+
+    def get_model(self, user):
+        with self._lock:
+            model = self._models.get(user.id)
+        if model is None or time.monotonic() - model.built_at >= self.ttl:
+            model = self.train(user)
+            with self._lock:
+                self._models[user.id] = model
+        return model
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._models.clear()
+            else:
+                self._models.pop(user_id, None)
+
+    def train(self, user):
+        rows = (Note.objects
+                .filter(user=user)
+                .annotate(category_name=F('effective_category__name'))
+                .filter(category_name__isnull=False)
+                .order_by('-updated_at')
+                .values_list('content', 'category_name')[:self.max_training_notes])
+
+        sums = {}
+        for content, category_name in rows:
+            features = hashed_features(extract_text_from_rich_content(str(content)), self.dimensions)
+            if features is None:
+                continue
+            if category_name in sums:
+                sums[category_name] += features
+            else:
+                sums[category_name] = features.copy()
+
+        if not sums:
+            return None
+
+        names = list(sums)
+        centroids = np.vstack([sums[name] for name in names])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        return CentroidModel(names, centroids)
+
+
+class LocalFirstClassifier(BaseClassifier):
+    """
+    Uses the local classifier and only goes to the remote model when the
+    local answer is missing or below LOCAL_CLASSIFIER_MIN_CONFIDENCE.
+    """
+
+    def __init__(self, local=None, remote=None, min_confidence=None):
+        self.local = local or LocalClassifier()
+        self.remote = remote or RemoteClassifier()
+        self.min_confidence = min_confidence if min_confidence is not None else settings.LOCAL_CLASSIFIER_MIN_CONFIDENCE
+
+    def classify(self, plain_text, user):
+        category_name, confidence = self.local.classify(plain_text, user)
+        if category_name and confidence >= self.min_confidence:
+            return category_name, confidence
+        return self.remote.classify(plain_text, user)
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    """Returns the process-wide classifier configured by CATEGORY_CLASSIFIER."""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = import_string(settings.CATEGORY_CLASSIFIER)()
+        return _classifier
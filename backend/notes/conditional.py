@@ -0,0 +1,47 @@
+import hashlib
+
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Strong ETag over `parts`, which must have a stable repr."""
+    return '"%s"' % hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def category_key(category):
+    return (category.id, category.name) if category else None
+
+
+def note_etag(note, user):
+    """
+    Validator for a full note. Background categorization and category
+    renames don't touch `updated_at`, so both categories are part of it,
+    and so is the requester because `is_owner` depends on them.
+    """
+    return make_etag(note.id, note.updated_at, category_key(note.user_updated_category),
+                     category_key(note.ai_generated_category), getattr(user, 'pk', None))
+
+
+def note_page_etag(notes, user, links):
+    """Validator for a page of list entries and its pagination links."""
+    entries = [(note.id, note.updated_at, category_key(note.effective_category), note.user_id) for note in notes]
+    return make_etag(entries, links, getattr(user, 'pk', None))
+
+
+def last_modified(note):
+    """`updated_at` as whole seconds, the resolution of Last-Modified."""
+    return int(note.updated_at.timestamp())
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    Sets the validators and makes clients revalidate on every use; responses
+    differ per user, so shared caches must keep them apart.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
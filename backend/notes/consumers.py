@@ -1,15 +1,19 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
+from django.conf import settings
+import asyncio
 import json
-from .models import Invite, SharedNote, Note
+import logging
+from .access import check_note_access
+from .deltas import delta_batcher, get_snapshot, seed_snapshot
+from .presence import presence, presence_broadcaster
 
-
-# Dictionary to keep track of active users per note (for simplicity)
-connected_users = {}
+logger = logging.getLogger(__name__)
 
 
 class NoteConsumer(AsyncWebsocketConsumer):
+    heartbeat_task = None
+
     async def connect(self):
         self.token = self.scope['url_route']['kwargs'].get('token')
         self.note_id = self.scope['url_route']['kwargs'].get('note_id')
@@ -17,81 +21,40 @@ class NoteConsumer(AsyncWebsocketConsumer):
 
         if await self.is_valid_connection():
             await self.channel_layer.group_add(self.note_group_name, self.channel_name)
-            # Update the count of connected users for this note
-            if self.note_id not in connected_users:
-                connected_users[self.note_id] = 0
-            connected_users[self.note_id] += 1
             await self.accept()
+            await self.send_sync()
+
+            # Register in the cluster-wide presence set and keep it alive
+            await presence.join(self.note_id, self.channel_name)
+            self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+            presence_broadcaster.schedule(self.channel_layer, self.note_id, force=True)
         else:
-            if self.note_id in connected_users:
-                connected_users[self.note_id] -= 1
-                if connected_users[self.note_id] <= 0:
-                    connected_users[self.note_id] = 0
             await self.close()
 
-        await self.channel_layer.group_send(
-            self.note_group_name,
-            {
-                'type': 'user_count_update',
-                'count': connected_users[self.note_id] if self.note_id in connected_users else 0
-            }
-        )
-
-    @database_sync_to_async
-    def get_invite(self, token):
-        try:
-            return Invite.objects.get(token=token)
-        except Invite.DoesNotExist:
-            return None
-
-    @database_sync_to_async
-    def get_shared_note(self, note_id, user):
-        try:
-            return SharedNote.objects.get(note_id=note_id, user=user)
-        except SharedNote.DoesNotExist:
-            return None
-
-    @database_sync_to_async
-    def get_owner_note(self, note_id, user):
-        try:
-            return Note.objects.get(id=note_id, user=user)
-        except Note.DoesNotExist:
-            return None
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                await presence.heartbeat(self.note_id, self.channel_name)
+            except Exception as e:
+                logger.error(f"Presence heartbeat failed for note {self.note_id}: {e}")
+            # Picks up members that expired without a clean disconnect
+            presence_broadcaster.schedule(self.channel_layer, self.note_id)
 
     async def is_valid_connection(self):
-        if self.token:
-            invite = await self.get_invite(self.token)
-            if invite and invite.expires_at > timezone.now():
-                return True
-
-        if self.scope['user'].is_authenticated:
-            shared_note = await self.get_shared_note(self.note_id, self.scope['user'])
-            if shared_note:
-                return True
-
-            owner_note = await self.get_owner_note(self.note_id, self.scope['user'])
-            if owner_note:
-                return True
-
-        return False
+        # One combined query at most, and none while the result is cached
+        return await database_sync_to_async(check_note_access)(
+            self.note_id, self.scope['user'], self.token)
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.note_group_name, self.channel_name)
 
-        # Update the count of connected users for this note
-        if self.note_id in connected_users:
-            connected_users[self.note_id] -= 1
-            if connected_users[self.note_id] <= 0:
-                connected_users[self.note_id] = 0
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            await presence.leave(self.note_id, self.channel_name)
 
             # Broadcast the updated user count to all subscribers
-            await self.channel_layer.group_send(
-                self.note_group_name,
-                {
-                    'type': 'user_count_update',
-                    'count': connected_users.get(self.note_id, 0)
-                }
-            )
+            presence_broadcaster.schedule(self.channel_layer, self.note_id, force=True)
 
     async def user_count_update(self, event):
         # Send the updated user count to the WebSocket
@@ -101,28 +64,49 @@ class NoteConsumer(AsyncWebsocketConsumer):
             'count': count
         }))
 
+    async def send_sync(self):
+        # Late joiners catch up from the snapshot plus the operations after it
+        snapshot, ops, version = await database_sync_to_async(get_snapshot)(self.note_id)
+        await self.send(text_data=json.dumps({
+            "type": "sync",
+            "snapshot": snapshot,
+            "ops": ops,
+            "version": version
+        }))
+
     async def receive(self, text_data):
         data = json.loads(text_data)
+
+        # The first client on a note without a snapshot provides the base document
+        if data.get("type") == "snapshot":
+            await database_sync_to_async(seed_snapshot)(
+                self.note_id, data.get("delta"), data.get("version") or 0)
+            return
+
         delta = data.get("delta")
         client_id = data.get("clientId")
 
-        # Broadcast the message to other clients, including the clientId
-        await self.channel_layer.group_send(
-            self.note_group_name,
-            {
-                "type": "note_message",
-                "delta": delta,
-                "clientId": client_id
-            }
-        )
-
-    async def note_message(self, event):
-        delta = event["delta"]
-        client_id = event["clientId"]
-
-        # Send message to WebSocket including clientId
-        await self.send(text_data=json.dumps({
-            "type": "message",
+        # Queue the delta; deltas within the batching window are logged and
+        # broadcast to the other clients together, each tagged with its clientId
+        delta_batcher.add(self.channel_layer, self.note_id, {
             "delta": delta,
             "clientId": client_id
+        })
+
+    async def note_batch(self, event):
+        # The frame is already JSON encoded once for every member
+        await self.send(text_data=event["payload"])
+
+    async def note_changed(self, event):
+        # Fields changed or the note deleted through the batch endpoint
+        await self.send(text_data=json.dumps({
+            "type": "note",
+            **event["note"]
+        }))
+
+    async def category_update(self, event):
+        # Push the AI-generated category once the background job is done
+        await self.send(text_data=json.dumps({
+            "type": "category",
+            "category": event["category"]
         }))
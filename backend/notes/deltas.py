@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Note, NoteOperation
+
+logger = logging.getLogger(__name__)
+
+INFINITY = float("inf")
+
+# Deltas are logged from a thread of their own, so fan-out never queues
+# behind the handshake and request queries on the shared sync thread
+_log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="note-delta-log")
+
+
+def _text_length(text):
+    # Quill measures strings in UTF-16 code units
+    return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def _text_slice(text, start, end):
+    encoded = text.encode("utf-16-le", "surrogatepass")
+    return encoded[start * 2:end * 2].decode("utf-16-le", "surrogatepass")
+
+
+def op_length(op):
+    if "delete" in op:
+        return op["delete"]
+    if "retain" in op:
+        return op["retain"]
+    return _text_length(op["insert"]) if isinstance(op["insert"], str) else 1
+
+
+def op_type(op):
+    for kind in ("insert", "delete", "retain"):
+        if kind in op:
+            return kind
+    return "retain"
+
+
+class _OpIterator:
+    def __init__(self, ops):
+        self.ops = ops
+        self.index = 0
+        self.offset = 0
+
+    def has_next(self):
+        return self.peek_length() < INFINITY
+
+    def peek_length(self):
+        if self.index < len(self.ops):
+            return op_length(self.ops[self.index]) - self.offset
+        return INFINITY
+
+    def peek_type(self):
+        if self.index < len(self.ops):
+            return op_type(self.ops[self.index])
+        return "retain"
+
+    def next(self, length=INFINITY):
+        if self.index >= len(self.ops):
+            return {"retain": INFINITY}
+
+        op = self.ops[self.index]
+        offset = self.offset
+        remaining = op_length(op) - offset
+        if length >= remaining:
+            length = remaining
+            self.index += 1
+            self.offset = 0
+        else:
+            self.offset += length
+
+        if "delete" in op:
+            return {"delete": length}
+
+        result = {}
+        if op.get("attributes"):
+            result["attributes"] = op["attributes"]
+        if "retain" in op:
+            result["retain"] = length
+        elif isinstance(op["insert"], str):
+            result["insert"] = _text_slice(op["insert"], offset, offset + length)
+        else:
+            result["insert"] = op["insert"]
+        return result
+
+
+def _push(ops, op):
+    """Appends `op`, merging it into the previous op the way Quill does."""
+    if not op_length(op):
+        return
+    index = len(ops)
+    last = ops[index - 1] if ops else None
+    if last is not None:
+        if "delete" in op and "delete" in last:
+            ops[index - 1] = {"delete": last["delete"] + op["delete"]}
+            return
+        # Inserts always go before an adjacent delete
+        if "delete" in last and "insert" in op:
+            index -= 1
+            last = ops[index - 1] if index > 0 else None
+            if last is None:
+                ops.insert(0, op)
+                return
+        attributes = op.get("attributes") or None
+        if attributes == (last.get("attributes") or None):
+            merged = None
+            if isinstance(op.get("insert"), str) and isinstance(last.get("insert"), str):
+                merged = {"insert": last["insert"] + op["insert"]}
+            elif "retain" in op and "retain" in last:
+                merged = {"retain": last["retain"] + op["retain"]}
+            if merged is not None:
+                if attributes:
+                    merged["attributes"] = attributes
+                ops[index - 1] = merged
+                return
+    ops.insert(index, op)
+
+
+def _compose_attributes(a, b, keep_null):
+    attributes = {**(a or {}), **(b or {})}
+    if not keep_null:
+        attributes = {key: value for key, value in attributes.items() if value is not None}
+    return attributes or None
+
+
+def compose(ops, other_ops):
+    """Quill's `Delta.compose` for plain lists of ops."""
+    this_iter = _OpIterator(ops)
+    other_iter = _OpIterator(other_ops)
+    result = []
+
+    while this_iter.has_next() or other_iter.has_next():
+        if other_iter.peek_type() == "insert":
+            _push(result, other_iter.next())
+        elif this_iter.peek_type() == "delete":
+            _push(result, this_iter.next())
+        else:
+            length = min(this_iter.peek_length(), other_iter.peek_length())
+            this_op = this_iter.next(length)
+            other_op = other_iter.next(length)
+            if "retain" in other_op:
+                new_op = {"retain": length} if "retain" in this_op else {"insert": this_op["insert"]}
+                attributes = _compose_attributes(
+                    this_op.get("attributes"), other_op.get("attributes"), "retain" in this_op)
+                if attributes:
+                    new_op["attributes"] = attributes
+                _push(result, new_op)
+            elif "delete" in other_op and "retain" in this_op:
+                _push(result, other_op)
+            # Otherwise `other` deletes something `this` inserted: both vanish
+
+    # Trailing plain retains are no-ops
+    while result and "retain" in result[-1] and not result[-1].get("attributes"):
+        result.pop()
+    return result
+
+
+def delta_ops(delta):
+    """Accepts either a Quill Delta object (`{"ops": [...]}`) or a bare op list."""
+    if isinstance(delta, dict):
+        return delta.get("ops") or []
+    return delta or []
+
+
+def store_operations(note_id, messages):
+    """Appends a batch of deltas to the note's log with one INSERT."""
+    operations = NoteOperation.objects.bulk_create([
+        NoteOperation(note_id=note_id, client_id=message.get("clientId") or "", delta=message.get("delta"))
+        for message in messages
+    ])
+    return operations[-1].id if operations and operations[-1].id else None
+
+
+def get_snapshot(note_id):
+    """
+    Returns `(snapshot, ops, version)` for a client joining the note. With no
+    snapshot, the note's content is the document before `ops`.
+    """
+    snapshot, version = Note.objects.values_list('content_delta', 'snapshot_version').get(pk=note_id)
+    operations = list(NoteOperation.objects.filter(note_id=note_id, id__gt=version)
+                      .order_by('id').values_list('id', 'delta'))
+    if operations:
+        version = operations[-1][0]
+    return snapshot, [delta for _, delta in operations], version
+
+
+def log_head(note_id, snapshot_version):
+    """Id of the note's last logged operation, or its snapshot version if none is left."""
+    head = NoteOperation.objects.filter(note_id=note_id).order_by('-id').values_list('id', flat=True).first()
+    return head or snapshot_version
+
+
+def seed_snapshot(note_id, delta, version):
+    """
+    Records a client's full document as the base snapshot at `version`.
+    Only the first client to seed a note wins, and only with a document
+    that includes every operation logged so far.
+    """
+    if not isinstance(version, int) or isinstance(version, bool):
+        return False
+    with transaction.atomic():
+        note = (Note.objects.select_for_update().only('id', 'content_delta', 'snapshot_version')
+                .filter(pk=note_id).first())
+        if note is None or note.content_delta is not None:
+            return False
+        # Operations logged since the client synced aren't in its document
+        if version != log_head(note_id, note.snapshot_version):
+            return False
+        Note.objects.filter(pk=note_id).update(content_delta={"ops": delta_ops(delta)}, snapshot_version=version)
+        NoteOperation.objects.filter(note_id=note_id, id__lte=version).delete()
+    return True
+
+
+def reset_snapshots(note_ids):
+    """
+    For notes whose content was just written outside the socket (a REST
+    save or a batch update): the content becomes the document again, up to
+    every operation logged so far. The snapshot and those operations are
+    dropped, and the next client to join seeds a fresh snapshot from the
+    content. Call inside the transaction that writes the content.
+    """
+    head = NoteOperation.objects.filter(note=OuterRef('pk')).order_by('-id').values('id')[:1]
+    Note.objects.filter(pk__in=note_ids).update(
+        content_delta=None, snapshot_version=Coalesce(Subquery(head), F('snapshot_version')))
+    NoteOperation.objects.filter(
+        note_id__in=note_ids,
+        id__lte=Subquery(Note.objects.filter(pk=OuterRef('note_id')).values('snapshot_version')[:1])).delete()
+
+
+def compact_note_operations(note_id):
+    """
+    Folds the logged operations into the note's snapshot and drops them.
+    Returns the number of operations folded.
+    """
+    with transaction.atomic():
+        note = Note.objects.select_for_update().only('id', 'content_delta', 'snapshot_version').get(pk=note_id)
+        if note.content_delta is None:
+            # Nothing to fold into until a client seeds the base document
+            return 0
+
+        operations = list(NoteOperation.objects.filter(note_id=note_id, id__gt=note.snapshot_version)
+                          .order_by('id').values_list('id', 'delta'))
+        if not operations:
+            return 0
+
+        document = delta_ops(note.content_delta)
+        for _, delta in operations:
+            document = compose(document, delta_ops(delta))
+
+        version = operations[-1][0]
+        # update() so compaction doesn't bump updated_at
+        Note.objects.filter(pk=note_id).update(content_delta={"ops": document}, snapshot_version=version)
+        NoteOperation.objects.filter(note_id=note_id, id__lte=version).delete()
+    return len(operations)
+
+
+class DeltaBatcher:
+    """
+    Coalesces the deltas this process receives for a note.
+
+    The first delta for a note opens a window of NOTE_DELTA_BATCH_WINDOW
+    seconds; everything that arrives meanwhile is appended to the
+    operation log with a single INSERT and goes out as a single `batch`
+    frame with one `group_send`. The frame is serialized once here, so each
+    member just writes the pre-encoded text to its socket. Every message in
+    the frame keeps its own `clientId`, and the frame carries the log
+    version of its last operation. Once NOTE_SNAPSHOT_EVERY_OPS operations
+    have been logged for a note its log is compacted into the snapshot.
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+        self._buffers = {}
+        self._logged = {}
+        self._tasks = set()
+
+    def get_window(self):
+        if self.window is not None:
+            return self.window
+        return getattr(settings, 'NOTE_DELTA_BATCH_WINDOW', 0.02)
+
+    def add(self, channel_layer, note_id, message):
+        buffer = self._buffers.get(note_id)
+        if buffer is None:
+            buffer = self._buffers[note_id] = []
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.get_window(), self._spawn, self.flush(channel_layer, note_id))
+        buffer.append(message)
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        # Hold a reference so the task isn't garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, channel_layer, note_id):
+        messages = self._buffers.pop(note_id, None)
+        if not messages:
+            return
+
+        # Log first so the frame can carry the version of its operations
+        version = None
+        try:
+            version = await database_sync_to_async(
+                store_operations, thread_sensitive=False, executor=_log_executor)(note_id, messages)
+        except Exception as e:
+            logger.error(f"Failed to log {len(messages)} deltas for note {note_id}: {e}")
+
+        payload = json.dumps({
+            "type": "batch",
+            "messages": messages,
+            "version": version
+        })
+        try:
+            await channel_layer.group_send(
+                f'note_{note_id}',
+                {
+                    "type": "note_batch",
+                    "payload": payload
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to broadcast {len(messages)} deltas to note {note_id}: {e}")
+
+        if version is not None:
+            self._logged[note_id] = self._logged.get(note_id, 0) + len(messages)
+            if self._logged[note_id] >= getattr(settings, 'NOTE_SNAPSHOT_EVERY_OPS', 200):
+                self._logged.pop(note_id)
+                self._spawn(self.compact(note_id))
+
+    async def compact(self, note_id):
+        try:
+            await database_sync_to_async(compact_note_operations)(note_id)
+        except Exception as e:
+            logger.error(f"Failed to compact operations for note {note_id}: {e}")
+
+
+delta_batcher = DeltaBatcher()
@@ -0,0 +1,109 @@
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+# Leading byte of a compressed value. It never starts UTF-8 text, so plain
+# values are stored as their bare encoding and need no rewriting
+COMPRESSED_MARKER = b'\xff'
+
+
+def compress_text(text):
+    """
+    The stored form of `text`: zlib-compressed behind COMPRESSED_MARKER when
+    it's at least CONTENT_COMPRESSION_THRESHOLD bytes long and compressing
+    actually saves space, otherwise the UTF-8 encoding as is.
+    """
+    threshold = settings.CONTENT_COMPRESSION_THRESHOLD
+    data = text.encode()
+    if threshold is not None and len(data) >= threshold:
+        compressed = COMPRESSED_MARKER + zlib.compress(data, settings.CONTENT_COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return compressed
+    return data
+
+
+class CompressedText:
+    """A compressed value as read from the database, inflated by `str()` once."""
+    __slots__ = ('data', '_text')
+
+    def __init__(self, data):
+        self.data = data
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = zlib.decompress(self.data[len(COMPRESSED_MARKER):]).decode()
+        return self._text
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedText):
+            return self.data == other.data
+        if isinstance(other, str):
+            return str(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<CompressedText: {len(self.data)} bytes>"
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """
+    Inflates the loaded value the first time the attribute is read. Defining
+    __set__ makes this a data descriptor, so it sees every read rather than
+    only those of deferred values.
+    """
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = instance.__dict__[self.field.attname] = str(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    A text field stored as bytes, compressed when the value is at least
+    CONTENT_COMPRESSION_THRESHOLD bytes long (None turns compression off
+    for new writes; compressed values are still read).
+
+    Model instances only decompress when the attribute is first read, so
+    loading a row without touching the text costs no inflating. values()
+    and values_list() have no attribute to hook into and hand out
+    `CompressedText` for compressed rows: `str()` them.
+
+    The column holds opaque bytes, so SQL can't look into the text: filter
+    and search on columns derived from it instead.
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if value.startswith(COMPRESSED_MARKER):
+            return CompressedText(value)
+        return value.decode()
+
+    def to_python(self, value):
+        if isinstance(value, CompressedText):
+            return str(value)
+        if isinstance(value, (bytes, memoryview)):
+            return str(self.from_db_value(value, None, None))
+        return super().to_python(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        # A value loaded but never read goes back as it came
+        data = value.data if isinstance(value, CompressedText) else compress_text(str(value))
+        return connection.Database.Binary(data)
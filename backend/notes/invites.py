@@ -0,0 +1,115 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Invite
+
+ResolvedInvite = namedtuple('ResolvedInvite', ['token', 'note_id', 'expires_at'])
+
+
+def parse_token(token):
+    """The token as a UUID, or None if it can't be one."""
+    try:
+        return uuid.UUID(str(token))
+    except ValueError:
+        return None
+
+
+class InviteTokenCache:
+    """
+    Process-wide LRU of valid invite tokens mapped to their note and expiry.
+
+    Entries are dropped when the invite expires, after INVITE_TOKEN_CACHE_TTL
+    seconds (the bound on how long another process may keep serving a
+    deleted invite), or right away when this process sees the invite change
+    (see notes/signals.py). Unknown tokens are never cached, so creating an
+    invite needs no invalidation.
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize if maxsize is not None else settings.INVITE_TOKEN_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else settings.INVITE_TOKEN_CACHE_TTL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, token):
+        """Returns the `ResolvedInvite` for a valid, unexpired token, or None."""
+        token = parse_token(token)
+        if token is None:
+            return None
+
+        invite = self.get(token)
+        if invite is None:
+            invite = (Invite.objects
+                      .filter(token=token, expires_at__gt=timezone.now())
+                      .values_list('token', 'note_id', 'expires_at')
+                      .first())
+            if invite is None:
+                return None
+            invite = ResolvedInvite(*invite)
+            self.set(invite)
+        return invite
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                invite, cached_until = entry
+                if cached_until > time.monotonic() and invite.expires_at > timezone.now():
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return invite
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def set(self, invite):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[invite.token] = (invite, time.monotonic() + self.ttl)
+            self._entries.move_to_end(invite.token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        token = parse_token(token)
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+invite_cache = InviteTokenCache()
+
+
+def get_request_invite(request):
+    """
+    The invite behind the request's `?token=`, resolved once per request
+    and kept on it as `request.invite` (None for no or an invalid token).
+    """
+    if not hasattr(request, 'invite'):
+        token = request.query_params.get("token")
+        request.invite = invite_cache.resolve(token) if token else None
+    return request.invite
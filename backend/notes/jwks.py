@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+
+import httpx
+from django.conf import settings
+from jose import jwk
+from jose.exceptions import JWKError
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSKeyStore:
+    """
+    Process-wide cache of the Auth0 signing keys.
+
+    Each JWK is parsed into a ready-to-use verifier once and kept in memory
+    for `ttl` seconds. Once the keys go stale they are still served while a
+    background thread refetches them, so a slow or failing Auth0 endpoint
+    never sits on the request path. A `kid` that isn't in the cache triggers
+    a refetch, at most once every `min_refetch_interval` seconds; async
+    callers should use `aget_key` so that refetch doesn't block the loop.
+    """
+
+    def __init__(self, ttl=None, min_refetch_interval=None, timeout=None):
+        self.ttl = ttl if ttl is not None else getattr(
+            settings, 'JWKS_CACHE_TTL', 600)
+        self.min_refetch_interval = min_refetch_interval if min_refetch_interval is not None else getattr(
+            settings, 'JWKS_MIN_REFETCH_INTERVAL', 30)
+        self.timeout = timeout if timeout is not None else getattr(
+            settings, 'JWKS_FETCH_TIMEOUT', 5)
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._async_fetch_lock = asyncio.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @property
+    def url(self):
+        return f"https://{settings.AUTH0_DOMAIN}/.well-known/jwks.json"
+
+    def get_key(self, kid):
+        """Returns the verifier for `kid`, or None if Auth0 doesn't know it."""
+        key = self._cached_key(kid)
+        if key is not None:
+            return key
+
+        # Serialize refetches so a burst of misses results in a single
+        # request; everyone queued behind it re-checks the fresh keys.
+        with self._fetch_lock:
+            with self._lock:
+                key = self._keys.get(kid)
+                if key is not None or not self._can_refetch():
+                    return key
+                self._last_attempt = time.monotonic()
+            self.refresh()
+
+        with self._lock:
+            return self._keys.get(kid)
+
+    async def aget_key(self, kid):
+        """Same as `get_key`, but refetches without blocking the event loop."""
+        key = self._cached_key(kid)
+        if key is not None:
+            return key
+
+        async with self._async_fetch_lock:
+            with self._lock:
+                key = self._keys.get(kid)
+                if key is not None or not self._can_refetch():
+                    return key
+                self._last_attempt = time.monotonic()
+            await self.arefresh()
+
+        with self._lock:
+            return self._keys.get(kid)
+
+    def refresh(self):
+        """Fetches the JWKS document and replaces the cached keys."""
+        try:
+            with urlopen(self.url, timeout=self.timeout) as response:
+                jwks = json.loads(response.read())
+        except Exception as e:
+            with self._lock:
+                self.refresh_errors += 1
+            logger.error(f"Failed to fetch JWKS from {self.url}: {e}")
+            return False
+
+        self.load(jwks)
+        return True
+
+    async def arefresh(self):
+        """Async variant of `refresh` for the WebSocket handshake path."""
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.get(self.url)
+                response.raise_for_status()
+                jwks = response.json()
+        except Exception as e:
+            with self._lock:
+                self.refresh_errors += 1
+            logger.error(f"Failed to fetch JWKS from {self.url}: {e}")
+            return False
+
+        self.load(jwks)
+        return True
+
+    def load(self, jwks):
+        """Parses a JWKS document and swaps it into the cache."""
+        keys = {}
+        for key in jwks.get("keys", []):
+            try:
+                keys[key["kid"]] = jwk.construct({
+                    "kty": key["kty"],
+                    "kid": key["kid"],
+                    "use": key.get("use", "sig"),
+                    "n": key["n"],
+                    "e": key["e"]
+                }, algorithm=key.get("alg", "RS256"))
+            except (KeyError, JWKError) as e:
+                logger.warning(f"Skipping unusable JWK {key.get('kid')}: {e}")
+
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "keys": len(self._keys),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "age": time.monotonic() - self._fetched_at if self._fetched_at is not None else None,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+            self.hits = self.misses = self.refreshes = self.refresh_errors = 0
+
+    def _cached_key(self, kid):
+        with self._lock:
+            key = self._keys.get(kid)
+            if key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self._is_stale():
+                self._start_background_refresh()
+            return key
+
+    def _is_stale(self):
+        return self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl
+
+    def _can_refetch(self):
+        return self._last_attempt is None or time.monotonic() - self._last_attempt >= self.min_refetch_interval
+
+    def _start_background_refresh(self):
+        # Called with the lock held
+        if self._refreshing or not self._can_refetch():
+            return
+        self._refreshing = True
+        self._last_attempt = time.monotonic()
+        threading.Thread(target=self._background_refresh,
+                         name="jwks-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+jwks_store = JWKSKeyStore()
@@ -0,0 +1,75 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from notes.categorization import categorize_notes_in_batches
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = "Backfills AI-generated categories for existing notes in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help="Notes packed into a single model request.")
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Model requests in flight at once.")
+        parser.add_argument('--user', type=int,
+                            help="Only categorize notes owned by this user id.")
+        parser.add_argument('--all', action='store_true',
+                            help="Also re-categorize notes that already have an AI category.")
+        parser.add_argument('--checkpoint', default='.categorize_notes.checkpoint',
+                            help="File recording the last processed note id.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore the checkpoint and start from the first note.")
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint'])
+        last_id = 0
+        if options['restart']:
+            checkpoint.unlink(missing_ok=True)
+        elif checkpoint.exists():
+            last_id = int(checkpoint.read_text().strip() or 0)
+            self.stdout.write(f"Resuming after note {last_id}")
+
+        notes = Note.objects.filter(id__gt=last_id, user_updated_category__isnull=True)
+        if not options['all']:
+            notes = notes.filter(ai_generated_category__isnull=True)
+        if options['user']:
+            notes = notes.filter(user_id=options['user'])
+        notes = notes.order_by('id').only('id', 'user_id', 'user_updated_category', 'content')
+
+        started = time.monotonic()
+        processed = 0
+        unclassified = 0
+
+        def on_batch(batch, failed):
+            nonlocal processed, unclassified
+            processed += len(batch) - len(failed)
+            # The checkpoint never moves past a note still waiting for its
+            # category, so the next run picks it up again
+            if not unclassified:
+                done = batch[:batch.index(failed[0])] if failed else batch
+                if done:
+                    checkpoint.write_text(str(done[-1].id))
+            unclassified += len(failed)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{processed} notes categorized ({processed / elapsed:.1f} notes/s), last id {batch[-1].id}")
+
+        categorize_notes_in_batches(
+            notes.iterator(chunk_size=options['batch_size'] * options['concurrency'] * 2),
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            on_batch=on_batch,
+        )
+
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Categorized {processed} notes in {elapsed:.1f}s ({rate:.1f} notes/s)"))
+        if unclassified:
+            self.stdout.write(self.style.WARNING(
+                f"{unclassified} notes got no category and were left unchanged; "
+                f"run the command again to resume from the first of them"))
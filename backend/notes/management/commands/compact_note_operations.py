@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notes.deltas import compact_note_operations
+from notes.models import NoteOperation
+
+
+class Command(BaseCommand):
+    help = "Folds logged collaborative deltas into note snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle', type=int, default=60,
+                            help="Only compact notes whose newest operation is at least this many seconds old.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['idle'])
+        note_ids = (NoteOperation.objects
+                    .values_list('note_id', flat=True)
+                    .distinct()
+                    .exclude(note_id__in=NoteOperation.objects.filter(created_at__gt=cutoff).values('note_id')))
+
+        notes = folded = 0
+        for note_id in note_ids.iterator():
+            count = compact_note_operations(note_id)
+            if count:
+                notes += 1
+                folded += count
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {folded} operations into {notes} note snapshots"))
@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notes.outbox import dispatch_due_emails
+
+
+class Command(BaseCommand):
+    help = "Sends the invite and share emails waiting in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX.get('BATCH_SIZE', 50),
+                            help="Emails sent per provider connection.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running, checking for due emails every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=settings.EMAIL_OUTBOX.get('POLL_INTERVAL', 30))
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = dispatch_due_emails(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Sent {sent} emails, {failed} failed"))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
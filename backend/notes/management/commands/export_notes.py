@@ -0,0 +1,36 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.transfer import export_records, ndjson_chunks, zip_chunks
+
+
+class Command(BaseCommand):
+    help = "Exports a user's notes as NDJSON or a zip archive, streamed as they're read."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', type=int, help="Id of the user whose notes are exported.")
+        parser.add_argument('--output', default='-',
+                            help="File to write; '-' for standard output.")
+        parser.add_argument('--zip', action='store_true',
+                            help="Write a zip archive instead of plain NDJSON.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        records = export_records(user)
+        chunks = zip_chunks(records) if options['zip'] else ndjson_chunks(records)
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported notes of user {user.pk} to {options['output']}"))
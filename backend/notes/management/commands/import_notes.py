@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.transfer import ImportFormatError, import_notes, open_export
+
+
+class Command(BaseCommand):
+    help = "Imports an NDJSON or zip export into a user's notes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', type=int, help="Id of the user receiving the notes.")
+        parser.add_argument('path', help="Export file, NDJSON or zip.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        with open(options['path'], 'rb') as file:
+            try:
+                imported = import_notes(user, open_export(file))
+            except ImportFormatError as e:
+                raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} notes for user {user.pk}"))
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notes.models import NoteTombstone
+
+
+class Command(BaseCommand):
+    help = "Deletes note tombstones older than NOTE_TOMBSTONE_RETENTION."
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.NOTE_TOMBSTONE_RETENTION)
+        deleted, _ = NoteTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} tombstones"))
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_category_cache_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_delta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='snapshot_version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='NoteOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(blank=True, max_length=64)),
+                ('delta', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operations', to='notes.note')),
+            ],
+        ),
+    ]
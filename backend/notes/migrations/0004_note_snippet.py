@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:01
+
+from bs4 import BeautifulSoup
+from django.db import migrations, models
+
+SNIPPET_LENGTH = 255
+
+
+def make_snippet(content):
+    # Frozen copy of notes.models.make_snippet as of this migration
+    soup = BeautifulSoup((content or "")[:SNIPPET_LENGTH * 8], "html.parser")
+    text = " ".join(soup.get_text(separator=" ").split())
+    return text[:SNIPPET_LENGTH]
+
+
+def fill_snippets(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    batch = []
+    for note in Note.objects.only('id', 'content').iterator(chunk_size=500):
+        note.snippet = make_snippet(note.content)
+        batch.append(note)
+        if len(batch) >= 500:
+            Note.objects.bulk_update(batch, ['snippet'])
+            batch = []
+    if batch:
+        Note.objects.bulk_update(batch, ['snippet'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0003_note_operations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='snippet',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(fill_snippets, migrations.RunPython.noop),
+    ]
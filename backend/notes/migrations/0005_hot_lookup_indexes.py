@@ -0,0 +1,50 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_shares(apps, schema_editor):
+    SharedNote = apps.get_model('notes', 'SharedNote')
+    keep_ids = (SharedNote.objects
+                .values('note_id', 'user_id')
+                .annotate(keep_id=Min('id'))
+                .values('keep_id'))
+    SharedNote.objects.exclude(id__in=keep_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0004_note_snippet'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['user', 'name'], name='category_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invite',
+            index=models.Index(fields=['token'], include=('expires_at', 'note'), name='invite_token_covering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', '-updated_at', '-id'], name='note_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(('ai_generated_category__isnull', True), ('user_updated_category__isnull', True)), fields=['id'], name='note_uncategorized_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='noteoperation',
+            index=models.Index(fields=['note', 'id'], name='noteoperation_note_id_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_shares, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='sharednote',
+            constraint=models.UniqueConstraint(fields=('note', 'user'), name='sharednote_note_user_unique'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:04
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+
+def make_search_vector(title, content):
+    # Frozen copy of notes.models.make_search_vector as of this migration
+    text = BeautifulSoup(content or "", "html.parser").get_text(separator=" ", strip=True)
+    return (SearchVector(models.Value(title or "", output_field=models.TextField()),
+                         weight='A', config=settings.SEARCH_CONFIG) +
+            SearchVector(models.Value(text, output_field=models.TextField()),
+                         weight='B', config=settings.SEARCH_CONFIG))
+
+
+def fill_search_vectors(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    batch = []
+    for note in Note.objects.only('id', 'title', 'content').iterator(chunk_size=500):
+        note.search_vector = make_search_vector(note.title, note.content)
+        batch.append(note)
+        if len(batch) >= 500:
+            Note.objects.bulk_update(batch, ['search_vector'])
+            batch = []
+    if batch:
+        Note.objects.bulk_update(batch, ['search_vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_hot_lookup_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Fill before indexing so the GIN index is built once
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='note',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='note_search_vector_idx'),
+        ),
+    ]
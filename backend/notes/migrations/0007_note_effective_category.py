@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_effective_categories(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    Note.objects.update(effective_category=Coalesce('user_updated_category', 'ai_generated_category'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0006_note_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='effective_category',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='effective_notes', to='notes.category'),
+        ),
+        migrations.RunPython(fill_effective_categories, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', 'effective_category'], name='note_user_category_idx'),
+        ),
+    ]
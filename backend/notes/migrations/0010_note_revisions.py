@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0009_outbox_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('is_keyframe', models.BooleanField(default=False)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('size', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='notes.note')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('is_keyframe', True)), fields=['note', 'number'], name='noterevision_keyframe_idx')],
+                'constraints': [models.UniqueConstraint(fields=('note', 'number'), name='noterevision_note_number_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:18
+
+import zlib
+
+import notes.fields
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copies of notes.fields.COMPRESSED_MARKER and compress_text as of
+# this migration; rows are read and written as raw bytes below, so the live
+# field never gets to compress or inflate them
+COMPRESSED_MARKER = b'\xff'
+BATCH_SIZE = 500
+
+
+def compress_text(data):
+    threshold = getattr(settings, 'CONTENT_COMPRESSION_THRESHOLD', 2048)
+    if threshold is not None and len(data) >= threshold:
+        compressed = COMPRESSED_MARKER + zlib.compress(data, getattr(settings, 'CONTENT_COMPRESSION_LEVEL', 6))
+        if len(compressed) < len(data):
+            return compressed
+    return data
+
+
+def rewrite_contents(Note, schema_editor, rewrite):
+    """Stores `rewrite(data)` for each note whose stored bytes it changes (returns None for the rest)."""
+    table = schema_editor.quote_name(Note._meta.db_table)
+    last_id = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(f"SELECT id, content FROM {table} WHERE id > %s ORDER BY id LIMIT %s",
+                           [last_id, BATCH_SIZE])
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            updates = []
+            for note_id, content in rows:
+                data = content.encode() if isinstance(content, str) else bytes(content or b"")
+                rewritten = rewrite(data)
+                if rewritten is not None:
+                    updates.append([schema_editor.connection.Database.Binary(rewritten), note_id])
+            if updates:
+                cursor.executemany(f"UPDATE {table} SET content = %s WHERE id = %s", updates)
+
+
+def content_to_bytes(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    if schema_editor.connection.vendor == 'postgresql':
+        # A plain ::bytea cast would read backslashes in the text as escapes
+        table = schema_editor.quote_name(Note._meta.db_table)
+        schema_editor.execute(f"ALTER TABLE {table} ALTER COLUMN content TYPE bytea "
+                              f"USING convert_to(content, 'UTF8')")
+        # Out-of-line values are compressed by the field already; TOAST
+        # compressing them again only costs CPU
+        schema_editor.execute(f"ALTER TABLE {table} ALTER COLUMN content SET STORAGE EXTERNAL")
+    else:
+        new_field = notes.fields.CompressedTextField(blank=True)
+        new_field.set_attributes_from_name('content')
+        schema_editor.alter_field(Note, Note._meta.get_field('content'), new_field)
+
+
+def content_to_text(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    if schema_editor.connection.vendor == 'postgresql':
+        table = schema_editor.quote_name(Note._meta.db_table)
+        schema_editor.execute(f"ALTER TABLE {table} ALTER COLUMN content SET STORAGE EXTENDED")
+        schema_editor.execute(f"ALTER TABLE {table} ALTER COLUMN content TYPE text "
+                              f"USING convert_from(content, 'UTF8')")
+    else:
+        old_field = Note._meta.get_field('content')
+        new_field = models.TextField(blank=True)
+        new_field.set_attributes_from_name('content')
+        schema_editor.alter_field(Note, old_field, new_field)
+
+
+def compress_contents(apps, schema_editor):
+    def compress(data):
+        if not data.startswith(COMPRESSED_MARKER):
+            compressed = compress_text(data)
+            if compressed.startswith(COMPRESSED_MARKER):
+                return compressed
+    rewrite_contents(apps.get_model('notes', 'Note'), schema_editor, compress)
+
+
+def inflate_contents(apps, schema_editor):
+    def inflate(data):
+        if data.startswith(COMPRESSED_MARKER):
+            return zlib.decompress(data[len(COMPRESSED_MARKER):])
+    rewrite_contents(apps.get_model('notes', 'Note'), schema_editor, inflate)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0010_note_revisions'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='note',
+                    name='content',
+                    field=notes.fields.CompressedTextField(blank=True),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(content_to_bytes, content_to_text),
+            ],
+        ),
+        # Existing large notes are compressed once here; new writes compress themselves
+        migrations.RunPython(compress_contents, inflate_contents),
+    ]
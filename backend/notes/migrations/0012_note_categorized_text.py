@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:20
+
+import notes.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0011_note_compressed_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='categorized_text',
+            field=notes.fields.CompressedTextField(blank=True, default='', editable=False),
+        ),
+    ]
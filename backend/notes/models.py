@@ -1,46 +1,263 @@
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 from django.contrib.auth.models import User
 import uuid
 from django.utils import timezone
 from datetime import timedelta
 
+from .fields import CompressedTextField
+
 
 from django.db import models
 from django.contrib.auth.models import User
 
 
+SNIPPET_LENGTH = 255
+
+
+def make_snippet(content):
+    """Plain-text preview of rich content (HTML), cut to SNIPPET_LENGTH."""
+    # Only the head of the document can end up in the snippet
+    soup = BeautifulSoup((content or "")[:SNIPPET_LENGTH * 8], "html.parser")
+    text = " ".join(soup.get_text(separator=" ").split())
+    return text[:SNIPPET_LENGTH]
+
+
+def make_search_vector(title, content):
+    """
+    tsvector expression for a note's search document: the title plus the
+    HTML-stripped content, with title matches weighted above body matches.
+    """
+    text = BeautifulSoup(content or "", "html.parser").get_text(separator=" ", strip=True)
+    return (SearchVector(models.Value(title or "", output_field=models.TextField()),
+                         weight='A', config=settings.SEARCH_CONFIG) +
+            SearchVector(models.Value(text, output_field=models.TextField()),
+                         weight='B', config=settings.SEARCH_CONFIG))
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="categories")
 
+    class Meta:
+        indexes = [
+            # Category lookups by name always happen within one user
+            models.Index(fields=['user', 'name'], name='category_user_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class Note(models.Model):
     title = models.CharField(max_length=255, blank=True, default="Untitled")
-    content = models.TextField(blank=True)
+    # Large documents are stored compressed and only inflated when read
+    content = CompressedTextField(blank=True)
     ai_generated_category = models.ForeignKey(
         Category, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_notes")
     user_updated_category = models.ForeignKey(
         Category, on_delete=models.SET_NULL, null=True, blank=True, related_name="user_notes")
+    # The user-picked category, else the AI one; kept in sync by save() and
+    # the Category pre_delete signal so filtering and counting need one join
+    effective_category = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name="effective_notes")
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="notes")
+    # Plain text the AI category was assigned for; later edits are measured
+    # against it to decide whether the note needs classifying again
+    categorized_text = CompressedTextField(blank=True, default="", editable=False)
+    # Plain-text preview for note lists, so they never need `content`
+    snippet = models.CharField(max_length=SNIPPET_LENGTH, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Collaborative snapshot: Quill delta document with every operation up to
+    # `snapshot_version` folded in (see notes/deltas.py)
+    content_delta = models.JSONField(null=True, blank=True)
+    snapshot_version = models.BigIntegerField(default=0)
+    # Full-text search document, only rebuilt when the title or content changes
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # A user's notes, most recently updated first (list pagination)
+            models.Index(fields=['user', '-updated_at', '-id'], name='note_user_recent_idx'),
+            # Notes still waiting for a category (categorize_notes backfill)
+            models.Index(fields=['id'], name='note_uncategorized_idx',
+                         condition=models.Q(ai_generated_category__isnull=True,
+                                            user_updated_category__isnull=True)),
+            GinIndex(fields=['search_vector'], name='note_search_vector_idx'),
+            # Category filters and per-category counts within a user's notes
+            models.Index(fields=['user', 'effective_category'], name='note_user_category_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded text and category so saves can tell whether they changed
+        instance._loaded_text = (instance.__dict__.get('title'), instance.__dict__.get('content'))
+        instance._loaded_category_id = instance.__dict__.get('effective_category_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        extra_fields = set()
+        if update_fields is None or {'user_updated_category', 'ai_generated_category'} & set(update_fields):
+            self.set_effective_category()
+            extra_fields.add('effective_category')
+        if update_fields is None or 'content' in update_fields:
+            self.snippet = make_snippet(self.content)
+            extra_fields.add('snippet')
+        if update_fields is None or {'title', 'content'} & set(update_fields):
+            text = (self.title, self.content)
+            if text != getattr(self, '_loaded_text', None):
+                self.search_vector = make_search_vector(*text)
+                extra_fields.add('search_vector')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *extra_fields}
+        super().save(*args, **kwargs)
+        # post_save has compared it already
+        self._loaded_category_id = self.effective_category_id
+
+        if 'search_vector' in extra_fields:
+            # The database computed the vector; reload it only if it's read
+            del self.search_vector
+            self._loaded_text = (self.title, self.content)
+
+    def category_changed(self):
+        """Whether the effective category differs from the one last loaded or saved."""
+        return self.effective_category_id != getattr(self, '_loaded_category_id', None)
+
+    def set_effective_category(self):
+        self.effective_category_id = self.user_updated_category_id or self.ai_generated_category_id
+
+    def fill_derived_fields(self):
+        """Sets what save() derives, for notes written with bulk_create or bulk_update."""
+        self.set_effective_category()
+        self.snippet = make_snippet(self.content)
+        self.search_vector = make_search_vector(self.title, self.content)
 
     def is_owner(self, user):
-        return self.user == user
+        # Compare ids so the owner row is never fetched
+        return self.user_id is not None and self.user_id == getattr(user, 'pk', None)
 
     @property
     def category(self):
-        return self.user_updated_category.name if self.user_updated_category else self.ai_generated_category.name if self.ai_generated_category else None
+        return self.effective_category.name if self.effective_category else None
 
     def __str__(self):
         return self.title
 
 
+class CategoryCacheEntry(models.Model):
+    """
+    Remembers which category a piece of note text was classified into, so
+    unchanged content never goes back to the model.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="category_cache")
+    content_hash = models.CharField(max_length=64)
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="cache_entries")
+    last_used_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'content_hash')
+        indexes = [
+            models.Index(fields=['user', 'last_used_at']),
+        ]
+
+
+class NoteRevision(models.Model):
+    """
+    One saved version of a note. `data` is zlib-compressed: the full
+    content for keyframes, otherwise a delta against the previous revision
+    (see notes/revisions.py).
+    """
+    note = models.ForeignKey(
+        Note, on_delete=models.CASCADE, related_name="revisions")
+    number = models.PositiveIntegerField()
+    is_keyframe = models.BooleanField(default=False)
+    title = models.CharField(max_length=255, blank=True)
+    size = models.PositiveIntegerField()  # length of the content
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'number'], name='noterevision_note_number_unique'),
+        ]
+        indexes = [
+            # Latest keyframe at or before a revision
+            models.Index(fields=['note', 'number'], name='noterevision_keyframe_idx',
+                         condition=models.Q(is_keyframe=True)),
+        ]
+
+
+class NoteOperation(models.Model):
+    """A delta broadcast to a note's collaborators; the id is its version."""
+    note = models.ForeignKey(
+        Note, on_delete=models.CASCADE, related_name="operations")
+    client_id = models.CharField(max_length=64, blank=True)
+    delta = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Tail of a note's log after its snapshot version
+            models.Index(fields=['note', 'id'], name='noteoperation_note_id_idx'),
+        ]
+
+
+class NoteTombstone(models.Model):
+    """
+    Records that a note left a user's list (deleted, or no longer shared),
+    so `notes/sync/` can report it. Plain ids, so tombstones outlive the
+    rows they refer to.
+    """
+    note_id = models.BigIntegerField()
+    user_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'deleted_at'], name='notetombstone_user_idx'),
+        ]
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent. Rows are written in the same transaction as
+    whatever the email announces and are sent by the dispatcher in
+    notes/outbox.py, so no request waits on the mail provider.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipient = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The dispatcher only ever looks for pending emails that are due
+            models.Index(fields=['next_attempt_at'], name='outboxemail_due_idx',
+                         condition=models.Q(status='pending')),
+        ]
+
+
 def default_expiration():
     return timezone.now() + timedelta(days=7)
 
@@ -55,9 +272,21 @@ class Invite(models.Model):
         default=default_expiration)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Token checks also read expires_at and note_id: index-only scans
+            models.Index(fields=['token'], include=['expires_at', 'note'], name='invite_token_covering_idx'),
+        ]
+
 
 class SharedNote(models.Model):
     note = models.ForeignKey(
         Note, on_delete=models.CASCADE, related_name='shared_with')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also serves every (note_id, user) lookup
+            models.UniqueConstraint(fields=['note', 'user'], name='sharednote_note_user_unique'),
+        ]
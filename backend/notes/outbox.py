@@ -0,0 +1,182 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, message, recipient, from_email=None):
+    """
+    Adds an email to the outbox as part of the current transaction; the
+    dispatcher is woken once it commits.
+    """
+    email = OutboxEmail.objects.create(
+        subject=subject, body=message, recipient=recipient,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL)
+    transaction.on_commit(lambda: get_email_dispatcher().wake())
+    return email
+
+
+def queue_emails(messages):
+    """
+    `queue_email` for many `(subject, message, recipient)` tuples with one
+    INSERT and one wake-up.
+    """
+    emails = OutboxEmail.objects.bulk_create([
+        OutboxEmail(subject=subject, body=message, recipient=recipient,
+                    from_email=settings.DEFAULT_FROM_EMAIL)
+        for subject, message, recipient in messages
+    ])
+    if emails:
+        transaction.on_commit(lambda: get_email_dispatcher().wake())
+    return emails
+
+
+def retry_delay(attempts):
+    """Exponential backoff after `attempts` failed attempts."""
+    delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY))
+
+
+def claim_due_emails(batch_size):
+    """
+    Leases up to `batch_size` due emails to this dispatcher. Other
+    dispatchers skip the locked rows, and a lease that is never settled
+    runs out so the emails are picked up again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(OutboxEmail.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+                   .order_by('next_attempt_at')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        OutboxEmail.objects.filter(id__in=ids).update(
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE))
+    return list(OutboxEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def record_failure(email, error):
+    """Charges `email` a failed attempt: it's retried later, or given up on after the last one."""
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+        logger.error(f"Giving up on email {email.id} to {email.recipient}: {error}")
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+
+
+def send_emails(emails, connection=None):
+    """
+    Sends `emails` over a single provider connection and records the
+    outcome of each. Returns `(sent, failed)` counts.
+    """
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as e:
+        # The provider is unreachable: every email in the batch is charged
+        # the attempt, so the batch backs off and eventually fails instead
+        # of being claimed again as soon as its lease runs out
+        logger.error(f"Could not connect to the email provider: {e}")
+        for email in emails:
+            record_failure(email, e)
+        failed = len(emails)
+    else:
+        for email in emails:
+            try:
+                EmailMessage(email.subject, email.body, email.from_email, [email.recipient],
+                             connection=connection).send()
+            except Exception as e:
+                failed += 1
+                record_failure(email, e)
+                continue
+            sent += 1
+            email.attempts += 1
+            email.status = OutboxEmail.SENT
+            email.sent_at = timezone.now()
+        try:
+            connection.close()
+        except Exception as e:
+            # What was sent is sent; record it regardless
+            logger.warning(f"Closing the email provider connection failed: {e}")
+
+    OutboxEmail.objects.bulk_update(
+        emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    return sent, failed
+
+
+def dispatch_due_emails(batch_size=None):
+    """Sends due emails batch by batch until none are left. Returns `(sent, failed)`."""
+    batch_size = batch_size or settings.EMAIL_OUTBOX.get('BATCH_SIZE', 50)
+    sent = failed = 0
+    while True:
+        emails = claim_due_emails(batch_size)
+        if not emails:
+            return sent, failed
+        batch_sent, batch_failed = send_emails(emails)
+        sent += batch_sent
+        failed += batch_failed
+
+
+class InProcessEmailDispatcher:
+    """
+    Drains the outbox from a daemon thread in this process. The thread is
+    started by the first `wake()`, runs whenever a transaction queues
+    emails, and otherwise polls every `poll_interval` seconds for retries.
+    """
+
+    def __init__(self, batch_size=50, poll_interval=30):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="email-outbox", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _work(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                dispatch_due_emails(self.batch_size)
+            except Exception as e:
+                logger.error(f"Email outbox dispatch failed: {e}")
+            finally:
+                close_old_connections()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_email_dispatcher():
+    """Returns the process-wide dispatcher configured by EMAIL_OUTBOX."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            options = dict(getattr(settings, 'EMAIL_OUTBOX', {}))
+            backend = import_string(options.pop(
+                'BACKEND', 'notes.outbox.InProcessEmailDispatcher'))
+            _dispatcher = backend(**{key.lower(): value for key, value in options.items()})
+        return _dispatcher
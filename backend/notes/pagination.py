@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class NoteCursorPagination(CursorPagination):
+    """Most recently updated notes first; `id` breaks ties in `updated_at`."""
+    ordering = ('-updated_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class NoteSearchPagination(PageNumberPagination):
+    """Search results are ordered by rank, so they're paged by number."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class NoteRevisionPagination(CursorPagination):
+    """A note's history, newest revision first."""
+    ordering = '-number'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
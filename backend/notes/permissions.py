@@ -1,6 +1,5 @@
 from rest_framework.permissions import BasePermission
-from django.utils import timezone
-from .models import Invite
+from .invites import get_request_invite
 
 class TokenOrIsAuthenticated(BasePermission):
     """
@@ -13,19 +12,13 @@ class TokenOrIsAuthenticated(BasePermission):
         if request.user and request.user.is_authenticated:
             return True
 
-        # If a token is provided, check if it's a valid invite token
-        token = request.query_params.get("token")
-        if token:
-            try:
-                invite = Invite.objects.get(token=token, expires_at__gt=timezone.now())
-                request.invite = invite  # Attach the invite to the request for later use
-                return True
-            except Invite.DoesNotExist:
-                return False
-
-        # Deny access if neither authentication nor a valid token is present
-        return False
+        # If a token is provided, check if it's a valid invite token.
+        # Resolved once per request and kept as `request.invite`
+        return get_request_invite(request) is not None
 
     def has_object_permission(self, request, view, obj):
-        # If authenticated, or a valid token invite exists, allow access
-        return self.has_permission(request, view)
\ No newline at end of file
+        # If authenticated, or the invite is for this very note, allow access
+        if request.user and request.user.is_authenticated:
+            return True
+        invite = get_request_invite(request)
+        return invite is not None and invite.note_id == obj.pk
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+
+import redis.asyncio as redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BasePresence:
+    """
+    Tracks which sockets are connected to each note, across every worker.
+
+    Members are identified by their channel name and stay present for
+    `ttl` seconds after their last join/heartbeat, so a worker that dies
+    without running `disconnect` can't leave ghost users behind.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else settings.PRESENCE_TTL
+
+    async def join(self, note_id, member):
+        raise NotImplementedError
+
+    async def heartbeat(self, note_id, member):
+        return await self.join(note_id, member)
+
+    async def leave(self, note_id, member):
+        raise NotImplementedError
+
+    async def count(self, note_id):
+        raise NotImplementedError
+
+
+class InMemoryPresence(BasePresence):
+    """
+    Presence kept in a plain dict. Instances built with the same `store`
+    behave like workers sharing one Redis, which is what tests need.
+    """
+
+    def __init__(self, ttl=None, store=None):
+        super().__init__(ttl)
+        self.store = store if store is not None else {}
+
+    async def join(self, note_id, member):
+        self.store.setdefault(note_id, {})[member] = time.time() + self.ttl
+
+    async def leave(self, note_id, member):
+        self.store.get(note_id, {}).pop(member, None)
+
+    async def count(self, note_id):
+        members = self.store.get(note_id, {})
+        now = time.time()
+        for member in [member for member, expires_at in members.items() if expires_at <= now]:
+            del members[member]
+        return len(members)
+
+
+class RedisPresence(BasePresence):
+    """
+    One sorted set per note in the channel layer's Redis: members are
+    channel names scored by their expiry time. Every change is a single
+    MULTI/EXEC round trip, so concurrent workers never race.
+    """
+
+    def __init__(self, ttl=None, host=None, prefix="presence"):
+        super().__init__(ttl)
+        self.host = host or self.channel_layer_host()
+        self.prefix = prefix
+        self._client = None
+
+    @staticmethod
+    def channel_layer_host():
+        hosts = settings.CHANNEL_LAYERS['default'].get('CONFIG', {}).get('hosts') or [('localhost', 6379)]
+        return hosts[0]
+
+    @property
+    def client(self):
+        if self._client is None:
+            if isinstance(self.host, str):
+                self._client = redis.Redis.from_url(self.host)
+            elif isinstance(self.host, dict):
+                self._client = redis.Redis(**self.host)
+            else:
+                self._client = redis.Redis(host=self.host[0], port=int(self.host[1]))
+        return self._client
+
+    def key(self, note_id):
+        return f"{self.prefix}:note:{note_id}"
+
+    async def join(self, note_id, member):
+        key = self.key(note_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {member: time.time() + self.ttl})
+            pipe.expire(key, int(self.ttl) + 1)
+            await pipe.execute()
+
+    async def leave(self, note_id, member):
+        await self.client.zrem(self.key(note_id), member)
+
+    async def count(self, note_id):
+        key = self.key(note_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zcard(key)
+            _, count = await pipe.execute()
+        return count
+
+
+class PresenceBroadcaster:
+    """
+    Debounces `user_count_update` broadcasts per note: any number of joins,
+    leaves and heartbeats within PRESENCE_BROADCAST_DELAY seconds result
+    in one count lookup and one group_send. Heartbeat checks only broadcast
+    when the count differs from the last one this worker sent; joins and
+    leaves pass `force` because another worker may have sent a newer count.
+    """
+
+    def __init__(self, presence, delay=None):
+        self.presence = presence
+        self.delay = delay
+        self._scheduled = set()
+        self._last_counts = {}
+        self._tasks = set()
+
+    def get_delay(self):
+        if self.delay is not None:
+            return self.delay
+        return settings.PRESENCE_BROADCAST_DELAY
+
+    def schedule(self, channel_layer, note_id, force=False):
+        if force:
+            self._last_counts.pop(note_id, None)
+        if note_id in self._scheduled:
+            return
+        self._scheduled.add(note_id)
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.get_delay(), self._spawn, channel_layer, note_id)
+
+    def _spawn(self, channel_layer, note_id):
+        task = asyncio.ensure_future(self.broadcast(channel_layer, note_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def broadcast(self, channel_layer, note_id):
+        self._scheduled.discard(note_id)
+        try:
+            count = await self.presence.count(note_id)
+            if self._last_counts.get(note_id) == count:
+                return
+            self._last_counts[note_id] = count
+            if not count:
+                self._last_counts.pop(note_id)
+            await channel_layer.group_send(
+                f'note_{note_id}',
+                {
+                    'type': 'user_count_update',
+                    'count': count
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to broadcast presence for note {note_id}: {e}")
+
+
+def get_presence_backend():
+    options = dict(settings.PRESENCE)
+    backend = import_string(options.pop('BACKEND'))
+    return backend(**{key.lower(): value for key, value in options.items()})
+
+
+presence = get_presence_backend()
+presence_broadcaster = PresenceBroadcaster(presence)
@@ -0,0 +1,162 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db.models import Max, OuterRef, Q, Subquery
+
+from .models import Note, NoteRevision
+
+# Tags (or a trailing unclosed one), words and runs of whitespace, covering
+# every character: edits rarely split one of these
+TOKEN_RE = re.compile(r"<[^>]*>?|[^<\s]+|\s+")
+
+
+def make_delta(old, new):
+    """
+    Ops rebuilding `new` from `old`: `[start, end]` copies that slice of
+    `old`, a string is inserted as is. The common prefix and suffix are
+    cut first, so a typical local edit never reaches SequenceMatcher.
+    """
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-suffix - 1] == new[-suffix - 1]:
+        suffix += 1
+
+    ops = []
+    if prefix:
+        ops.append([0, prefix])
+
+    old_middle, new_middle = old[prefix:len(old) - suffix], new[prefix:len(new) - suffix]
+    a, b = TOKEN_RE.findall(old_middle), TOKEN_RE.findall(new_middle)
+    offsets = [prefix]
+    for token in a:
+        offsets.append(offsets[-1] + len(token))
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            _push_copy(ops, offsets[i1], offsets[i2])
+        elif j2 > j1:
+            _push_insert(ops, "".join(b[j1:j2]))
+
+    if suffix:
+        _push_copy(ops, len(old) - suffix, len(old))
+    return ops
+
+
+def _push_copy(ops, start, end):
+    if ops and isinstance(ops[-1], list) and ops[-1][1] == start:
+        ops[-1][1] = end
+    else:
+        ops.append([start, end])
+
+
+def _push_insert(ops, text):
+    if ops and isinstance(ops[-1], str):
+        ops[-1] += text
+    else:
+        ops.append(text)
+
+
+def apply_delta(old, ops):
+    return "".join(old[op[0]:op[1]] if isinstance(op, list) else op for op in ops)
+
+
+def encode(payload):
+    return zlib.compress(payload.encode(), settings.NOTE_REVISION_COMPRESSION_LEVEL)
+
+
+def decode(data):
+    return zlib.decompress(bytes(data)).decode()
+
+
+def record_revision(note, previous_content=None):
+    """
+    Appends the note's current title and content to its history. The
+    content is stored as a delta against `previous_content` (what the
+    latest revision holds), or as a full keyframe for the first revision,
+    when the previous content is unknown, or every
+    NOTE_REVISION_KEYFRAME_INTERVAL revisions.
+
+    Call it inside the transaction that saved the note, after locking the
+    note row (see `lock_stored_text`), so revision numbers never collide.
+    """
+    last_keyframe = (NoteRevision.objects
+                     .filter(note=OuterRef('note'), is_keyframe=True)
+                     .order_by('-number').values('number')[:1])
+    last = (NoteRevision.objects.filter(note=note)
+            .order_by('-number')
+            .annotate(keyframe=Subquery(last_keyframe))
+            .values_list('number', 'keyframe')
+            .first())
+    revision = build_revision(note, previous_content, last)
+    revision.save()
+    return revision
+
+
+def record_revisions(changes):
+    """
+    `record_revision` for many `(note, previous_content)` pairs, with one
+    query for where their histories stand and one insert.
+    """
+    heads = {note_id: (last, keyframe) for note_id, last, keyframe in
+             NoteRevision.objects
+             .filter(note__in=[note for note, _ in changes])
+             .values('note')
+             .annotate(last=Max('number'), last_keyframe=Max('number', filter=Q(is_keyframe=True)))
+             .values_list('note', 'last', 'last_keyframe')}
+    return NoteRevision.objects.bulk_create(
+        build_revision(note, previous_content, heads.get(note.id)) for note, previous_content in changes)
+
+
+def build_revision(note, previous_content, last):
+    """
+    The unsaved revision following `last`, the `(number, keyframe number)`
+    of the note's latest revision and keyframe (None for a new history).
+    """
+    number = last[0] + 1 if last else 1
+    keyframe = (last is None or last[1] is None or previous_content is None or
+                number - last[1] >= settings.NOTE_REVISION_KEYFRAME_INTERVAL)
+    if keyframe:
+        data = encode(note.content)
+    else:
+        data = encode(json.dumps(make_delta(previous_content, note.content), separators=(",", ":")))
+
+    return NoteRevision(note=note, number=number, is_keyframe=keyframe, title=note.title,
+                        size=len(note.content), data=data)
+
+
+def lock_stored_text(note):
+    """
+    Locks the note row until the end of the transaction and returns the
+    content it holds. `note`'s own copy is used unless the row changed
+    since it was loaded.
+    """
+    updated_at = Note.objects.select_for_update().values_list('updated_at', flat=True).get(pk=note.pk)
+    if updated_at == note.updated_at and 'content' in note.__dict__:
+        return note.content
+    return str(Note.objects.values_list('content', flat=True).get(pk=note.pk))
+
+
+def get_revision_content(note_id, number):
+    """
+    Rebuilds the content of revision `number`: its latest keyframe plus at
+    most NOTE_REVISION_KEYFRAME_INTERVAL - 1 deltas, read in one query.
+    Returns `(revision, content)`, or None if there's no such revision.
+    """
+    keyframe = (NoteRevision.objects
+                .filter(note_id=note_id, is_keyframe=True, number__lte=number)
+                .order_by('-number').values('number')[:1])
+    chain = list(NoteRevision.objects
+                 .filter(note_id=note_id, number__lte=number, number__gte=Subquery(keyframe))
+                 .order_by('number'))
+    if not chain or chain[-1].number != number:
+        return None
+
+    content = decode(chain[0].data)
+    for revision in chain[1:]:
+        content = apply_delta(content, json.loads(decode(revision.data)))
+    return chain[-1], content
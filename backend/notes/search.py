@@ -0,0 +1,30 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+
+TAG_RE = re.compile(r"<[^>]+>")
+
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+
+def set_headlines(notes, terms):
+    """
+    Sets `headline` on each of `notes` (loaded with their content): an
+    excerpt of the note's text with matches for the `terms` of a websearch
+    query wrapped in `<mark>`. The content column is compressed, so the
+    text is sent back to Postgres, which builds every headline of the page
+    in one query.
+    """
+    if not notes:
+        return
+    documents = [TAG_RE.sub(" ", note.content) for note in notes]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT ts_headline(%s::regconfig, document, websearch_to_tsquery(%s::regconfig, %s), %s) "
+            "FROM unnest(%s::text[]) WITH ORDINALITY AS documents(document, position) "
+            "ORDER BY position",
+            [settings.SEARCH_CONFIG, settings.SEARCH_CONFIG, terms, HEADLINE_OPTIONS, documents])
+        headlines = [headline for headline, in cursor.fetchall()]
+    for note, headline in zip(notes, headlines):
+        note.headline = headline
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Note, Category
+from .models import Note, NoteRevision, Category
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -8,6 +8,13 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
+class CategoryCountSerializer(CategorySerializer):
+    note_count = serializers.IntegerField(read_only=True)
+
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + ['note_count']
+
+
 class NoteSerializer(serializers.ModelSerializer):
     is_owner = serializers.SerializerMethodField()
     user_updated_category = CategorySerializer(read_only=True)
@@ -26,3 +33,32 @@ class NoteSerializer(serializers.ModelSerializer):
     def get_is_owner(self, obj):
         request = self.context.get('request')
         return obj.is_owner(request.user)
+
+
+class NoteListSerializer(serializers.ModelSerializer):
+    """Lightweight representation for note lists; `content` only comes with retrieve."""
+    is_owner = serializers.SerializerMethodField()
+    category = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Note
+        fields = ['id', 'title', 'snippet', 'category', 'is_owner', 'updated_at']
+
+    def get_is_owner(self, obj):
+        request = self.context.get('request')
+        return obj.is_owner(request.user)
+
+
+class NoteSearchSerializer(NoteListSerializer):
+    """A list entry plus its search rank and a highlighted excerpt (`<mark>` around matches)."""
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta(NoteListSerializer.Meta):
+        fields = NoteListSerializer.Meta.fields + ['rank', 'headline']
+
+
+class NoteRevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NoteRevision
+        fields = ['number', 'title', 'size', 'is_keyframe', 'created_at']
@@ -0,0 +1,144 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .access import invalidate_users_note_access
+from .models import Invite, Note, SharedNote
+from .outbox import queue_emails
+
+# Per-recipient statuses reported by `bulk_share`
+SHARED = 'shared'
+INVITED = 'invited'
+ALREADY_SHARED = 'already_shared'
+OWNER = 'owner'
+INVALID_EMAIL = 'invalid_email'
+UNRESOLVED_EMAIL = 'unresolved_email'
+NOTE_NOT_FOUND = 'note_not_found'
+
+
+def normalize_emails(emails):
+    """Valid and invalid addresses, deduplicated case-insensitively, in order."""
+    valid, invalid, seen = [], [], set()
+    for email in emails:
+        email = str(email or "").strip()
+        if email.lower() in seen:
+            continue
+        seen.add(email.lower())
+        try:
+            validate_email(email)
+        except ValidationError:
+            invalid.append(email)
+        else:
+            valid.append(email)
+    return valid, invalid
+
+
+def resolve_users(emails):
+    """
+    Maps each email (lowercased) to a user, matching addresses
+    case-insensitively and creating the missing ones. Takes the oldest
+    account when several share an address. An address whose placeholder
+    account couldn't be created is left out.
+    """
+    emails = {email.lower() for email in emails}
+
+    def lookup():
+        users = {}
+        for user in (User.objects.annotate(email_lower=Lower('email'))
+                     .filter(email_lower__in=emails).order_by('-id')):
+            users[user.email_lower] = user
+        return users
+
+    users = lookup()
+    missing = sorted(emails - users.keys())
+    if missing:
+        # username must be unique, so placeholder accounts use the address.
+        # One taken by an account with another email is skipped here
+        User.objects.bulk_create([User(username=email, email=email) for email in missing],
+                                 ignore_conflicts=True)
+        users = lookup()
+    return users
+
+
+def bulk_share(owner, note_ids, emails, invite=False):
+    """
+    Shares each of the owner's `note_ids` with every address in `emails`,
+    also creating guest invites when `invite` is set, and queues one email
+    per recipient. The number of queries doesn't depend on how many notes
+    or recipients there are. Returns one `{note_id, email, status}` entry
+    per note and address.
+    """
+    valid, invalid = normalize_emails(emails)
+    notes = {note.id: note for note in Note.objects.filter(user=owner, id__in=note_ids).only('id', 'title', 'user_id')}
+
+    report = []
+    for note_id in note_ids:
+        if note_id not in notes:
+            report.extend({"note_id": note_id, "email": email, "status": NOTE_NOT_FOUND} for email in valid)
+        report.extend({"note_id": note_id, "email": email, "status": INVALID_EMAIL} for email in invalid)
+    if not notes or not valid:
+        return report
+
+    with transaction.atomic():
+        users = resolve_users(valid)
+        existing = set(SharedNote.objects
+                       .filter(note_id__in=notes, user__in=users.values())
+                       .values_list('note_id', 'user_id'))
+
+        shares, invites, links = [], [], {}
+        for note_id in note_ids:
+            note = notes.get(note_id)
+            if note is None:
+                continue
+            for email in valid:
+                user = users.get(email.lower())
+                entry = {"note_id": note_id, "email": email}
+                report.append(entry)
+                if user is None:
+                    entry["status"] = UNRESOLVED_EMAIL
+                    continue
+                if user.id == note.user_id:
+                    entry["status"] = OWNER
+                    continue
+
+                already_shared = (note_id, user.id) in existing
+                if not already_shared:
+                    shares.append(SharedNote(note_id=note_id, user=user))
+                if invite:
+                    token = uuid.uuid4()
+                    invites.append(Invite(note_id=note_id, email=email, token=token))
+                    link = f"{settings.FRONTEND_URL}/note/{note_id}/?token={token}"
+                    entry["status"] = INVITED
+                elif already_shared:
+                    entry["status"] = ALREADY_SHARED
+                    continue
+                else:
+                    link = f"{settings.FRONTEND_URL}/note/{note_id}"
+                    entry["status"] = SHARED
+                links.setdefault(email, []).append((note.title, link))
+
+        # A share that appeared since the lookup is left as it is
+        SharedNote.objects.bulk_create(shares, ignore_conflicts=True)
+        Invite.objects.bulk_create(invites)
+        queue_emails(share_email(email, note_links, invite) for email, note_links in links.items())
+
+    # bulk_create sends no post_save, so drop cached denials here
+    invalidate_users_note_access([(share.note_id, share.user_id) for share in shares])
+    return report
+
+
+def share_email(email, note_links, invite):
+    """`(subject, message, recipient)` announcing `note_links` to `email`."""
+    if invite:
+        subject = "You've been invited to collaborate on a note!"
+        intro = "You've been invited to collaborate on these notes. Access them using these links:"
+    else:
+        subject = "A note has been shared with you!"
+        intro = "These notes have been shared with you. Access them here:"
+    lines = "\n".join(f"- '{title}': {link}" for title, link in note_links)
+    return subject, f"Hello,\n\n{intro}\n{lines}\n\nBest regards,\nYour Team", email
@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .access import invalidate_note_access, invalidate_users_note_access
+from .caching import invalidate_categories, invalidate_notes
+from .invites import invite_cache
+from .models import Category, Invite, Note, NoteTombstone, SharedNote
+from .tokens import token_cache
+
+# Tombstones gathered by `batched_deletions`, when one is active
+_pending_tombstones = ContextVar('pending_tombstones', default=None)
+
+
+@contextmanager
+def batched_deletions():
+    """
+    Gathers the tombstones and access cache invalidations that the delete
+    signals below produce inside the block, and writes them all at once
+    when it completes, so deleting many notes doesn't insert row by row.
+    """
+    tombstones = []
+    reset = _pending_tombstones.set(tombstones)
+    try:
+        yield
+    finally:
+        _pending_tombstones.reset(reset)
+    NoteTombstone.objects.bulk_create(tombstones)
+    invalidate_users_note_access([(tombstone.note_id, tombstone.user_id) for tombstone in tombstones])
+
+
+def add_tombstone(note_id, user_id):
+    pending = _pending_tombstones.get()
+    if pending is None:
+        invalidate_note_access(note_id, user_id=user_id)
+        NoteTombstone.objects.create(note_id=note_id, user_id=user_id)
+    else:
+        pending.append(NoteTombstone(note_id=note_id, user_id=user_id))
+
+
+@receiver(post_save, sender=SharedNote)
+def shared_note_changed(sender, instance, **kwargs):
+    invalidate_note_access(instance.note_id, user_id=instance.user_id)
+
+
+@receiver(post_delete, sender=SharedNote)
+def shared_note_deleted(sender, instance, **kwargs):
+    # Also runs for every share cascaded from a deleted note
+    add_tombstone(instance.note_id, instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Invite)
+def invite_changed(sender, instance, **kwargs):
+    invalidate_note_access(instance.note_id, token=instance.token)
+    invite_cache.invalidate(instance.token)
+
+
+@receiver(post_save, sender=Note)
+def note_saved(sender, instance, created, **kwargs):
+    # The owner's category counts only move with a new note or category
+    counts_changed = created or instance.category_changed()
+    invalidate_notes([instance.id], [instance.user_id] if counts_changed else [])
+
+
+@receiver(post_delete, sender=Note)
+def note_deleted(sender, instance, **kwargs):
+    # Shares and invites are cascaded with their own post_delete signals
+    add_tombstone(instance.id, instance.user_id)
+    invalidate_notes([instance.id], [instance.user_id])
+
+
+def notes_in_category(category):
+    return list(Note.objects
+                .filter(Q(user_updated_category=category) | Q(ai_generated_category=category))
+                .values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    invalidate_categories(instance.user_id)
+    if not created:
+        # Full notes show their categories' names
+        invalidate_notes(notes_in_category(instance), [instance.user_id])
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    invalidate_categories(instance.user_id)
+    invalidate_notes(notes_in_category(instance), [instance.user_id])
+    # Notes whose user-picked category goes away fall back to their AI one;
+    # SET_NULL on effective_category takes care of the rest
+    Note.objects.filter(user_updated_category=instance).update(effective_category=F('ai_generated_category'))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, **kwargs):
+    # Verified tokens stop authenticating a deactivated user right away,
+    # in this process; other workers' entries end with the token's `exp`
+    if not instance.is_active:
+        token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
@@ -0,0 +1,110 @@
+import os
+import time
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.auth.models import User
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase, override_settings
+from jose import jwk, jwt
+
+from app.middleware import JWTAuthMiddleware
+from notes import routing
+from notes.jwks import jwks_store
+from notes.models import Note
+from notes.presence import InMemoryPresence, PresenceBroadcaster
+from notes.tokens import token_cache
+
+# Local stand-ins for Redis and Auth0, so the suite needs neither
+test_settings = override_settings(
+    ALGORITHMS=['RS256'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+
+# Wall-clock measurements at production-like sizes: too slow and too
+# dependent on the machine for every run, so opted into with NOTES_BENCHMARKS=1
+benchmark = skipUnless(os.environ.get('NOTES_BENCHMARKS'), "NOTES_BENCHMARKS is not set")
+
+KID = 'test-key'
+_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+# Parsed once: loading the PEM costs far more than signing with it
+SIGNING_KEY = jwk.construct(_private_key.private_bytes(
+    serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()), 'RS256')
+
+
+def jwks_document(kid=KID):
+    """The JWKS document Auth0 would serve for the test signing key."""
+    key = SIGNING_KEY.public_key().to_dict()
+    key.update(kid=kid, use='sig')
+    return {'keys': [key]}
+
+
+def make_token(sub, expires_in=300, kid=KID):
+    return jwt.encode({
+        'sub': sub,
+        'aud': settings.API_IDENTIFIER,
+        'iss': f'https://{settings.AUTH0_DOMAIN}/',
+        'exp': int(time.time()) + expires_in,
+    }, SIGNING_KEY, algorithm='RS256', headers={'kid': kid})
+
+
+def stub_model_client(reply):
+    """
+    Stands in for the OpenAI client: each chat completion is answered with
+    `reply(prompt)`, or fails if that is an exception.
+    """
+    def create(messages, **kwargs):
+        content = reply(messages[-1]['content'])
+        if isinstance(content, Exception):
+            raise content
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=mock.Mock(side_effect=create))))
+
+
+def make_user(name):
+    return User.objects.create(username=f'auth0|{name}', email=f'{name}@example.com')
+
+
+def patch_presence(test, presence=None):
+    presence = presence or InMemoryPresence()
+    for target, value in [('notes.consumers.presence', presence),
+                          ('notes.consumers.presence_broadcaster', PresenceBroadcaster(presence, delay=0.01))]:
+        patcher = mock.patch(target, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class RealtimeTestCase(TransactionTestCase):
+    """WebSocket tests against the full middleware and routing stack."""
+
+    def setUp(self):
+        jwks_store.load(jwks_document())
+        token_cache.clear()
+        self.addCleanup(jwks_store.clear)
+        self.addCleanup(token_cache.clear)
+        patch_presence(self)
+
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, title="Doc", content="<p>Hello</p>")
+        self.token = make_token('auth0|owner')
+        self.application = JWTAuthMiddleware(URLRouter(routing.websocket_urlpatterns))
+
+    async def connect(self, token=None):
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/notes/{self.note.id}/?authToken={token or self.token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator, frame_type, timeout=2):
+        """The next frame of `frame_type`, skipping any others."""
+        while True:
+            frame = await communicator.receive_json_from(timeout=timeout)
+            if frame['type'] == frame_type:
+                return frame
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from notes import access
+from notes.access import check_note_access, visible_to
+from notes.invites import invite_cache
+from notes.models import Invite, Note, SharedNote
+
+from .helpers import RealtimeTestCase, make_user, test_settings
+
+
+@test_settings
+class NoteAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        invite_cache.clear()
+        self.addCleanup(invite_cache.clear)
+        self.owner = make_user('owner')
+        self.guest = make_user('guest')
+        self.note = Note.objects.create(user=self.owner, title="Doc")
+
+    def test_one_query_then_served_from_the_cache(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(check_note_access(self.note.id, self.owner))
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                self.assertTrue(check_note_access(self.note.id, self.owner))
+
+    def test_denials_are_cached_too(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(check_note_access(self.note.id, self.guest))
+        with self.assertNumQueries(0):
+            self.assertFalse(check_note_access(self.note.id, self.guest))
+            self.assertFalse(check_note_access(self.note.id, AnonymousUser()))
+
+    def test_sharing_and_unsharing_invalidate(self):
+        self.assertFalse(check_note_access(self.note.id, self.guest))
+        share = SharedNote.objects.create(note=self.note, user=self.guest)
+        with self.assertNumQueries(1):
+            self.assertTrue(check_note_access(self.note.id, self.guest))
+
+        share.delete()
+        self.assertFalse(check_note_access(self.note.id, self.guest))
+
+    def test_invite_token_grants_access_until_deleted(self):
+        invite = Invite.objects.create(note=self.note, email='guest@example.com')
+        other = Note.objects.create(user=self.owner, title="Other")
+
+        with self.assertNumQueries(1):
+            self.assertTrue(check_note_access(self.note.id, token=invite.token))
+        with self.assertNumQueries(0):
+            self.assertTrue(check_note_access(self.note.id, token=invite.token))
+        # The token is scoped to its own note
+        self.assertFalse(check_note_access(other.id, token=invite.token))
+
+        invite.delete()
+        self.assertFalse(check_note_access(self.note.id, token=invite.token))
+
+    def test_expired_invite_is_denied(self):
+        invite = Invite.objects.create(note=self.note, email='guest@example.com',
+                                       expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertFalse(check_note_access(self.note.id, token=invite.token))
+
+    def test_shares_are_read_once_per_query(self):
+        shared = Note.objects.create(user=make_user('bob'), title="Bob's")
+        SharedNote.objects.create(note=shared, user=self.guest)
+        visible = Note.objects.filter(visible_to(self.guest))
+        self.assertEqual(list(visible), [shared])
+
+        plan = visible.explain()
+        # Not probed again with each note's id, as a correlated EXISTS would be
+        if connection.vendor == 'postgresql':
+            self.assertIn('hashed SubPlan', plan)
+            self.assertNotIn('notes_note.id', plan)
+        else:
+            self.assertNotIn('CORRELATED', plan)
+            self.assertIn('LIST SUBQUERY', plan)
+
+
+@test_settings
+class HandshakeAccessTests(RealtimeTestCase):
+    HANDSHAKES = 100
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        invite_cache.clear()
+        self.addCleanup(invite_cache.clear)
+
+    def test_repeat_handshakes_check_access_once(self):
+        async def scenario():
+            started = time.monotonic()
+            for _ in range(self.HANDSHAKES):
+                communicator = await self.connect()
+                await communicator.disconnect()
+            return self.HANDSHAKES / (time.monotonic() - started)
+
+        with mock.patch('notes.access.has_note_access', wraps=access.has_note_access) as has_note_access:
+            rate = asyncio.run(scenario())
+
+        self.assertEqual(has_note_access.call_count, 1)
+        self.assertGreater(rate, 20)
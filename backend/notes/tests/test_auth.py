@@ -0,0 +1,290 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from jose import jwt
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIRequestFactory
+
+from app.middleware import JWTAuthMiddleware
+from notes import routing
+from notes.authentication import Auth0JSONWebTokenAuthentication
+from notes.jwks import JWKSKeyStore, jwks_store
+from notes.models import Note
+from notes.presence import InMemoryPresence, PresenceBroadcaster
+from notes.tokens import VerifiedTokenCache, token_cache
+
+from .helpers import jwks_document, make_token, make_user, test_settings
+
+
+class JWKSKeyStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = JWKSKeyStore(ttl=600, min_refetch_interval=30)
+        self.fetches = 0
+
+        def refresh():
+            self.fetches += 1
+            self.store.load(jwks_document())
+            return True
+
+        async def arefresh():
+            self.fetches += 1
+            # An Auth0 round trip; other coroutines must keep running meanwhile
+            await asyncio.sleep(0.05)
+            self.store.load(jwks_document())
+            return True
+
+        self.store.refresh = refresh
+        self.store.arefresh = arefresh
+
+    def test_known_kid_is_served_from_memory(self):
+        self.assertIsNotNone(self.store.get_key('test-key'))
+        for _ in range(10):
+            self.assertIsNotNone(self.store.get_key('test-key'))
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(self.store.stats()['hits'], 10)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.get_key('test-key')
+        for _ in range(5):
+            self.assertIsNone(self.store.get_key('unknown'))
+        self.assertEqual(self.fetches, 1)
+
+        # Once the interval has passed an unknown kid may refetch again
+        self.store._last_attempt -= self.store.min_refetch_interval
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertEqual(self.fetches, 2)
+
+    def test_concurrent_async_misses_fetch_once(self):
+        async def lookups():
+            return await asyncio.gather(*(self.store.aget_key('test-key') for _ in range(50)))
+
+        keys = asyncio.run(lookups())
+        self.assertTrue(all(key is not None for key in keys))
+        self.assertEqual(self.fetches, 1)
+
+
+@test_settings
+class WebSocketHandshakeLoadTests(TransactionTestCase):
+    """
+    Hundreds of concurrent handshakes, each needing a JWKS fetch, signature
+    check and user lookup, while an existing connection keeps editing.
+    """
+
+    HANDSHAKES = 200
+
+    def setUp(self):
+        jwks_store.clear()
+        token_cache.clear()
+        self.addCleanup(jwks_store.clear)
+        self.addCleanup(token_cache.clear)
+        self.fetches = 0
+        self.fetch_released = None
+
+        async def held_arefresh():
+            # The Auth0 round trip only finishes once the test lets it
+            self.fetches += 1
+            await self.fetch_released.wait()
+            jwks_store.load(jwks_document())
+            return True
+
+        def blocking_refresh():
+            raise AssertionError("JWKS fetched synchronously")
+
+        presence = InMemoryPresence()
+        for target, value in [('notes.jwks.jwks_store.arefresh', held_arefresh),
+                              ('notes.jwks.jwks_store.refresh', blocking_refresh),
+                              ('notes.consumers.presence', presence),
+                              ('notes.consumers.presence_broadcaster', PresenceBroadcaster(presence))]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, title="Shared doc")
+        User.objects.bulk_create([User(username=f'auth0|guest{i}') for i in range(self.HANDSHAKES)])
+        self.application = JWTAuthMiddleware(URLRouter(routing.websocket_urlpatterns))
+
+    def communicator(self, token):
+        return WebsocketCommunicator(self.application, f'/ws/notes/{self.note.id}/?authToken={token}')
+
+    def test_handshakes_do_not_stall_existing_connections(self):
+        owner_token = make_token('auth0|owner')
+        guest_tokens = [make_token(f'auth0|guest{i}') for i in range(self.HANDSHAKES)]
+        decode_threads = []
+        verify = jwt.decode
+
+        def decode(*args, **kwargs):
+            decode_threads.append(threading.get_ident())
+            return verify(*args, **kwargs)
+
+        async def delta(editor, watcher):
+            await editor.send_json_to({"delta": {"ops": [{"insert": "x"}]}, "clientId": "editor"})
+            while (await watcher.receive_json_from(timeout=5))['type'] != 'batch':
+                pass
+
+        async def scenario():
+            self.fetch_released = asyncio.Event()
+            # The editors connect while the JWKS fetch is let through; each
+            # communicator starts its handshake as soon as it's built
+            self.fetch_released.set()
+            editor = self.communicator(owner_token)
+            watcher = self.communicator(owner_token)
+            for communicator in (editor, watcher):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+                self.assertEqual((await communicator.receive_json_from())['type'], 'sync')
+
+            # A new signing key: every guest handshake needs the next fetch
+            jwks_store.clear()
+            self.fetch_released.clear()
+            guests = [self.communicator(token) for token in guest_tokens]
+            storm = asyncio.ensure_future(asyncio.gather(*(guest.connect(timeout=30) for guest in guests)))
+            # Deltas still go out while every handshake waits on Auth0,
+            # which a fetch or verification blocking the loop would prevent
+            for _ in range(5):
+                await delta(editor, watcher)
+            self.assertFalse(storm.done())
+            self.fetch_released.set()
+            results = await storm
+
+            # None of the guests may open the note, but all were verified
+            self.assertEqual([connected for connected, _ in results], [False] * self.HANDSHAKES)
+            for communicator in (editor, watcher, *guests):
+                await communicator.disconnect()
+            return threading.get_ident()
+
+        with mock.patch('app.middleware.jwt.decode', decode):
+            loop_thread = asyncio.run(scenario())
+
+        # One fetch per key set, shared by all the concurrent handshakes
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(len(decode_threads), self.HANDSHAKES + 2)
+        self.assertNotIn(loop_thread, decode_threads)
+        self.assertEqual(token_cache.stats()['size'], self.HANDSHAKES + 1)
+
+
+def authenticate(token):
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+    user, _ = Auth0JSONWebTokenAuthentication().authenticate(request)
+    return user
+
+
+class VerifiedTokenCacheTests(SimpleTestCase):
+    def test_entries_expire_with_the_token(self):
+        cache = VerifiedTokenCache(maxsize=10)
+        user = User(pk=1, username='auth0|a')
+        cache.set('fresh', {'exp': time.time() + 60}, user)
+        cache.set('expired', {'exp': time.time() - 1}, user)
+        self.assertEqual(cache.get('fresh')[1].pk, 1)
+        self.assertIsNone(cache.get('expired'))
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = VerifiedTokenCache(maxsize=2)
+        claims = {'exp': time.time() + 60}
+        for pk, token in enumerate(['a', 'b', 'c']):
+            cache.get('a')
+            cache.set(token, claims, User(pk=pk))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_cached_users_are_copies(self):
+        cache = VerifiedTokenCache(maxsize=10)
+        cache.set('token', {'exp': time.time() + 60}, User(pk=1, username='auth0|a'))
+        cache.get('token')[1].username = 'changed'
+        self.assertEqual(cache.get('token')[1].username, 'auth0|a')
+
+
+@test_settings
+class TokenVerificationTests(TestCase):
+    def setUp(self):
+        jwks_store.load(jwks_document())
+        token_cache.clear()
+        self.addCleanup(jwks_store.clear)
+        self.addCleanup(token_cache.clear)
+        self.user = make_user('alice')
+        self.token = make_token('auth0|alice')
+
+    def test_repeat_requests_skip_verification_and_user_query(self):
+        self.assertEqual(authenticate(self.token).pk, self.user.pk)
+        with mock.patch('notes.authentication.jwt.decode') as decode, self.assertNumQueries(0):
+            for _ in range(5):
+                self.assertEqual(authenticate(self.token).pk, self.user.pk)
+        decode.assert_not_called()
+        self.assertEqual(token_cache.stats()['hits'], 5)
+
+    def test_websocket_handshake_shares_the_cache(self):
+        authenticate(self.token).pk
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen['user'] = scope['user']
+
+        with mock.patch('app.middleware.jwt.decode') as decode, self.assertNumQueries(0):
+            asyncio.run(JWTAuthMiddleware(inner)(
+                {'type': 'websocket', 'query_string': f'authToken={self.token}'.encode()}, None, None))
+        decode.assert_not_called()
+        self.assertEqual(seen['user'].pk, self.user.pk)
+
+    def test_deactivated_users_stop_authenticating(self):
+        authenticate(self.token).pk
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(token_cache.stats()['size'], 0)
+        with self.assertRaises(AuthenticationFailed):
+            authenticate(self.token).pk
+
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen['user'] = scope['user']
+
+        asyncio.run(JWTAuthMiddleware(inner)(
+            {'type': 'websocket', 'query_string': f'authToken={self.token}'.encode()}, None, None))
+        self.assertFalse(seen['user'].is_authenticated)
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_deleted_users_are_dropped_from_the_cache(self):
+        other = make_user('bob')
+        authenticate(self.token).pk
+        authenticate(make_token('auth0|bob')).pk
+        self.user.delete()
+        self.assertEqual(token_cache.stats()['size'], 1)
+        self.assertEqual(authenticate(make_token('auth0|bob')).pk, other.pk)
+
+
+@test_settings
+class ConcurrentTokenVerificationTests(TransactionTestCase):
+    def setUp(self):
+        jwks_store.load(jwks_document())
+        token_cache.clear()
+        self.addCleanup(jwks_store.clear)
+        self.addCleanup(token_cache.clear)
+
+    def test_concurrent_requests_resolve_their_own_users(self):
+        users = [make_user(f'user{i}') for i in range(8)]
+        tokens = [make_token(user.username) for user in users]
+
+        def request(i):
+            try:
+                return authenticate(tokens[i % len(tokens)]).pk
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            resolved = list(executor.map(request, range(400)))
+
+        self.assertEqual(resolved, [users[i % len(users)].pk for i in range(400)])
+        stats = token_cache.stats()
+        self.assertEqual(stats['size'], len(users))
+        self.assertEqual(stats['hits'] + stats['misses'], 400)
+        self.assertGreater(stats['hit_rate'], 0.9)
@@ -0,0 +1,189 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from notes.batch import apply_operations, notify_note_changes
+from notes.models import Category, Note, NoteRevision, SharedNote
+
+from .helpers import RealtimeTestCase, make_user, test_settings
+
+
+@test_settings
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('notes.batch.schedule_categorization')
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+        notifier = mock.patch('notes.batch.notify_note_changes')
+        self.notify = notifier.start()
+        self.addCleanup(notifier.stop)
+
+        self.owner = make_user('owner')
+        self.work = Category.objects.create(user=self.owner, name="Work")
+        self.notes = [Note.objects.create(user=self.owner, title=f"Note {i}", content=f"<p>{i}</p>")
+                      for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def apply(self, operations, user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return apply_operations(user or self.owner, operations)
+
+    def statuses(self, results):
+        return [(result['op'], result['status']) for result in results]
+
+    def test_each_operation_reports_its_status(self):
+        a, b, c, d = self.notes
+        results = self.apply([
+            {"op": "create", "title": "New", "content": "<p>Fresh</p>"},
+            {"op": "update", "id": a.id, "content": "<p>Edited</p>"},
+            {"op": "recategorize", "id": b.id, "category_id": self.work.id},
+            {"op": "delete", "id": c.id},
+        ])
+
+        self.assertEqual(self.statuses(results), [
+            ('create', 'created'), ('update', 'updated'), ('recategorize', 'updated'), ('delete', 'deleted')])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        created = Note.objects.get(pk=results[0]['id'])
+        self.assertEqual((created.title, created.content), ("New", "<p>Fresh</p>"))
+        self.assertEqual(Note.objects.get(pk=a.pk).content, "<p>Edited</p>")
+        self.assertEqual(Note.objects.get(pk=b.pk).effective_category, self.work)
+        self.assertFalse(Note.objects.filter(pk=c.pk).exists())
+        self.assertEqual(Note.objects.get(pk=d.pk).content, "<p>3</p>")
+        # New and edited content is versioned and queued for the AI
+        self.assertEqual(NoteRevision.objects.filter(note__in=[created, a]).count(), 2)
+        self.assertEqual(self.schedule.call_count, 2)
+
+    def test_failures_are_reported_and_skipped(self):
+        a, b = self.notes[:2]
+        other = Note.objects.create(user=make_user('bob'), title="Bob's")
+        theirs = Category.objects.create(user=other.user, name="Theirs")
+        results = self.apply([
+            {"op": "rename", "id": a.id},
+            {"op": "update", "id": "1"},
+            {"op": "update", "id": a.id, "title": 5},
+            {"op": "update", "id": a.id, "content": None},
+            {"op": "recategorize", "id": a.id},
+            {"op": "update", "id": other.id, "title": "Mine now"},
+            {"op": "delete", "id": 999},
+            {"op": "recategorize", "id": b.id, "category_id": theirs.id},
+            {"op": "update", "id": a.id, "title": "First"},
+            {"op": "delete", "id": a.id},
+            "not an object",
+        ])
+
+        self.assertEqual([result['status'] for result in results], [
+            'invalid', 'invalid', 'invalid', 'invalid', 'invalid', 'not_found', 'not_found',
+            'invalid', 'updated', 'duplicate', 'invalid'])
+        self.assertEqual(results[7]['message'], "Category not found.")
+        self.assertEqual(Note.objects.get(pk=a.pk).title, "First")
+        self.assertEqual(Note.objects.get(pk=other.pk).title, "Bob's")
+        self.assertIsNone(Note.objects.get(pk=b.pk).user_updated_category)
+
+    def test_shared_notes_can_be_changed(self):
+        note = self.notes[0]
+        reader = make_user('reader')
+        SharedNote.objects.create(note=note, user=reader)
+        results = self.apply([{"op": "update", "id": note.id, "title": "Shared edit"}], user=reader)
+        self.assertEqual(results[0]['status'], 'updated')
+        self.assertEqual(Note.objects.get(pk=note.pk).title, "Shared edit")
+
+    def test_picking_no_category_falls_back_to_the_ai_one(self):
+        ideas = Category.objects.create(user=self.owner, name="Ideas")
+        note = self.notes[0]
+        Note.objects.filter(pk=note.pk).update(user_updated_category=self.work, ai_generated_category=ideas,
+                                               effective_category=self.work)
+        self.apply([{"op": "recategorize", "id": note.id, "category_id": None}])
+        note.refresh_from_db()
+        self.assertIsNone(note.user_updated_category)
+        self.assertEqual(note.effective_category, ideas)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def operations(notes):
+            return [operation for note in notes for operation in [
+                {"op": "create", "title": f"From {note.id}"},
+                {"op": "update", "id": note.id, "content": f"<p>Changed {note.id}</p>"},
+            ]]
+
+        more = [Note.objects.create(user=self.owner, content=f"<p>{i}</p>") for i in range(8)]
+        with CaptureQueriesContext(connection) as few:
+            self.apply(operations(self.notes[:1]) + [
+                {"op": "recategorize", "id": self.notes[1].id, "category_id": self.work.id}])
+        with CaptureQueriesContext(connection) as many:
+            self.apply(operations(self.notes[2:] + more[:4]) + [
+                {"op": "recategorize", "id": note.id, "category_id": self.work.id} for note in more[4:]])
+        self.assertEqual(len(few), len(many))
+
+    def test_changed_notes_are_notified_once_committed(self):
+        a, b, c = self.notes[:3]
+        with self.captureOnCommitCallbacks() as callbacks:
+            apply_operations(self.owner, [
+                {"op": "update", "id": a.id, "title": "Renamed", "category_id": self.work.id},
+                {"op": "recategorize", "id": b.id, "category_id": self.work.id},
+                {"op": "delete", "id": c.id},
+                {"op": "delete", "id": 999},
+            ])
+        self.notify.assert_not_called()
+        for callback in callbacks:
+            callback()
+        self.notify.assert_called_once_with({a.id: ['title', 'category'], b.id: ['category'], c.id: None})
+
+    def test_cached_notes_are_invalidated(self):
+        note = self.notes[0]
+        self.assertEqual(self.client.get(f'/api/notes/{note.id}/').data['title'], "Note 0")
+        self.client.get('/api/notes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/notes/batch/', {"operations": [
+                {"op": "update", "id": note.id, "title": "Fresh title"},
+                {"op": "delete", "id": self.notes[1].id},
+            ]}, format='json')
+        self.assertEqual(self.statuses(response.data['results']), [('update', 'updated'), ('delete', 'deleted')])
+        self.assertEqual(self.client.get(f'/api/notes/{note.id}/').data['title'], "Fresh title")
+        titles = [entry['title'] for entry in self.client.get('/api/notes/').data['results']]
+        self.assertIn("Fresh title", titles)
+        self.assertNotIn("Note 1", titles)
+
+    def test_requests_are_validated(self):
+        for data in [{}, {"operations": []}, {"operations": {"op": "delete"}}]:
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post('/api/notes/batch/', data, format='json').status_code, 400)
+        with self.settings(NOTE_BATCH_MAX_OPERATIONS=1):
+            response = self.client.post('/api/notes/batch/', {"operations": [
+                {"op": "create"}, {"op": "create"}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Note.objects.filter(title="Untitled").exists())
+
+
+class NotifyTests(SimpleTestCase):
+    def test_failed_sends_are_logged_without_raising(self):
+        layer = mock.Mock(group_send=mock.AsyncMock(side_effect=[None, OSError("Redis down")]))
+        with mock.patch('notes.batch.get_channel_layer', return_value=layer), \
+                self.assertLogs('notes.batch', 'ERROR') as logs:
+            notify_note_changes({1: ['title'], 2: None})
+        self.assertEqual(layer.group_send.call_count, 2)
+        self.assertIn("1 of 2", logs.output[0])
+
+
+@test_settings
+class BatchNotificationTests(RealtimeTestCase):
+    def test_open_editors_get_a_note_frame(self):
+        async def scenario():
+            communicator = await self.connect()
+            await sync_to_async(apply_operations)(self.owner, [{"op": "update", "id": self.note.id, "title": "New"}])
+            changed = await self.receive(communicator, 'note')
+            await sync_to_async(apply_operations)(self.owner, [{"op": "delete", "id": self.note.id}])
+            deleted = await self.receive(communicator, 'note')
+            await communicator.disconnect()
+            return changed, deleted
+
+        with mock.patch('notes.batch.schedule_categorization'):
+            changed, deleted = asyncio.run(scenario())
+        self.assertEqual(changed, {"type": "note", "id": self.note.id, "changed": ["title"]})
+        self.assertEqual(deleted, {"type": "note", "id": self.note.id, "deleted": True})
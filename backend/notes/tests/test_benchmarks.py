@@ -0,0 +1,642 @@
+"""
+Timings behind the performance work, at sizes the regular tests avoid.
+Run them with
+
+    NOTES_BENCHMARKS=1 python manage.py test notes.tests.test_benchmarks
+
+Each prints its numbers and checks them against generous ceilings.
+"""
+import asyncio
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from app.middleware import JWTAuthMiddleware
+from notes import routing
+from notes.classifiers import LocalClassifier, LocalFirstClassifier
+from notes.deltas import compact_note_operations, seed_snapshot, store_operations
+from notes.jwks import jwks_store
+from notes.models import Category, Note, NoteRevision
+from notes.presence import InMemoryPresence, PresenceBroadcaster
+from notes.revisions import build_revision, encode, get_revision_content
+from notes.serializers import NoteSerializer
+from notes.transfer import export_records, ndjson_chunks
+from notes.tokens import token_cache
+
+from .helpers import RealtimeTestCase, benchmark, jwks_document, make_token, make_user, test_settings
+from .test_transfer import note_content, peak_memory
+
+TOPICS = {
+    "Cooking": "pasta tomato basil garlic oven bake bread dough recipe sauce onion butter flour simmer".split(),
+    "Travel": "flight hotel passport train airport luggage beach museum booking itinerary visa tickets tour".split(),
+    "Work": "meeting deadline report client budget roadmap quarterly review project slides hiring sprint".split(),
+    "Fitness": "run gym squat protein workout cardio stretch miles yoga weights recovery pace interval".split(),
+}
+FILLER = "the and a to of for with on in this that we it is".split()
+
+
+def synthetic_note(rng, topic):
+    """A note mostly about `topic`, with filler and a few words from other topics."""
+    others = [word for name, words in TOPICS.items() if name != topic for word in words]
+    words = rng.choices(TOPICS[topic], k=4) + rng.choices(FILLER, k=6) + rng.choices(others, k=3)
+    rng.shuffle(words)
+    return f"<p>{' '.join(words)}</p>"
+
+
+def report(name, **numbers):
+    values = ", ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                       for key, value in numbers.items())
+    sys.stderr.write(f"\n{name}: {values}\n")
+
+
+@benchmark
+@test_settings
+class HandshakeStormBenchmark(TransactionTestCase):
+    """Event loop lag and delta latency while 200 handshakes wait on a slow JWKS fetch."""
+
+    HANDSHAKES = 200
+
+    def setUp(self):
+        jwks_store.clear()
+        token_cache.clear()
+        self.addCleanup(jwks_store.clear)
+        self.addCleanup(token_cache.clear)
+
+        async def slow_arefresh():
+            await asyncio.sleep(0.2)
+            jwks_store.load(jwks_document())
+            return True
+
+        presence = InMemoryPresence()
+        for target, value in [('notes.jwks.jwks_store.arefresh', slow_arefresh),
+                              ('notes.consumers.presence', presence),
+                              ('notes.consumers.presence_broadcaster', PresenceBroadcaster(presence))]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, title="Shared doc")
+        User.objects.bulk_create([User(username=f'auth0|guest{i}') for i in range(self.HANDSHAKES)])
+        self.application = JWTAuthMiddleware(URLRouter(routing.websocket_urlpatterns))
+
+    def communicator(self, token):
+        return WebsocketCommunicator(self.application, f'/ws/notes/{self.note.id}/?authToken={token}')
+
+    def test_handshake_storm(self):
+        owner_token = make_token('auth0|owner')
+        guest_tokens = [make_token(f'auth0|guest{i}') for i in range(self.HANDSHAKES)]
+
+        async def scenario():
+            editor = self.communicator(owner_token)
+            watcher = self.communicator(owner_token)
+            for communicator in (editor, watcher):
+                await communicator.connect()
+                await communicator.receive_json_from()
+
+            lags = []
+
+            async def ticker(stop):
+                while not stop.is_set():
+                    started = time.monotonic()
+                    await asyncio.sleep(0.005)
+                    lags.append(time.monotonic() - started - 0.005)
+
+            async def delta_latency():
+                started = time.monotonic()
+                await editor.send_json_to({"delta": {"ops": [{"insert": "x"}]}, "clientId": "editor"})
+                while (await watcher.receive_json_from(timeout=5))['type'] != 'batch':
+                    pass
+                return time.monotonic() - started
+
+            baseline = [await delta_latency() for _ in range(5)]
+
+            # Garbage left by earlier tests would otherwise be collected in
+            # the window and show up as loop lag
+            gc.collect()
+            guests = [self.communicator(token) for token in guest_tokens]
+            stop = asyncio.Event()
+            ticking = asyncio.ensure_future(ticker(stop))
+            storm = asyncio.ensure_future(asyncio.gather(*(guest.connect(timeout=30) for guest in guests)))
+            during = [await delta_latency() for _ in range(5)]
+            await storm
+            stop.set()
+            await ticking
+            for communicator in (editor, watcher, *guests):
+                await communicator.disconnect()
+            return baseline, during, lags
+
+        baseline, during, lags = asyncio.run(scenario())
+
+        report("handshake storm", max_loop_lag=max(lags),
+               median_delta_latency=statistics.median(baseline),
+               median_delta_latency_during=statistics.median(during))
+        # A blocking JWKS fetch would stall the loop for 200ms at a time
+        self.assertLess(max(lags), 0.1)
+        self.assertLess(statistics.median(during), statistics.median(baseline) + 0.02)
+
+
+@benchmark
+@test_settings
+class ClassifierBenchmark(TestCase):
+    """
+    The local classifier against the remote path's answers. The remote
+    model's round trip can't be timed offline, so its labels are the topics
+    the notes were written about; what's measured is the local latency, how
+    often the local answer agrees, and how many notes still go remote.
+    """
+
+    TRAINING_NOTES = 400
+    HELD_OUT = 500
+
+    def test_local_latency_and_agreement(self):
+        rng = random.Random(7)
+        user = make_user('owner')
+        categories = {name: Category.objects.create(user=user, name=name) for name in TOPICS}
+        Note.objects.bulk_create(
+            Note(user=user, content=synthetic_note(rng, topic), ai_generated_category=categories[topic],
+                 effective_category=categories[topic])
+            for topic in rng.choices(list(TOPICS), k=self.TRAINING_NOTES))
+        held_out = [(topic, synthetic_note(rng, topic).removeprefix("<p>").removesuffix("</p>"))
+                    for topic in rng.choices(list(TOPICS), k=self.HELD_OUT)]
+
+        local = LocalClassifier()
+        local.get_model(user)
+        timings, answers = [], []
+        for topic, text in held_out:
+            started = time.perf_counter()
+            answers.append(local.classify(text, user))
+            timings.append(time.perf_counter() - started)
+
+        remote_labels = {text: topic for topic, text in held_out}
+        remote = mock.Mock()
+        remote.classify.side_effect = lambda text, user: (remote_labels[text], 1.0)
+        local_first = LocalFirstClassifier(local=local, remote=remote)
+        combined = [local_first.classify(text, user)[0] for _, text in held_out]
+
+        threshold = settings.LOCAL_CLASSIFIER_MIN_CONFIDENCE
+        confident = [(topic, name) for (topic, _), (name, confidence) in zip(held_out, answers)
+                     if confidence >= threshold]
+        agreement = sum(name == topic for (topic, _), (name, _) in zip(held_out, answers)) / len(held_out)
+        confident_agreement = sum(name == topic for topic, name in confident) / len(confident)
+        combined_agreement = sum(name == topic for (topic, _), name in zip(held_out, combined)) / len(held_out)
+        timings.sort()
+        report("local classifier", mean_ms=statistics.mean(timings) * 1000,
+               p99_ms=timings[int(len(timings) * 0.99)] * 1000,
+               agreement=agreement, confident_agreement=confident_agreement,
+               remote_share=remote.classify.call_count / len(held_out), local_first_agreement=combined_agreement)
+        self.assertLess(statistics.mean(timings), 0.001)
+        self.assertGreater(confident_agreement, 0.9)
+
+
+@benchmark
+@test_settings
+class DeltaThroughputBenchmark(RealtimeTestCase):
+    """Keystrokes per second from one editor to a watcher, with batching."""
+
+    KEYSTROKES = 5000
+
+    def test_throughput(self):
+        async def scenario():
+            editor = await self.connect()
+            watcher = await self.connect()
+            for communicator in (editor, watcher):
+                await self.receive(communicator, 'sync')
+
+            started = time.perf_counter()
+            for i in range(self.KEYSTROKES):
+                await editor.send_json_to({"delta": {"ops": [{"insert": "x"}]}, "clientId": "editor"})
+                if i % 50 == 49:
+                    await asyncio.sleep(0)
+            received = frames = 0
+            while received < self.KEYSTROKES:
+                received += len((await self.receive(watcher, 'batch', timeout=10))['messages'])
+                frames += 1
+            elapsed = time.perf_counter() - started
+            for communicator in (editor, watcher):
+                await communicator.disconnect()
+            return frames, elapsed
+
+        frames, elapsed = asyncio.run(scenario())
+
+        report("delta throughput", keystrokes_per_second=self.KEYSTROKES / elapsed,
+               keystrokes_per_frame=self.KEYSTROKES / frames)
+        self.assertGreater(self.KEYSTROKES / elapsed, 1000)
+
+
+@benchmark
+@test_settings
+class WriteAmplificationBenchmark(TestCase):
+    """
+    Bytes written for a burst of typing at the end of an 11KB note: the
+    delta log (one INSERT per batch window, folded into the snapshot every
+    NOTE_SNAPSHOT_EVERY_OPS operations) against a full-document PUT per
+    window. Only the content of a PUT is counted, not its revision or
+    search vector, so that side is a lower bound.
+    """
+
+    KEYSTROKES = 2000
+    WINDOW = 20
+
+    def test_delta_log_against_full_saves(self):
+        owner = make_user('owner')
+        text = " ".join(f"word{i}" for i in range(1500))
+        base = f"<p>{text}</p>"
+
+        logged = Note.objects.create(user=owner, title="Logged", content=base)
+        self.assertTrue(seed_snapshot(logged.id, {"ops": [{"insert": f"{text}\n"}]}, 0))
+        delta_bytes = 0
+        started = time.perf_counter()
+        for start in range(0, self.KEYSTROKES, self.WINDOW):
+            messages = [{"delta": {"ops": [{"retain": len(text) + i}, {"insert": "x"}]}, "clientId": "editor"}
+                        for i in range(start, start + self.WINDOW)]
+            store_operations(logged.id, messages)
+            delta_bytes += sum(len(json.dumps(message["delta"])) for message in messages)
+            if (start + self.WINDOW) % settings.NOTE_SNAPSHOT_EVERY_OPS == 0:
+                compact_note_operations(logged.id)
+                snapshot = Note.objects.values_list('content_delta', flat=True).get(pk=logged.id)
+                delta_bytes += len(json.dumps(snapshot))
+        delta_seconds = time.perf_counter() - started
+
+        saved = Note.objects.create(user=owner, title="Saved", content=base)
+        client = APIClient()
+        client.force_authenticate(owner)
+        put_bytes = 0
+        content = base
+        started = time.perf_counter()
+        for _ in range(0, self.KEYSTROKES, self.WINDOW):
+            content = content.removesuffix("</p>") + "x" * self.WINDOW + "</p>"
+            response = client.put(f'/api/notes/{saved.id}/', {'title': "Saved", 'content': content}, format='json')
+            self.assertEqual(response.status_code, 200)
+            put_bytes += len(content)
+        put_seconds = time.perf_counter() - started
+
+        windows = self.KEYSTROKES // self.WINDOW
+        report("write amplification", delta_kb=delta_bytes / 1024, put_kb=put_bytes / 1024,
+               ratio=put_bytes / delta_bytes, delta_ms_per_window=delta_seconds / windows * 1000,
+               put_ms_per_window=put_seconds / windows * 1000)
+        self.assertLess(delta_bytes, put_bytes / 2)
+
+
+@benchmark
+@test_settings
+class NoteListBenchmark(TestCase):
+    """
+    Walks every page of a 10k-note list through the cursor, and compares a
+    page of lean entries with the same notes serialized in full.
+    """
+
+    NOTES = 10_000
+
+    def test_pages_stay_flat(self):
+        owner = make_user('owner')
+        notes = [Note(user=owner, title=f"Note {i}",
+                      content="<p>" + " ".join(f"word{i}-{j}" for j in range(500)) + "</p>")
+                 for i in range(self.NOTES)]
+        for note in notes:
+            note.fill_derived_fields()
+        Note.objects.bulk_create(notes, batch_size=1000)
+        client = APIClient()
+        client.force_authenticate(owner)
+
+        timings, sizes = [], []
+        url, listed = '/api/notes/', []
+        while url:
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, 200)
+            sizes.append(len(response.content))
+            listed.extend(entry['id'] for entry in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(set(listed)), self.NOTES)
+
+        page = Note.objects.filter(pk__in=listed[:50])
+        full = len(json.dumps(NoteSerializer(page, many=True, context={
+            'request': SimpleNamespace(user=owner)}).data, default=str))
+        first, last = statistics.median(timings[:10]), statistics.median(timings[-10:])
+        report("note list", pages=len(timings), first_pages_ms=first * 1000, last_pages_ms=last * 1000,
+               max_ms=max(timings) * 1000, page_kb=statistics.median(sizes) / 1024, full_page_kb=full / 1024)
+        # Cursor pages cost the same however deep they are
+        self.assertLess(last, first * 2 + 0.005)
+        self.assertLess(statistics.median(timings), 0.1)
+
+
+@benchmark
+@skipUnless(connection.vendor == 'postgresql', 'Full-text search needs Postgres')
+@test_settings
+class SearchBenchmark(TestCase):
+    """Search request latency over 100k notes, for rare, common and multi-word queries."""
+
+    NOTES = 100_000
+    RUNS = 10
+
+    def test_search_latency(self):
+        rng = random.Random(15)
+        owner = make_user('owner')
+        vocabulary = [f"term{i}" for i in range(5000)]
+        rare = set(rng.sample(range(self.NOTES), 20))
+        for start in range(0, self.NOTES, 5000):
+            notes = []
+            for i in range(start, start + 5000):
+                words = rng.choices(vocabulary, k=100) + (["zeppelin"] if i in rare else [])
+                notes.append(Note(user=owner, title=f"Note {i}", content=f"<p>{' '.join(words)}</p>"))
+                notes[-1].fill_derived_fields()
+            Note.objects.bulk_create(notes)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE notes_note")
+        client = APIClient()
+        client.force_authenticate(owner)
+
+        latencies = {}
+        for name, terms in [("rare", "zeppelin"), ("common", "term42"), ("two_words", "term42 term43")]:
+            timings = []
+            for _ in range(self.RUNS):
+                started = time.perf_counter()
+                response = client.get('/api/notes/search/', {'q': terms})
+                timings.append(time.perf_counter() - started)
+                self.assertEqual(response.status_code, 200)
+            latencies[f"{name}_ms"] = statistics.median(timings) * 1000
+            latencies[f"{name}_matches"] = response.data['count']
+
+        report("search", notes=self.NOTES, **latencies)
+        self.assertEqual(latencies["rare_matches"], len(rare))
+        self.assertLess(latencies["rare_ms"], 50)
+        self.assertLess(latencies["common_ms"], 500)
+
+
+@benchmark
+@test_settings
+class BulkShareBenchmark(TestCase):
+    """
+    bulk_share requests of growing size, against sharing each note with
+    each recipient through share_note_with_user.
+    """
+
+    SIZES = [(1, 1), (10, 10), (50, 100)]
+
+    def setUp(self):
+        patcher = mock.patch('notes.outbox.get_email_dispatcher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def recipients(self, prefix, count):
+        # Existing accounts, which the single-share endpoint needs
+        emails = [f'{prefix}{i}@example.com' for i in range(count)]
+        User.objects.bulk_create([User(username=email, email=email) for email in emails])
+        return emails
+
+    def test_bulk_share_scaling(self):
+        results = {}
+        queries = []
+        for notes, recipients in self.SIZES:
+            note_ids = [Note.objects.create(user=self.owner).id for _ in range(notes)]
+            emails = self.recipients(f'bulk{notes}x{recipients}-', recipients)
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post('/api/notes/bulk_share/', {'note_ids': note_ids, 'emails': emails},
+                                            format='json')
+            elapsed = time.perf_counter() - started
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual({entry['status'] for entry in response.data['results']}, {'shared'})
+            results[f"bulk_{notes}x{recipients}_ms_per_share"] = elapsed * 1000 / (notes * recipients)
+            queries.append(len(captured))
+
+        note_ids = [Note.objects.create(user=self.owner).id for _ in range(10)]
+        emails = self.recipients('single-', 10)
+        started = time.perf_counter()
+        for note_id in note_ids:
+            for email in emails:
+                response = self.client.post(f'/api/notes/{note_id}/share_note_with_user/', {'email': email},
+                                            format='json')
+                self.assertEqual(response.status_code, 200)
+        single = time.perf_counter() - started
+
+        report("bulk share", **results, single_10x10_ms_per_share=single * 1000 / 100, bulk_queries=queries)
+        # sqlite splits the largest request's INSERTs by its variable limit
+        self.assertEqual(queries[0], queries[1])
+        self.assertLess(results["bulk_10x10_ms_per_share"], single * 1000 / 100 / 5)
+
+
+@benchmark
+@test_settings
+class RevisionHistoryBenchmark(TestCase):
+    """
+    Storage for 10k revisions of a 10KB note, each a one-word edit, against
+    keeping every version whole (plain and compressed), and the time to
+    rebuild sampled revisions from their keyframe and deltas.
+    """
+
+    REVISIONS = 10_000
+    SAMPLES = 100
+
+    def test_history_size_and_reconstruction(self):
+        rng = random.Random(21)
+        owner = make_user('owner')
+        words = [f"word{i}" for i in range(1500)]
+        note = Note.objects.create(user=owner, title="History", content=f"<p>{' '.join(words)}</p>")
+        sampled = set(rng.sample(range(1, self.REVISIONS + 1), self.SAMPLES)) | {self.REVISIONS}
+
+        expected, pending = {}, []
+        stored = whole = 0
+        previous, last = None, None
+        started = time.perf_counter()
+        for number in range(1, self.REVISIONS + 1):
+            words[rng.randrange(len(words))] = f"edit{number}"
+            note.content = f"<p>{' '.join(words)}</p>"
+            revision = build_revision(note, previous, last)
+            pending.append(revision)
+            stored += len(revision.data)
+            whole += len(note.content)
+            last = (number, number if revision.is_keyframe else last[1])
+            previous = note.content
+            if number in sampled:
+                expected[number] = note.content
+            if len(pending) == 500:
+                NoteRevision.objects.bulk_create(pending)
+                pending = []
+        recording = time.perf_counter() - started
+        # Outside the timing: what compressing every version whole would store
+        compressed = sum(len(encode(content)) for content in expected.values()) * self.REVISIONS // len(expected)
+
+        timings = []
+        for number in sorted(expected):
+            started = time.perf_counter()
+            _, content = get_revision_content(note.id, number)
+            timings.append(time.perf_counter() - started)
+            self.assertEqual(content, expected[number])
+
+        timings.sort()
+        report("revision history", revisions=self.REVISIONS, stored_kb=stored / 1024, whole_kb=whole / 1024,
+               compressed_whole_kb=compressed / 1024, record_ms_per_revision=recording / self.REVISIONS * 1000,
+               rebuild_median_ms=statistics.median(timings) * 1000, rebuild_max_ms=timings[-1] * 1000)
+        self.assertLess(stored, compressed / 2)
+        self.assertLess(timings[-1], 0.1)
+
+
+@benchmark
+@test_settings
+class ContentCompressionBenchmark(TestCase):
+    """
+    Bytes stored for note content with and without compression, and the
+    latency of saving and opening the largest notes either way.
+    """
+
+    SIZES = [500, 5_000, 50_000]
+    NOTES_PER_SIZE = 100
+
+    def content(self, rng, size):
+        paragraphs = []
+        while sum(len(paragraph) for paragraph in paragraphs) < size:
+            words = " ".join(rng.choices(TOPICS["Work"] + FILLER, k=40))
+            paragraphs.append(f"<p>{words} <strong>{rng.choice(TOPICS['Travel'])}</strong></p>")
+        return "".join(paragraphs)
+
+    def store(self, rng, name):
+        user = make_user(name)
+        client = APIClient()
+        client.force_authenticate(user)
+        saves = []
+        for size in self.SIZES:
+            for _ in range(self.NOTES_PER_SIZE):
+                started = time.perf_counter()
+                response = client.post('/api/notes/', {'title': "Note", 'content': self.content(rng, size)},
+                                       format='json')
+                if size == self.SIZES[-1]:
+                    saves.append(time.perf_counter() - started)
+                self.assertEqual(response.status_code, 201)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT SUM(LENGTH(content)) FROM notes_note WHERE user_id = %s", [user.id])
+            stored = cursor.fetchone()[0]
+        opens = []
+        for note_id in Note.objects.filter(user=user).order_by('-id').values_list('id', flat=True)[:50]:
+            cache.clear()
+            started = time.perf_counter()
+            self.assertEqual(client.get(f'/api/notes/{note_id}/').status_code, 200)
+            opens.append(time.perf_counter() - started)
+        return stored, statistics.median(saves), statistics.median(opens)
+
+    def test_compression(self):
+        rng = random.Random(22)
+        with mock.patch('notes.views.schedule_categorization'):
+            compressed, compressed_save, compressed_open = self.store(rng, 'compressed')
+            with self.settings(CONTENT_COMPRESSION_THRESHOLD=None):
+                plain, plain_save, plain_open = self.store(rng, 'plain')
+
+        report("content compression", stored_kb=compressed / 1024, plain_kb=plain / 1024,
+               ratio=plain / compressed, large_save_ms=compressed_save * 1000, plain_large_save_ms=plain_save * 1000,
+               large_open_ms=compressed_open * 1000, plain_large_open_ms=plain_open * 1000)
+        self.assertLess(compressed, plain / 2)
+        # Inflating a 50KB note costs well under a millisecond
+        self.assertLess(compressed_open, plain_open + 0.005)
+
+
+@benchmark
+@test_settings
+class ExportBenchmark(TestCase):
+    """
+    Peak memory and throughput of a 100k-note export, against the same
+    export of 1k notes: streaming keeps the peak where it was.
+    """
+
+    SIZES = [1_000, 100_000]
+
+    def test_export_memory_is_flat(self):
+        owner = make_user('owner')
+        peaks, created = {}, 0
+        for size in self.SIZES:
+            for start in range(created, size, 5000):
+                Note.objects.bulk_create(Note(user=owner, title=f"Note {i}", content=note_content(i))
+                                         for i in range(start, min(start + 5000, size)))
+            created = size
+            started = time.perf_counter()
+            total, peaks[size] = peak_memory(ndjson_chunks(export_records(owner)))
+            elapsed = time.perf_counter() - started
+
+        report("export", notes=self.SIZES[-1], mb=total / 2**20, mb_per_second=total / 2**20 / elapsed,
+               peak_mb=peaks[self.SIZES[-1]] / 2**20, peak_mb_at_1k=peaks[self.SIZES[0]] / 2**20)
+        self.assertGreater(total, 400_000_000)
+        self.assertLess(peaks[self.SIZES[-1]], peaks[self.SIZES[0]] * 1.5)
+
+
+@benchmark
+@test_settings
+class BatchBenchmark(TestCase):
+    """
+    1000 mixed operations as one notes/batch/ request against the same
+    changes made with one REST call each.
+    """
+
+    OPERATIONS = 1000
+
+    def setUp(self):
+        for target in ['notes.batch.schedule_categorization', 'notes.views.schedule_categorization',
+                       'notes.batch.notify_note_changes']:
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.work = Category.objects.create(user=self.owner, name="Work")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def operations(self):
+        """A quarter each of creates, content updates, recategorizations and deletes."""
+        quarter = self.OPERATIONS // 4
+        notes = [Note.objects.create(user=self.owner, title=f"Note {i}", content=f"<p>{i}</p>")
+                 for i in range(quarter * 3)]
+        return ([{"op": "create", "title": f"New {i}", "content": f"<p>New {i}</p>"} for i in range(quarter)] +
+                [{"op": "update", "id": note.id, "content": f"<p>Edited {note.id}</p>"} for note in notes[:quarter]] +
+                [{"op": "recategorize", "id": note.id, "category_id": self.work.id}
+                 for note in notes[quarter:quarter * 2]] +
+                [{"op": "delete", "id": note.id} for note in notes[quarter * 2:]])
+
+    def one_by_one(self, operation):
+        if operation["op"] == "create":
+            return self.client.post('/api/notes/', {"title": operation["title"], "content": operation["content"]},
+                                    format='json')
+        url = f'/api/notes/{operation["id"]}/'
+        if operation["op"] == "update":
+            return self.client.patch(url, {"content": operation["content"]}, format='json')
+        if operation["op"] == "recategorize":
+            return self.client.patch(url, {"user_updated_category": operation["category_id"]}, format='json')
+        return self.client.delete(url)
+
+    def test_batch_against_single_calls(self):
+        operations = self.operations()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as batch_queries:
+            response = self.client.post('/api/notes/batch/', {"operations": operations}, format='json')
+        batch = time.perf_counter() - started
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({result['status'] for result in response.data['results']}, {'created', 'updated', 'deleted'})
+
+        operations = self.operations()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as single_queries:
+            for operation in operations:
+                self.assertLess(self.one_by_one(operation).status_code, 300)
+        single = time.perf_counter() - started
+
+        report("batch", operations=self.OPERATIONS, batch_ms=batch * 1000, single_ms=single * 1000,
+               speedup=single / batch, batch_queries=len(batch_queries), single_queries=len(single_queries))
+        self.assertLess(batch, single / 3)
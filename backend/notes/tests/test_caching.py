@@ -0,0 +1,129 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from notes.caching import VersionedCache, response_cache
+from notes.models import Category, Note, SharedNote
+
+from .helpers import make_user, test_settings
+
+
+@test_settings
+class ResponseCacheTests(TestCase):
+    """Every write is visible to the next read, for the owner and for anyone the note is shared with."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('notes.views.schedule_categorization')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.owner = make_user('owner')
+        self.guest = make_user('guest')
+        self.category = Category.objects.create(user=self.owner, name='Work')
+        self.note = Note.objects.create(user=self.owner, title="Plan", content="<p>First</p>",
+                                        user_updated_category=self.category)
+        SharedNote.objects.create(note=self.note, user=self.guest)
+        self.clients = {}
+        for user in (self.owner, self.guest):
+            self.clients[user] = APIClient()
+            self.clients[user].force_authenticate(user)
+
+    def get(self, user, url=None):
+        return self.clients[user].get(url or f'/api/notes/{self.note.id}/')
+
+    def write(self, write):
+        # Invalidation happens once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return write()
+
+    def test_cached_note_is_served_without_queries(self):
+        self.get(self.owner)
+        self.get(self.guest)
+        with self.assertNumQueries(0):
+            for user in (self.owner, self.guest):
+                self.assertEqual(self.get(user).data['content'], "<p>First</p>")
+        self.assertGreaterEqual(response_cache.stats()['note']['hits'], 2)
+
+    def test_edits_are_seen_by_every_reader(self):
+        for user in (self.owner, self.guest):
+            self.get(user)
+        self.write(lambda: self.clients[self.guest].patch(
+            f'/api/notes/{self.note.id}/', {'content': "<p>Second</p>"}, format='json'))
+        for user in (self.owner, self.guest):
+            self.assertEqual(self.get(user).data['content'], "<p>Second</p>")
+
+    def test_category_rename_is_seen_in_the_note_and_counts(self):
+        self.get(self.owner)
+        self.get(self.owner, '/api/notes/categories/')
+        self.get(self.owner, '/api/categories/')
+
+        def rename():
+            self.category.name = 'Office'
+            self.category.save()
+        self.write(rename)
+
+        self.assertEqual(self.get(self.owner).data['user_updated_category']['name'], 'Office')
+        self.assertEqual(self.get(self.owner, '/api/notes/categories/').data['user_categories'][0]['name'], 'Office')
+        self.assertEqual(self.get(self.owner, '/api/categories/').data[0]['name'], 'Office')
+
+    def test_new_note_moves_the_category_counts(self):
+        self.get(self.owner, '/api/notes/categories/')
+        self.write(lambda: Note.objects.create(user=self.owner, user_updated_category=self.category))
+        counts = self.get(self.owner, '/api/notes/categories/').data['user_categories']
+        self.assertEqual(counts[0]['note_count'], 2)
+
+    def test_unsharing_revokes_the_cached_note(self):
+        self.assertEqual(self.get(self.guest).status_code, 200)
+        self.write(lambda: SharedNote.objects.filter(note=self.note, user=self.guest).delete())
+        self.assertEqual(self.get(self.guest).status_code, 404)
+        self.assertEqual(self.get(self.owner).status_code, 200)
+
+    def test_deleted_note_is_gone(self):
+        self.get(self.owner)
+        self.write(lambda: self.clients[self.owner].delete(f'/api/notes/{self.note.id}/'))
+        self.assertEqual(self.get(self.owner).status_code, 404)
+
+    def test_cold_conditional_get_reads_no_content(self):
+        etag = self.get(self.owner)['ETag']
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.clients[self.owner].get(f'/api/notes/{self.note.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('"content"' in query['sql'] for query in queries))
+        # Nothing was cached either: the full note is only cached to serve it
+        with CaptureQueriesContext(connection) as queries:
+            self.get(self.owner)
+        self.assertTrue(any('"content"' in query['sql'] for query in queries))
+
+
+@test_settings
+class VersionedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache = VersionedCache(prefix='test-cache', timeout=60, version_timeout=120)
+
+    def test_versions_expire_after_their_values(self):
+        self.cache.get_or_set('value', ['scope'], lambda: 'first')
+        now = time.time()
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=now + 90):
+            # The value has expired, the version it was stored under hasn't
+            self.assertIsNotNone(cache.get(self.cache.version_key('scope')))
+            self.assertEqual(self.cache.get_or_set('value', ['scope'], lambda: 'second'), 'second')
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=now + 150):
+            self.assertIsNone(cache.get(self.cache.version_key('scope')))
+
+    def test_value_computed_before_an_invalidation_is_never_served(self):
+        value, store = self.cache.get('value', ['scope'])
+        self.assertIsNone(value)
+        # A write commits while the value is being computed from older rows
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cache.invalidate(['scope'])
+        store('stale')
+        self.assertEqual(self.cache.get_or_set('value', ['scope'], lambda: 'fresh'), 'fresh')
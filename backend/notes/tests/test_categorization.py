@@ -0,0 +1,423 @@
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openai import OpenAI
+from rest_framework.test import APIClient
+
+from notes.categorization import InProcessCategorizationQueue, categorize_note, categorize_notes_in_batches
+from notes.classifiers import RemoteClassifier
+from notes.models import Category, CategoryCacheEntry, Note
+from notes.utils import extract_text_from_rich_content, generate_or_get_category_from_content
+
+from .helpers import make_user, stub_model_client, test_settings
+
+
+class FakeModelServer:
+    """
+    OpenAI-compatible chat completions endpoint on localhost. Each note is
+    categorized as its first word; batches containing a note for which
+    `fails(text)` is true get a 500, like an outage would.
+    """
+
+    def __init__(self, fails=None):
+        self.fails = fails or (lambda text: False)
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                texts = re.findall(r'^\d+\. (.*)$', body['messages'][-1]['content'], re.MULTILINE)
+                server.requests.append(texts)
+                if any(server.fails(text) for text in texts):
+                    self.reply(500, {'error': {'message': 'Model overloaded', 'type': 'server_error'}})
+                    return
+                names = [text.split()[0].capitalize() for text in texts]
+                self.reply(200, {
+                    'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': json.dumps(names)}}],
+                })
+
+            def reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def client(self):
+        return OpenAI(api_key='test', base_url=f'http://127.0.0.1:{self.httpd.server_port}/v1', max_retries=0)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@test_settings
+class CategorizeNotesCommandTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        topics = ['cooking', 'travel', 'work']
+        self.notes = [Note.objects.create(user=self.alice if i % 2 else self.bob,
+                                          content=f'<p>{topics[i % 3]} note number {i}</p>')
+                      for i in range(45)]
+        self.checkpoint = Path(tempfile.mkdtemp()) / 'checkpoint'
+
+    def run_command(self, server, *args):
+        with mock.patch('notes.utils.get_open_ai_client', return_value=server.client):
+            out = StringIO()
+            call_command('categorize_notes', '--batch-size=10', '--concurrency=3',
+                         f'--checkpoint={self.checkpoint}', *args, stdout=out)
+        return out.getvalue()
+
+    def categories(self):
+        return {note.id: (note.ai_generated_category.name if note.ai_generated_category else None,
+                          note.effective_category_id == note.ai_generated_category_id)
+                for note in Note.objects.select_related('ai_generated_category')}
+
+    def test_backfills_in_batches_and_records_the_checkpoint(self):
+        server = FakeModelServer()
+        self.addCleanup(server.close)
+        output = self.run_command(server)
+
+        # Batches run concurrently, so they may reach the server in any order
+        self.assertEqual(sorted(len(texts) for texts in server.requests), [5, 10, 10, 10, 10])
+        categories = self.categories()
+        for i, note in enumerate(self.notes):
+            self.assertEqual(categories[note.id], (['Cooking', 'Travel', 'Work'][i % 3], True))
+        # Categories are resolved once per user
+        self.assertEqual(Category.objects.filter(user=self.alice).count(), 3)
+        self.assertEqual(Category.objects.filter(user=self.bob).count(), 3)
+        self.assertEqual(self.checkpoint.read_text(), str(self.notes[-1].id))
+        self.assertIn('Categorized 45 notes', output)
+        self.assertIn('notes/s', output)
+
+    def test_queries_per_batch_do_not_grow_with_its_notes(self):
+        server = FakeModelServer()
+        self.addCleanup(server.close)
+        self.run_command(server)
+
+        # With the categories in place: the notes, then per batch one
+        # category lookup for each of the two users and one bulk update
+        with CaptureQueriesContext(connection) as queries:
+            self.run_command(server, '--all', '--restart')
+        self.assertEqual(len(queries), 1 + 5 * 3)
+
+    def test_outage_keeps_existing_categories(self):
+        server = FakeModelServer()
+        self.addCleanup(server.close)
+        self.run_command(server)
+        before = self.categories()
+
+        server.fails = lambda text: True
+        with self.assertLogs('notes.utils', 'ERROR'):
+            output = self.run_command(server, '--all', '--restart')
+
+        self.assertEqual(self.categories(), before)
+        self.assertFalse(self.checkpoint.exists())
+        self.assertIn('45 notes got no category', output)
+
+    def test_checkpoint_stops_before_the_first_unclassified_note(self):
+        failing = self.notes[23]
+        server = FakeModelServer(fails=lambda text: text.endswith('number 23'))
+        self.addCleanup(server.close)
+        with self.assertLogs('notes.utils', 'ERROR'):
+            self.run_command(server)
+
+        # The batch holding note 23 failed as a whole; later batches went through
+        categories = self.categories()
+        self.assertEqual([i for i, note in enumerate(self.notes) if categories[note.id][0] is None],
+                         list(range(20, 30)))
+        self.assertEqual(self.checkpoint.read_text(), str(self.notes[19].id))
+
+        # Once the model is back, resuming picks up exactly the skipped notes
+        server.fails = lambda text: False
+        server.requests.clear()
+        self.run_command(server)
+        self.assertEqual(sorted(sum(server.requests, [])),
+                         sorted(f'{["cooking", "travel", "work"][i % 3]} note number {i}' for i in range(20, 30)))
+        self.assertTrue(all(name for name, _ in self.categories().values()))
+        self.assertEqual(self.checkpoint.read_text(), str(self.notes[29].id))
+        self.assertEqual(Note.objects.get(pk=failing.pk).ai_generated_category.name, 'Work')
+
+
+@test_settings
+class CategorizeNoteTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('notes.categorization.notify_category_update')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.work = Category.objects.create(user=self.owner, name="Work")
+        self.note = Note.objects.create(user=self.owner, content="<p>Quarterly plan</p>",
+                                        ai_generated_category=self.work)
+
+    def test_result_is_stored_and_pushed(self):
+        travel = Category.objects.create(user=self.owner, name="Travel")
+        result = categorize_note(self.note.id, "<p>Flights to Lisbon</p>", self.owner.id,
+                                 categorize=lambda content, user: travel)
+
+        self.assertEqual(result, travel)
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.ai_generated_category, self.note.effective_category), (travel, travel))
+        self.assertEqual(self.note.categorized_text, "Flights to Lisbon")
+        self.notify.assert_called_once_with(self.note.id, travel)
+
+    def test_no_answer_keeps_the_current_category(self):
+        before = Note.objects.get(pk=self.note.pk)
+        self.assertIsNone(categorize_note(self.note.id, "<p>Quarterly plan, v2</p>", self.owner.id,
+                                          categorize=lambda content, user: None))
+
+        after = Note.objects.get(pk=self.note.pk)
+        self.assertEqual((after.ai_generated_category, after.effective_category), (self.work, self.work))
+        self.assertEqual(after.updated_at, before.updated_at)
+        self.notify.assert_not_called()
+
+    def test_user_picked_category_wins(self):
+        mine = Category.objects.create(user=self.owner, name="Mine")
+        Note.objects.filter(pk=self.note.pk).update(user_updated_category=mine, effective_category=mine)
+        categorize_note(self.note.id, "<p>Flights</p>", self.owner.id, categorize=lambda content, user: self.work)
+        self.assertEqual(Note.objects.get(pk=self.note.pk).effective_category, mine)
+        self.notify.assert_not_called()
+
+    @override_settings(AI_CATEGORIZATION_ENABLED=True)
+    def test_saves_are_queued_once_committed(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        with mock.patch('notes.categorization.get_categorization_queue') as get_queue:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = client.patch(f'/api/notes/{self.note.id}/', {'content': "<p>New</p>"}, format='json')
+            self.assertEqual(response.status_code, 200)
+            get_queue.return_value.enqueue.assert_not_called()
+            for callback in callbacks:
+                callback()
+        get_queue.return_value.enqueue.assert_called_once_with(self.note.id, "<p>New</p>", self.owner.id)
+
+
+@test_settings
+class CategorizationQueueTests(TransactionTestCase):
+    """The in-process queue with its worker threads, as a save would use it."""
+
+    def setUp(self):
+        patcher = mock.patch('notes.categorization.notify_category_update')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, content="<p>v0</p>")
+        self.other = Note.objects.create(user=self.owner, content="<p>other</p>")
+        self.seen = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def categorize(self, content, user):
+        self.seen.append(content)
+        if content == "<p>v1</p>":
+            self.started.set()
+            self.release.wait(5)
+        name = extract_text_from_rich_content(content)
+        return Category.objects.get_or_create(user=user, name=name)[0]
+
+    def category_name(self, note):
+        return Note.objects.select_related('ai_generated_category').get(pk=note.pk).ai_generated_category.name
+
+    def test_edits_made_while_classifying_are_coalesced(self):
+        queue = InProcessCategorizationQueue(workers=2, categorize=self.categorize)
+        queue.enqueue(self.note.id, "<p>v1</p>", self.owner.id)
+        self.assertTrue(self.started.wait(5))
+        for version in ("<p>v2</p>", "<p>v3</p>", "<p>v4</p>"):
+            queue.enqueue(self.note.id, version, self.owner.id)
+        self.assertEqual(queue.pending_count(), 1)
+
+        # The idle worker takes other notes, but never the busy one
+        queue.enqueue(self.other.id, "<p>other</p>", self.owner.id)
+        while "<p>other</p>" not in self.seen:
+            time.sleep(0.01)
+        self.assertEqual(self.seen, ["<p>v1</p>", "<p>other</p>"])
+
+        self.release.set()
+        queue.join()
+        self.assertEqual(self.seen, ["<p>v1</p>", "<p>other</p>", "<p>v4</p>"])
+        self.assertEqual(self.category_name(self.note), "v4")
+        self.assertEqual(queue.pending_count(), 0)
+
+    def test_failures_are_logged_and_the_queue_keeps_going(self):
+        def categorize(content, user):
+            if content == "<p>boom</p>":
+                raise RuntimeError("model exploded")
+            return self.categorize(content, user)
+
+        queue = InProcessCategorizationQueue(workers=1, categorize=categorize)
+        with self.assertLogs('notes.categorization', 'ERROR'):
+            queue.enqueue(self.note.id, "<p>boom</p>", self.owner.id)
+            queue.join()
+        queue.enqueue(self.other.id, "<p>fine</p>", self.owner.id)
+        queue.join()
+        self.assertEqual(self.category_name(self.other), "fine")
+
+    @override_settings(AI_CATEGORIZATION_ENABLED=True)
+    def test_stub_model_client_end_to_end(self):
+        client = stub_model_client(lambda prompt: " Recipes ")
+        with mock.patch('notes.classifiers._classifier', RemoteClassifier()), \
+                mock.patch('notes.classifiers.get_open_ai_client', return_value=client):
+            queue = InProcessCategorizationQueue(workers=1)
+            queue.enqueue(self.note.id, "<p>Pasta with tomato sauce</p>", self.owner.id)
+            queue.join()
+
+        self.assertEqual(self.category_name(self.note), "Recipes")
+        prompt = client.chat.completions.create.call_args.kwargs['messages'][-1]['content']
+        self.assertIn("Pasta with tomato sauce", prompt)
+        self.notify.assert_called_once()
+
+
+@test_settings
+class CategorizeNotesInBatchesTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner')
+        self.notes = [Note.objects.create(user=self.owner, content=f"<p>topic{i % 2} {i}</p>") for i in range(10)]
+
+    def test_batches_run_concurrently_and_are_stored_in_order(self):
+        # The first two batches only return once both are in flight together
+        together = threading.Barrier(2, timeout=5)
+        calls = []
+
+        def classify(texts):
+            calls.append(texts)
+            if len(calls) <= 2:
+                together.wait()
+            # The note with the 4 in it gets no answer
+            return [None if text.endswith(" 4") else text.split()[0] for text in texts]
+
+        stored = []
+        categorize_notes_in_batches(list(Note.objects.order_by('id')), batch_size=3, concurrency=2,
+                                    classify=classify,
+                                    on_batch=lambda batch, unclassified: stored.append(
+                                        ([note.id for note in batch], [note.id for note in unclassified])))
+
+        ids = [note.id for note in self.notes]
+        self.assertEqual(sorted(len(texts) for texts in calls), [1, 3, 3, 3])
+        self.assertEqual(stored, [(ids[0:3], []), (ids[3:6], [ids[4]]), (ids[6:9], []), (ids[9:], [])])
+        names = dict(Note.objects.values_list('id', 'ai_generated_category__name'))
+        self.assertEqual([names[note_id] for note_id in ids],
+                         ["topic0", "topic1", "topic0", "topic1", None, "topic1", "topic0", "topic1", "topic0",
+                          "topic1"])
+        self.assertEqual(Category.objects.filter(user=self.owner).count(), 2)
+        self.assertEqual(Note.objects.get(pk=ids[0]).categorized_text, "topic0 0")
+
+
+@test_settings
+@override_settings(AI_CATEGORIZATION_ENABLED=True, CATEGORY_CACHE_MAX_ENTRIES=2)
+class CategoryCacheTests(TestCase):
+    def setUp(self):
+        self.classifier = mock.Mock()
+        self.classifier.classify.side_effect = lambda text, user: (text.split()[0].capitalize(), 0.9)
+        patcher = mock.patch('notes.classifiers._classifier', self.classifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+
+    def categorize(self, content, user=None):
+        return generate_or_get_category_from_content(content, user or self.owner)
+
+    def test_unchanged_text_skips_the_model_and_the_category_lookup(self):
+        category = self.categorize("<p>Pasta with tomato sauce</p>")
+        self.assertEqual(category.name, "Pasta")
+
+        # Markup, case and whitespace don't change the text that's hashed:
+        # one lookup of the entry and one touch of its last use
+        with self.assertNumQueries(2):
+            self.assertEqual(self.categorize("<p>PASTA  with <b>tomato</b>\n sauce</p>"), category)
+        self.assertEqual(self.classifier.classify.call_count, 1)
+
+        # Entries are per user
+        other = make_user('other')
+        self.assertEqual(self.categorize("<p>Pasta with tomato sauce</p>", other).user, other)
+        self.assertEqual(self.classifier.classify.call_count, 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        start = timezone.now()
+        ticks = (start + timedelta(seconds=i) for i in range(100))
+        with mock.patch('django.utils.timezone.now', side_effect=lambda: next(ticks)):
+            for text in ("alpha", "beta", "alpha", "gamma"):
+                self.categorize(f"<p>{text} note</p>")
+
+        self.assertEqual(CategoryCacheEntry.objects.filter(user=self.owner).count(), 2)
+        self.classifier.classify.reset_mock()
+        self.categorize("<p>alpha note</p>")
+        self.categorize("<p>gamma note</p>")
+        self.classifier.classify.assert_not_called()
+        self.categorize("<p>beta note</p>")
+        self.classifier.classify.assert_called_once()
+
+    def test_no_answer_is_not_remembered(self):
+        self.classifier.classify.side_effect = lambda text, user: (None, 0.0)
+        self.assertIsNone(self.categorize("<p>Unsure</p>"))
+        self.assertFalse(CategoryCacheEntry.objects.exists())
+
+
+@test_settings
+@override_settings(CATEGORY_RECLASSIFY_MIN_CHANGE=0.2)
+class ReclassificationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('notes.categorization.notify_category_update')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.category = Category.objects.create(user=self.owner, name="Topic")
+        self.classified = []
+
+    def categorize(self, content, user):
+        self.classified.append(content)
+        return self.category
+
+    def test_small_saves_add_up_to_a_reclassification(self):
+        words = [f"word{i}" for i in range(24)]
+        note = Note.objects.create(user=self.owner, content=f"<p>{' '.join(words)}</p>")
+        categorize_note(note.id, note.content, self.owner.id, categorize=self.categorize)
+        self.assertEqual(len(self.classified), 1)
+
+        # Autosave: each save changes one word, which on its own is trivial
+        for i in range(20):
+            words[i] = f"new{i}"
+            categorize_note(note.id, f"<p>{' '.join(words)}</p>", self.owner.id, categorize=self.categorize)
+
+        # Measured against the text last classified, every 5th save (over
+        # 20% of the words) drifts far enough
+        self.assertEqual(len(self.classified), 1 + 4)
+        self.assertEqual(Note.objects.get(pk=note.pk).categorized_text, " ".join(words))
+
+    def test_trivial_edits_keep_the_category(self):
+        note = Note.objects.create(user=self.owner, content="<p>Packing list for the beach trip</p>")
+        categorize_note(note.id, note.content, self.owner.id, categorize=self.categorize)
+        for content in ("<p>Packing list for the <b>beach</b> trip</p>", "<p>packing LIST for the beach trip!</p>",
+                        "<p>Packing list for the beach trip</p><p>towels</p>"):
+            categorize_note(note.id, content, self.owner.id, categorize=self.categorize)
+        self.assertEqual(len(self.classified), 1)
+
+    def test_notes_without_an_ai_category_are_always_classified(self):
+        note = Note.objects.create(user=self.owner, content="<p>Packing list</p>")
+        Note.objects.filter(pk=note.pk).update(categorized_text="Packing list")
+        categorize_note(note.id, "<p>Packing list</p>", self.owner.id, categorize=self.categorize)
+        self.assertEqual(len(self.classified), 1)
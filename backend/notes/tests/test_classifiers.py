@@ -0,0 +1,110 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from notes import classifiers
+from notes.classifiers import LocalClassifier, LocalFirstClassifier, RemoteClassifier, get_classifier, hashed_features
+from notes.models import Category, Note
+
+from .helpers import make_user, stub_model_client, test_settings
+
+
+class HashedFeaturesTests(SimpleTestCase):
+    def test_vectors_are_normalized_and_case_insensitive(self):
+        vector = hashed_features("Pasta pasta with tomato", 64)
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+        np.testing.assert_array_equal(vector, hashed_features("PASTA pasta, with tomato!", 64))
+
+    def test_text_without_words_has_no_vector(self):
+        self.assertIsNone(hashed_features(" ... ", 64))
+
+
+class RemoteClassifierTests(SimpleTestCase):
+    def test_reply_is_the_category(self):
+        client = stub_model_client(lambda prompt: " Recipes \n")
+        with mock.patch('notes.classifiers.get_open_ai_client', return_value=client):
+            self.assertEqual(RemoteClassifier().classify("Pasta with tomato sauce", None), ("Recipes", 1.0))
+        prompt = client.chat.completions.create.call_args.kwargs['messages'][-1]['content']
+        self.assertIn("Pasta with tomato sauce", prompt)
+
+    def test_errors_give_no_answer(self):
+        client = stub_model_client(lambda prompt: ConnectionError("unreachable"))
+        with mock.patch('notes.classifiers.get_open_ai_client', return_value=client), \
+                self.assertLogs('notes.classifiers', 'ERROR'):
+            self.assertEqual(RemoteClassifier().classify("Pasta", None), (None, 0.0))
+
+
+@test_settings
+class LocalClassifierTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner')
+        self.cooking = Category.objects.create(user=self.owner, name="Cooking")
+        self.travel = Category.objects.create(user=self.owner, name="Travel")
+        for content, category in [
+            ("<p>Pasta with tomato sauce and basil</p>", self.cooking),
+            ("<p>Bake the bread, knead the dough</p>", self.cooking),
+            ("<p>Flights to Lisbon and a hotel near the beach</p>", self.travel),
+            ("<p>Train tickets, passport, hotel booking</p>", self.travel),
+        ]:
+            Note.objects.create(user=self.owner, content=content, ai_generated_category=category)
+        self.classifier = LocalClassifier(dimensions=1024, ttl=300, max_training_notes=100)
+
+    def test_nearest_category_wins_with_its_similarity(self):
+        name, confidence = self.classifier.classify("tomato sauce for the pasta", self.owner)
+        self.assertEqual(name, "Cooking")
+        self.assertGreater(confidence, 0.3)
+        self.assertLessEqual(confidence, 1.0)
+        self.assertEqual(self.classifier.classify("hotel and flights", self.owner)[0], "Travel")
+
+    def test_user_picked_categories_override_the_ai_one(self):
+        # The AI called it travel; the user knows it's about food
+        Note.objects.create(user=self.owner, content="<p>Street food tour, dumplings and noodles</p>",
+                            ai_generated_category=self.travel, user_updated_category=self.cooking)
+        Note.objects.create(user=self.owner, content="<p>Dumplings and noodles recipe</p>",
+                            ai_generated_category=self.travel, user_updated_category=self.cooking)
+        self.assertEqual(self.classifier.classify("noodles and dumplings", self.owner)[0], "Cooking")
+
+    def test_models_are_per_user_and_rebuilt_after_the_ttl(self):
+        other = make_user('other')
+        self.assertEqual(self.classifier.classify("tomato pasta", other), (None, 0.0))
+
+        self.classifier.classify("tomato pasta", self.owner)
+        with self.assertNumQueries(0):
+            self.classifier.classify("hotel", self.owner)
+        expired = self.classifier.get_model(self.owner).built_at + 301
+        with mock.patch('notes.classifiers.time.monotonic', return_value=expired), self.assertNumQueries(1):
+            self.classifier.classify("hotel", self.owner)
+        self.classifier.invalidate(self.owner.id)
+        with self.assertNumQueries(1):
+            self.classifier.classify("hotel", self.owner)
+
+    def test_text_without_words_gets_no_answer(self):
+        self.assertEqual(self.classifier.classify("", self.owner), (None, 0.0))
+
+
+class LocalFirstClassifierTests(SimpleTestCase):
+    def setUp(self):
+        self.local = mock.Mock()
+        self.remote = mock.Mock()
+        self.remote.classify.return_value = ("Remote", 1.0)
+        self.classifier = LocalFirstClassifier(local=self.local, remote=self.remote, min_confidence=0.5)
+
+    def test_confident_local_answer_skips_the_remote_model(self):
+        self.local.classify.return_value = ("Local", 0.8)
+        self.assertEqual(self.classifier.classify("text", None), ("Local", 0.8))
+        self.remote.classify.assert_not_called()
+
+    def test_unsure_or_missing_local_answer_falls_back(self):
+        for answer in [("Local", 0.2), (None, 0.0)]:
+            with self.subTest(answer=answer):
+                self.local.classify.return_value = answer
+                self.assertEqual(self.classifier.classify("text", None), ("Remote", 1.0))
+        self.assertEqual(self.remote.classify.call_count, 2)
+
+    @override_settings(CATEGORY_CLASSIFIER='notes.classifiers.RemoteClassifier')
+    def test_configured_classifier_is_built_once(self):
+        with mock.patch.object(classifiers, '_classifier', None):
+            classifier = get_classifier()
+            self.assertIsInstance(classifier, RemoteClassifier)
+            self.assertIs(get_classifier(), classifier)
@@ -0,0 +1,64 @@
+import zlib
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from notes.fields import COMPRESSED_MARKER, CompressedText
+from notes.models import Note
+
+from .helpers import make_user
+
+BIG = "<p>" + "lorem ipsum dolor sit amet " * 300 + "</p>"
+
+
+class CompressedTextFieldTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        self.small = Note.objects.create(user=self.user, content="<p>Short</p>")
+        self.big = Note.objects.create(user=self.user, content=BIG)
+
+    def stored(self, note):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM notes_note WHERE id = %s", [note.id])
+            value = cursor.fetchone()[0]
+        return value.encode() if isinstance(value, str) else bytes(value)
+
+    def test_only_large_contents_are_compressed(self):
+        self.assertEqual(self.stored(self.small), b"<p>Short</p>")
+        stored = self.stored(self.big)
+        self.assertTrue(stored.startswith(COMPRESSED_MARKER))
+        self.assertLess(len(stored), len(BIG) / 10)
+
+    def test_content_is_inflated_on_first_read_only(self):
+        with mock.patch('notes.fields.zlib.decompress', wraps=zlib.decompress) as decompress:
+            note = Note.objects.get(pk=self.big.pk)
+            self.assertEqual(note.snippet[:5], "lorem")
+            decompress.assert_not_called()
+            self.assertEqual(note.content, BIG)
+            self.assertEqual(note.content, BIG)
+        self.assertEqual(decompress.call_count, 1)
+
+    def test_compressed_values_are_copied_without_recompressing(self):
+        copy = Note.objects.create(user=self.user)
+        stored = Note.objects.values_list('content', flat=True).get(pk=self.big.pk)
+        with mock.patch('notes.fields.zlib.compress') as compress, \
+                mock.patch('notes.fields.zlib.decompress') as decompress:
+            Note.objects.filter(pk=copy.pk).update(content=stored)
+        compress.assert_not_called()
+        decompress.assert_not_called()
+        self.assertEqual(self.stored(copy), self.stored(self.big))
+        self.assertEqual(Note.objects.get(pk=copy.pk).content, BIG)
+
+    def test_values_hand_out_compressed_text(self):
+        contents = dict(Note.objects.values_list('id', 'content'))
+        self.assertEqual(contents[self.small.id], "<p>Short</p>")
+        self.assertIsInstance(contents[self.big.id], CompressedText)
+        self.assertEqual(str(contents[self.big.id]), BIG)
+        self.assertEqual(contents[self.big.id], BIG)
+
+    @override_settings(CONTENT_COMPRESSION_THRESHOLD=None)
+    def test_compression_can_be_turned_off_for_new_writes(self):
+        note = Note.objects.create(user=self.user, content=BIG)
+        self.assertEqual(self.stored(note), BIG.encode())
+        self.assertEqual(Note.objects.get(pk=self.big.pk).content, BIG)
@@ -0,0 +1,106 @@
+from unittest import skipUnless
+
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from notes.models import Category, Note, SharedNote
+
+from .helpers import make_user, test_settings
+
+
+@test_settings
+class IndexTests(TestCase):
+    """The hot lookups' indexes, as the migrations actually created them."""
+
+    expected = {
+        'notes_note': {
+            'note_user_recent_idx': ['user_id', 'updated_at', 'id'],
+            'note_uncategorized_idx': ['id'],
+            'note_user_category_idx': ['user_id', 'effective_category_id'],
+        },
+        'notes_category': {'category_user_name_idx': ['user_id', 'name']},
+        'notes_invite': {'invite_token_covering_idx': ['token']},
+        'notes_noteoperation': {'noteoperation_note_id_idx': ['note_id', 'id']},
+        'notes_sharednote': {'sharednote_note_user_unique': ['note_id', 'user_id']},
+    }
+
+    def constraints(self, table):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(cursor, table)
+
+    def test_indexes_exist_with_their_columns(self):
+        for table, indexes in self.expected.items():
+            constraints = self.constraints(table)
+            for name, columns in indexes.items():
+                with self.subTest(table=table, index=name):
+                    self.assertIn(name, constraints)
+                    self.assertEqual(constraints[name]['columns'], columns)
+
+    def test_recent_notes_index_matches_the_list_ordering(self):
+        index = self.constraints('notes_note')['note_user_recent_idx']
+        self.assertEqual(index['orders'], ['ASC', 'DESC', 'DESC'])
+
+    def test_note_can_only_be_shared_once_with_a_user(self):
+        self.assertTrue(self.constraints('notes_sharednote')['sharednote_note_user_unique']['unique'])
+        owner, guest = make_user('owner'), make_user('guest')
+        note = Note.objects.create(user=owner)
+        SharedNote.objects.create(note=note, user=guest)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SharedNote.objects.create(note=note, user=guest)
+
+
+@test_settings
+class IndexUsageTests(TestCase):
+    """The plans of the note queries the list and search endpoints run."""
+
+    def setUp(self):
+        self.owner = make_user('owner')
+        work = Category.objects.create(user=self.owner, name="Work")
+        for i in range(60):
+            Note.objects.create(user=self.owner, title=f"Note {i}", content="<p>Quarterly planning</p>",
+                                user_updated_category=work if i % 2 else None)
+        SharedNote.objects.create(note=Note.objects.create(user=make_user('bob')), user=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        if connection.vendor == 'postgresql':
+            # A few rows fit in one page, where a sequential scan always wins
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def plans(self, path):
+        """The response to `path` and the plan of each notes query it ran."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if query['sql'].startswith('SELECT') and 'FROM "notes_note"' in query['sql']:
+                    cursor.execute(f"{connection.ops.explain_query_prefix()} {query['sql']}")
+                    plans.append("\n".join(str(row[-1]) for row in cursor.fetchall()))
+        self.assertTrue(plans)
+        return response, plans
+
+    def assertSeeksUserIndex(self, plan, index=r'note_user_(recent|category)_idx'):
+        self.assertRegex(plan, index)
+        self.assertNotRegex(plan, r'\bSCAN notes_note|Seq Scan on notes_note')
+
+    def test_list_pages_seek_the_users_notes(self):
+        response, plans = self.plans('/api/notes/')
+        for plan in plans:
+            self.assertSeeksUserIndex(plan)
+        # Later pages start from the cursor's position in the recent index
+        _, plans = self.plans(response.data['next'])
+        for plan in plans:
+            self.assertSeeksUserIndex(plan, 'note_user_recent_idx')
+        _, plans = self.plans('/api/notes/?category=Work')
+        for plan in plans:
+            self.assertSeeksUserIndex(plan)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Full-text search needs Postgres')
+    def test_search_uses_the_search_vector_index(self):
+        _, plans = self.plans('/api/notes/search/?q=quarterly')
+        for plan in plans:
+            self.assertIn('note_search_vector_idx', plan)
@@ -0,0 +1,117 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from notes.invites import InviteTokenCache, invite_cache
+from notes.models import Invite, Note
+
+from .helpers import make_user, test_settings
+
+
+@test_settings
+class InviteTokenCacheTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner)
+        self.invite = Invite.objects.create(note=self.note, email='guest@example.com')
+        self.cache = InviteTokenCache(maxsize=2, ttl=60)
+
+    def test_valid_token_is_resolved_once(self):
+        with self.assertNumQueries(1):
+            for _ in range(5):
+                self.assertEqual(self.cache.resolve(str(self.invite.token)).note_id, self.note.id)
+
+    def test_malformed_and_unknown_tokens(self):
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.cache.resolve('not-a-token'))
+        # Unknown tokens aren't cached, so a new invite needs no invalidation
+        with self.assertNumQueries(2):
+            self.assertIsNone(self.cache.resolve('00000000-0000-0000-0000-000000000000'))
+            self.assertIsNone(self.cache.resolve('00000000-0000-0000-0000-000000000000'))
+
+    def test_entries_end_with_the_invite(self):
+        self.cache.resolve(self.invite.token)
+        with mock.patch('notes.invites.timezone.now', return_value=self.invite.expires_at + timedelta(seconds=1)):
+            self.assertIsNone(self.cache.resolve(self.invite.token))
+
+    def test_entries_expire_after_the_ttl(self):
+        self.cache.resolve(self.invite.token)
+        with mock.patch('notes.invites.time.monotonic', return_value=time.monotonic() + 61), \
+                self.assertNumQueries(1):
+            self.cache.resolve(self.invite.token)
+
+    def test_deleting_the_invite_drops_it(self):
+        invite_cache.resolve(self.invite.token)
+        self.addCleanup(invite_cache.clear)
+        self.invite.delete()
+        self.assertIsNone(invite_cache.resolve(self.invite.token))
+
+
+@test_settings
+class GuestEndpointTests(TestCase):
+    """Requests with `?token=` and no account."""
+
+    def setUp(self):
+        cache.clear()
+        invite_cache.clear()
+        self.addCleanup(invite_cache.clear)
+        patcher = mock.patch('notes.views.schedule_categorization')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, title="Invited", content="<p>Hello</p>")
+        self.other = Note.objects.create(user=self.owner, title="Private", content="<p>Secret</p>")
+        self.invite = Invite.objects.create(note=self.note, email='guest@example.com')
+        self.client = APIClient()
+
+    def url(self, note=None, token=None):
+        path = f'/api/notes/{note.id}/' if note else '/api/notes/'
+        return f'{path}?token={token or self.invite.token}'
+
+    def invite_queries(self, queries):
+        return [query for query in queries if 'notes_invite' in query['sql']]
+
+    def test_list_holds_only_the_invited_note(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url())
+        self.assertEqual([entry['id'] for entry in response.data['results']], [self.note.id])
+        # The token is resolved from memory from then on
+        with self.assertNumQueries(1):
+            self.client.get(self.url())
+
+    def test_page_load_needs_at_most_one_query(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url(self.note)).data['content'], "<p>Hello</p>")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url(self.note)).status_code, 200)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.client.get(self.url(self.note))
+
+    def test_update_resolves_the_token_once(self):
+        self.client.get(self.url())
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url(self.note), {'content': "<p>Edited</p>"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.invite_queries(queries), [])
+        self.assertEqual(self.client.get(self.url(self.note)).data['content'], "<p>Edited</p>")
+
+    def test_token_only_opens_its_own_note(self):
+        self.assertEqual(self.client.get(self.url(self.other)).status_code, 404)
+        response = self.client.patch(self.url(self.other), {'content': "<p>Defaced</p>"}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Note.objects.get(pk=self.other.pk).content, "<p>Secret</p>")
+
+    def test_invalid_and_expired_tokens_are_refused(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url(self.note, token='nope')).status_code, 403)
+        Invite.objects.filter(pk=self.invite.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.client.get(self.url(self.note)).status_code, 403)
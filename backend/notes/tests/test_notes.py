@@ -0,0 +1,291 @@
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from notes.models import Category, Note, NoteTombstone, SharedNote, make_search_vector
+
+from .helpers import make_user, test_settings
+
+
+@test_settings
+class NoteListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('alice')
+        self.other = make_user('bob')
+        self.work = Category.objects.create(user=self.user, name='Work')
+        self.notes = [Note.objects.create(user=self.user, content=f'<p>Note {i}</p>',
+                                          user_updated_category=self.work if i % 2 else None)
+                      for i in range(60)]
+        self.shared = Note.objects.create(user=self.other, title="Shared", user_updated_category=None)
+        SharedNote.objects.create(note=self.shared, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for filters, matching in [({}, 61), ({'category': 'Work'}, 30)]:
+            for page_size in (5, 50):
+                with self.subTest(filters=filters, page_size=page_size), self.assertNumQueries(1):
+                    response = self.client.get('/api/notes/', {**filters, 'page_size': page_size})
+                self.assertEqual(len(response.data['results']), min(page_size, matching))
+
+    def test_list_entries_leave_the_content_behind(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notes/', {'page_size': 2})
+        self.assertNotIn('"content"', queries[0]['sql'])
+        self.assertEqual(response.data['results'][0], {
+            'id': self.shared.id, 'title': 'Shared', 'snippet': '', 'category': None,
+            'is_owner': False, 'updated_at': response.data['results'][0]['updated_at'],
+        })
+        self.assertEqual(response.data['results'][1]['snippet'], 'Note 59')
+        self.assertEqual(response.data['results'][1]['category'], 'Work')
+
+    def test_cursor_walks_owned_and_shared_notes_once(self):
+        seen = []
+        url = '/api/notes/?page_size=7'
+        while url:
+            response = self.client.get(url)
+            seen.extend(entry['id'] for entry in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [self.shared.id] + [note.id for note in reversed(self.notes)])
+
+    def test_retrieve_query_count_is_constant(self):
+        ai = Category.objects.create(user=self.user, name='Ideas')
+        Note.objects.filter(pk=self.notes[1].pk).update(ai_generated_category=ai)
+        for note in (self.notes[0], self.notes[1], self.shared):
+            cache.clear()
+            with self.subTest(note=note.id), self.assertNumQueries(2):
+                response = self.client.get(f'/api/notes/{note.id}/')
+            self.assertEqual(response.data['is_owner'], note.user_id == self.user.id)
+
+
+@test_settings
+class CategoryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_notes(self, count):
+        for i in range(count):
+            category = Category.objects.create(user=self.user, name=f'Category {i}')
+            for _ in range(3):
+                Note.objects.create(user=self.user, ai_generated_category=category)
+
+    def test_one_query_whatever_the_number_of_categories(self):
+        for count in (2, 20):
+            self.add_notes(count)
+            cache.clear()
+            with self.subTest(categories=count), self.assertNumQueries(1):
+                response = self.client.get('/api/notes/categories/')
+            self.assertEqual(len(response.data['user_categories']), Category.objects.count())
+            self.assertEqual({entry['note_count'] for entry in response.data['user_categories']}, {3})
+
+    def test_counts_are_cached_until_a_note_changes(self):
+        self.add_notes(2)
+        self.client.get('/api/notes/categories/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/notes/categories/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(user=self.user, ai_generated_category=Category.objects.first())
+        response = self.client.get('/api/notes/categories/')
+        self.assertEqual(sorted(entry['note_count'] for entry in response.data['user_categories']), [3, 4])
+
+
+@test_settings
+class SearchVectorTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        self.note = Note.objects.create(user=self.user, title="Trip", content="<p>Pack the tent</p>")
+
+    def rebuilds(self, note, **kwargs):
+        with mock.patch('notes.models.make_search_vector', wraps=make_search_vector) as rebuild:
+            note.save(**kwargs)
+        return rebuild.call_count
+
+    def test_vector_is_only_rebuilt_when_the_text_changes(self):
+        note = Note.objects.get(pk=self.note.pk)
+        note.user_updated_category = Category.objects.create(user=self.user, name='Travel')
+        self.assertEqual(self.rebuilds(note), 0)
+
+        note.content = "<p>Pack the stove</p>"
+        self.assertEqual(self.rebuilds(note, update_fields=['content']), 1)
+        # The saved text is the new baseline
+        self.assertEqual(self.rebuilds(note, update_fields=['content']), 0)
+        self.assertEqual(self.rebuilds(Note.objects.defer('content').get(pk=note.pk),
+                                       update_fields=['user_updated_category']), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Full-text search needs Postgres')
+@test_settings
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        other = make_user('bob')
+        self.title_match = Note.objects.create(user=self.user, title="Tent", content="<p>Camping gear</p>")
+        self.body_match = Note.objects.create(user=self.user, title="Trip", content="<p>Pack the <b>tent</b></p>")
+        self.shared = Note.objects.create(user=other, title="Shared", content="<p>Borrow a tent</p>")
+        SharedNote.objects.create(note=self.shared, user=self.user)
+        Note.objects.create(user=other, title="Private", content="<p>My tent</p>")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_ranks_owned_and_shared_matches_with_headlines(self):
+        response = self.client.get('/api/notes/search/', {'q': 'tent'})
+        results = response.data['results']
+        self.assertEqual(results[0]['id'], self.title_match.id)
+        self.assertEqual({entry['id'] for entry in results},
+                         {self.title_match.id, self.body_match.id, self.shared.id})
+        headline = next(entry['headline'] for entry in results if entry['id'] == self.body_match.id)
+        self.assertIn('<mark>tent</mark>', headline)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for page_size in (1, 3):
+            # Count, page and one query for all of the page's headlines
+            with self.subTest(page_size=page_size), self.assertNumQueries(3):
+                self.client.get('/api/notes/search/', {'q': 'tent', 'page_size': page_size})
+
+
+@test_settings
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('alice')
+        self.notes = [Note.objects.create(user=self.user, content=f'<p>Note {i}</p>') for i in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def revalidate(self, url, response):
+        """Repeats `url` with `response`'s validators, recording queries and serializer calls."""
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('notes.views.NoteSerializer.to_representation') as full, \
+                mock.patch('notes.views.NoteListSerializer.to_representation') as entry:
+            repeated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeated.status_code, 304)
+        self.assertEqual(repeated['ETag'], response['ETag'])
+        self.assertEqual(full.call_count + entry.call_count, 0)
+        return [query['sql'] for query in queries]
+
+    def test_unchanged_list_is_not_serialized(self):
+        url = '/api/notes/?page_size=3'
+        for sql in self.revalidate(url, self.client.get(url)):
+            self.assertNotIn('"content"', sql)
+
+    def test_unchanged_note_is_neither_read_nor_serialized(self):
+        url = f'/api/notes/{self.notes[0].id}/'
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        # Whether or not the note is in the response cache
+        self.assertEqual(self.revalidate(url, response), [])
+        cache.clear()
+        for sql in self.revalidate(url, response):
+            self.assertNotIn('"content"', sql)
+
+    def test_changes_and_other_users_get_a_full_response(self):
+        url = f'/api/notes/{self.notes[0].id}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True), mock.patch('notes.views.schedule_categorization'):
+            self.client.patch(url, {'title': 'Renamed'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Renamed')
+
+        other = make_user('bob')
+        self.notes[0].shared_with.create(user=other)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+@test_settings
+class SyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('alice')
+        self.other = make_user('bob')
+        self.notes = [Note.objects.create(user=self.user, title=f"Note {i}") for i in range(3)]
+        self.shared = Note.objects.create(user=self.other, title="Shared")
+        SharedNote.objects.create(note=self.shared, user=self.user)
+        self.unshared = Note.objects.create(user=self.other, title="Not yet shared")
+        # Everything so far happened well before the first sync
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Note.objects.update(updated_at=an_hour_ago)
+        SharedNote.objects.update(created_at=an_hour_ago)
+        NoteTombstone.objects.all().delete()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since=None):
+        response = self.client.get('/api/notes/sync/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, data):
+        return sorted(note['id'] for note in data['notes'])
+
+    def test_first_sync_returns_every_visible_note(self):
+        before = timezone.now()
+        data = self.sync()
+        self.assertEqual(self.ids(data), sorted([note.id for note in self.notes] + [self.shared.id]))
+        self.assertEqual(data['deleted'], [])
+        # The cursor overlaps the call, so writes racing it are sent again
+        cursor = float(data['cursor'])
+        self.assertAlmostEqual(cursor, before.timestamp() - settings.NOTE_SYNC_OVERLAP, delta=1)
+
+    def test_cursor_returns_only_changes_since(self):
+        cursor = self.sync()['cursor']
+        self.assertEqual(self.sync(cursor)['notes'], [])
+
+        self.client.patch(f'/api/notes/{self.notes[1].id}/', {'title': 'Renamed'}, format='json')
+        Note.objects.filter(pk=self.shared.pk).update(title="Edited by Bob", updated_at=timezone.now())
+        self.other.notes.create(title="Bob's own")
+        data = self.sync(cursor)
+        self.assertEqual(self.ids(data), sorted([self.notes[1].id, self.shared.id]))
+        self.assertEqual({note['title'] for note in data['notes']}, {'Renamed', 'Edited by Bob'})
+
+    def test_shares_added_since_the_cursor_are_returned(self):
+        cursor = self.sync()['cursor']
+        # Shared now, but not edited since long before the cursor
+        SharedNote.objects.create(note=self.unshared, user=self.user)
+        SharedNote.objects.create(note=Note.objects.create(user=self.other, title="Someone else's"),
+                                  user=make_user('carol'))
+        self.assertEqual(self.ids(self.sync(cursor)), [self.unshared.id])
+
+    def test_deleted_and_unshared_notes_are_tombstones(self):
+        cursor = self.sync()['cursor']
+        deleted_id = self.notes[0].id
+        self.client.delete(f'/api/notes/{deleted_id}/')
+        SharedNote.objects.filter(note=self.shared, user=self.user).delete()
+        # Bob's own deletions aren't Alice's business
+        self.other.notes.create(title="Bob's own").delete()
+
+        data = self.sync(cursor)
+        self.assertEqual(data['notes'], [])
+        self.assertEqual(data['deleted'], sorted([deleted_id, self.shared.id]))
+
+        # Shared again: back in the list rather than deleted
+        SharedNote.objects.create(note=self.shared, user=self.user)
+        data = self.sync(cursor)
+        self.assertEqual(self.ids(data), [self.shared.id])
+        self.assertEqual(data['deleted'], [deleted_id])
+
+    def test_expired_and_invalid_cursors_are_refused(self):
+        expired = timezone.now() - timedelta(seconds=settings.NOTE_TOMBSTONE_RETENTION + 60)
+        response = self.client.get('/api/notes/sync/', {'since': f"{expired.timestamp():.6f}"})
+        self.assertEqual(response.status_code, 410)
+        for cursor in ['yesterday', '1e400']:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/api/notes/sync/', {'since': cursor}).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/notes/sync/').status_code, 403)
@@ -0,0 +1,91 @@
+import time
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from notes.models import Note, OutboxEmail
+from notes.outbox import dispatch_due_emails, queue_email, send_emails
+
+from .helpers import make_user, test_settings
+
+
+class SlowEmailBackend(EmailBackend):
+    """The locmem backend behind a provider that takes its time."""
+
+    def send_messages(self, messages):
+        time.sleep(0.5)
+        return super().send_messages(messages)
+
+
+@test_settings
+@override_settings(EMAIL_BACKEND='notes.tests.test_outbox.SlowEmailBackend',
+                   EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, title="Plan")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        patcher = mock.patch('notes.outbox.get_email_dispatcher')
+        self.dispatcher = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_due(self):
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_invite_returns_before_the_email_is_sent(self):
+        started = time.monotonic()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/notes/{self.note.id}/invite_guest/', {'email': 'guest@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(mail.outbox, [])
+        self.dispatcher.return_value.wake.assert_called_once()
+
+        self.assertEqual(dispatch_due_emails(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['guest@example.com'])
+        self.assertIn(response.data['invite_link'], mail.outbox[0].body)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_dispatcher_is_only_woken_once_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            queue_email("Subject", "Body", 'guest@example.com')
+        self.assertEqual(len(callbacks), 1)
+        self.dispatcher.return_value.wake.assert_not_called()
+
+    def test_unreachable_provider_charges_every_email_an_attempt(self):
+        for i in range(3):
+            queue_email("Subject", "Body", f'guest{i}@example.com')
+        connection = mock.Mock(open=mock.Mock(side_effect=OSError("Connection refused")))
+
+        for attempt in range(1, 4):
+            self.make_due()
+            with mock.patch('notes.outbox.get_connection', return_value=connection), self.assertLogs('notes.outbox'):
+                self.assertEqual(dispatch_due_emails(), (0, 3))
+            emails = list(OutboxEmail.objects.all())
+            self.assertEqual({email.attempts for email in emails}, {attempt})
+            self.assertEqual({email.last_error for email in emails}, {"Connection refused"})
+
+        # Out of attempts: given up on rather than claimed forever
+        self.assertEqual({email.status for email in emails}, {OutboxEmail.FAILED})
+        self.make_due()
+        self.assertEqual(dispatch_due_emails(), (0, 0))
+
+    def test_failed_email_backs_off_while_the_others_go_out(self):
+        queue_email("Subject", "Body", 'first@example.com')
+        queue_email("Subject", "Body", 'second@example.com')
+        connection = mock.MagicMock()
+        connection.send_messages.side_effect = [1, OSError("Mailbox unavailable")]
+
+        self.assertEqual(send_emails(list(OutboxEmail.objects.order_by('id')), connection), (1, 1))
+
+        first, second = OutboxEmail.objects.order_by('id')
+        self.assertEqual((first.status, first.attempts), (OutboxEmail.SENT, 1))
+        self.assertEqual((second.status, second.attempts), (OutboxEmail.PENDING, 1))
+        self.assertGreater(second.next_attempt_at, first.next_attempt_at)
+        # Nothing else is due until the retry delay has passed
+        self.assertEqual(dispatch_due_emails(), (0, 0))
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from notes.batch import apply_operations
+from notes.deltas import DeltaBatcher, compact_note_operations, get_snapshot, seed_snapshot, store_operations
+from notes.models import Note, NoteOperation
+from notes.presence import InMemoryPresence, PresenceBroadcaster
+from notes.views import NoteViewSet
+
+from .helpers import RealtimeTestCase, make_user, patch_presence, test_settings
+
+
+@test_settings
+class DeltaBatchingTests(RealtimeTestCase):
+    def test_deltas_within_the_window_go_out_as_one_frame(self):
+        batcher = DeltaBatcher(window=0.05)
+        layer = get_channel_layer()
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.group_add(f'note_{self.note.id}', channel)
+            with mock.patch.object(layer, 'group_send', wraps=layer.group_send) as group_send:
+                for i in range(20):
+                    batcher.add(layer, self.note.id, {"delta": {"ops": [{"insert": str(i)}]},
+                                                      "clientId": "a" if i % 2 else "b"})
+                message = await asyncio.wait_for(layer.receive(channel), 2)
+            return message, group_send.call_count
+
+        message, sends = asyncio.run(scenario())
+
+        # One channel layer publish and one INSERT for 20 keystrokes
+        self.assertEqual(sends, 1)
+        self.assertEqual(message['type'], 'note_batch')
+        frame = json.loads(message['payload'])
+        self.assertEqual([m['delta']['ops'][0]['insert'] for m in frame['messages']], [str(i) for i in range(20)])
+        self.assertEqual([m['clientId'] for m in frame['messages']], ['b', 'a'] * 10)
+        operations = list(NoteOperation.objects.filter(note=self.note).order_by('id'))
+        self.assertEqual(len(operations), 20)
+        self.assertEqual(frame['version'], operations[-1].id)
+
+    def test_members_receive_the_pre_encoded_frame(self):
+        async def scenario():
+            editor = await self.connect()
+            watcher = await self.connect()
+            for communicator in (editor, watcher):
+                await self.receive(communicator, 'sync')
+
+            with mock.patch('notes.consumers.json', wraps=json) as consumer_json:
+                for i in range(5):
+                    await editor.send_json_to({"delta": {"ops": [{"insert": str(i)}]}, "clientId": "editor"})
+                frames = [await self.receive(communicator, 'batch') for communicator in (editor, watcher)]
+            for communicator in (editor, watcher):
+                await communicator.disconnect()
+            return frames, [call.args[0] for call in consumer_json.dumps.call_args_list]
+
+        frames, serialized = asyncio.run(scenario())
+
+        # Consumers only write the payload; no batch is serialized per member
+        self.assertEqual([data for data in serialized if data['type'] == 'batch'], [])
+        self.assertEqual(frames[0], frames[1])
+        self.assertEqual([m['delta']['ops'][0]['insert'] for m in frames[0]['messages']], list('01234'))
+        self.assertTrue(all(m['clientId'] == 'editor' for m in frames[0]['messages']))
+
+    def test_keystroke_bursts_are_batched(self):
+        keystrokes = 500
+
+        async def scenario():
+            editor = await self.connect()
+            watcher = await self.connect()
+            for communicator in (editor, watcher):
+                await self.receive(communicator, 'sync')
+
+            layer = get_channel_layer()
+            with mock.patch.object(layer, 'group_send', wraps=layer.group_send) as group_send, \
+                    mock.patch('notes.deltas.store_operations', wraps=store_operations) as store:
+                for i in range(keystrokes):
+                    await editor.send_json_to({"delta": {"ops": [{"insert": str(i)}]}, "clientId": "editor"})
+                    if i % 50 == 49:
+                        await asyncio.sleep(0.03)
+                frames = []
+                while sum(len(frame['messages']) for frame in frames) < keystrokes:
+                    frames.append(await self.receive(watcher, 'batch'))
+            for communicator in (editor, watcher):
+                await communicator.disconnect()
+            publishes = [call for call in group_send.call_args_list if call.args[1]['type'] == 'note_batch']
+            return frames, len(publishes), store.call_count
+
+        frames, publishes, inserts = asyncio.run(scenario())
+
+        # Without batching every keystroke is one publish and one INSERT;
+        # here it's one of each per window
+        self.assertEqual(inserts, publishes)
+        self.assertEqual(len(frames), publishes)
+        self.assertLessEqual(publishes / keystrokes, 0.05)
+        # Every keystroke arrives exactly once, in order
+        inserted = [m['delta']['ops'][0]['insert'] for frame in frames for m in frame['messages']]
+        self.assertEqual(inserted, [str(i) for i in range(keystrokes)])
+        versions = [frame['version'] for frame in frames]
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertEqual(NoteOperation.objects.filter(note=self.note).count(), keystrokes)
+
+
+@test_settings
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner, title="Doc", content="<p>Hello</p>")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def log(self, *texts):
+        return store_operations(self.note.id, [{"delta": {"ops": [{"insert": text}]}, "clientId": "c"}
+                                               for text in texts])
+
+    def seeded(self):
+        version = self.log("a", "b")
+        self.assertTrue(seed_snapshot(self.note.id, {"ops": [{"insert": "Hello ab\n"}]}, version))
+        return version
+
+    def test_seed_must_include_every_logged_operation(self):
+        synced_at = self.log("a")
+        # Logged after the client synced, so missing from its document
+        head = self.log("b")
+        self.assertFalse(seed_snapshot(self.note.id, {"ops": [{"insert": "stale"}]}, synced_at))
+        self.assertFalse(seed_snapshot(self.note.id, {"ops": [{"insert": "ahead"}]}, head + 10))
+        self.assertFalse(seed_snapshot(self.note.id, {"ops": []}, "latest"))
+        self.assertEqual(NoteOperation.objects.filter(note=self.note).count(), 2)
+
+        self.assertTrue(seed_snapshot(self.note.id, {"ops": [{"insert": "ab"}]}, head))
+        self.assertEqual(get_snapshot(self.note.id), ({"ops": [{"insert": "ab"}]}, [], head))
+        self.assertFalse(NoteOperation.objects.filter(note=self.note).exists())
+
+    def test_rest_save_replaces_the_snapshot(self):
+        self.seeded()
+        tail = self.log("c")
+        response = self.client.put(f'/api/notes/{self.note.id}/', {'title': 'Doc', 'content': '<p>Rewritten</p>'},
+                                   format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Joiners start from the saved content, and may seed again on top of it
+        self.assertEqual(get_snapshot(self.note.id), (None, [], tail))
+        self.assertFalse(NoteOperation.objects.filter(note=self.note).exists())
+        after = self.log("d")
+        self.assertEqual(get_snapshot(self.note.id), (None, [{"ops": [{"insert": "d"}]}], after))
+        self.assertTrue(seed_snapshot(self.note.id, {"ops": [{"insert": "Rewrittend\n"}]}, after))
+
+    def test_title_only_save_keeps_the_snapshot(self):
+        self.seeded()
+        tail = self.log("c")
+        response = self.client.patch(f'/api/notes/{self.note.id}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        snapshot, ops, version = get_snapshot(self.note.id)
+        self.assertEqual((snapshot, len(ops), version), ({"ops": [{"insert": "Hello ab\n"}]}, 1, tail))
+
+    def test_save_does_not_write_back_a_stale_snapshot(self):
+        self.seeded()
+        self.log("c")
+        get_object = NoteViewSet.get_object
+
+        def get_object_then_compact(view):
+            note = get_object(view)
+            # Compaction runs while the request holds its copy of the note
+            compact_note_operations(self.note.id)
+            return note
+
+        with mock.patch.object(NoteViewSet, 'get_object', get_object_then_compact):
+            self.client.patch(f'/api/notes/{self.note.id}/', {'title': 'Renamed'}, format='json')
+        snapshot, ops, version = get_snapshot(self.note.id)
+        self.assertEqual((snapshot, ops), ({"ops": [{"insert": "cHello ab\n"}]}, []))
+
+    def test_batch_update_replaces_the_snapshot(self):
+        self.seeded()
+        tail = self.log("c")
+        apply_operations(self.owner, [{"op": "update", "id": self.note.id, "content": "<p>Batch</p>"}])
+        self.assertEqual(get_snapshot(self.note.id), (None, [], tail))
+
+
+class PresenceTests(SimpleTestCase):
+    """Several workers, each with its own presence client on one shared store."""
+
+    def test_counts_agree_across_workers(self):
+        store = {}
+        workers = [InMemoryPresence(ttl=30, store=store) for _ in range(3)]
+
+        async def scenario():
+            for i, worker in enumerate(workers):
+                for j in range(i + 1):
+                    await worker.join(1, f'worker{i}.socket{j}')
+            await workers[2].join(2, 'worker2.other-note')
+            joined = [await worker.count(1) for worker in workers]
+            await workers[1].leave(1, 'worker1.socket0')
+            left = [await worker.count(1) for worker in workers]
+            return joined, left, await workers[0].count(2)
+
+        joined, left, other = asyncio.run(scenario())
+        self.assertEqual(joined, [6, 6, 6])
+        self.assertEqual(left, [5, 5, 5])
+        self.assertEqual(other, 1)
+
+    def test_members_without_heartbeat_expire(self):
+        store = {}
+        crashed, alive = InMemoryPresence(ttl=30, store=store), InMemoryPresence(ttl=30, store=store)
+
+        async def scenario():
+            await crashed.join(1, 'crashed.socket')
+            await alive.join(1, 'alive.socket')
+            with mock.patch('notes.presence.time.time', return_value=time.time() + 20):
+                await alive.heartbeat(1, 'alive.socket')
+            # The crashed worker never ran disconnect or sent another heartbeat
+            with mock.patch('notes.presence.time.time', return_value=time.time() + 40):
+                return await alive.count(1)
+
+        self.assertEqual(asyncio.run(scenario()), 1)
+
+    def test_broadcasts_are_debounced_per_note(self):
+        presence = InMemoryPresence(ttl=30)
+        broadcaster = PresenceBroadcaster(presence, delay=0.05)
+        layer = mock.Mock(group_send=mock.AsyncMock())
+
+        async def scenario():
+            for i in range(10):
+                await presence.join(1, f'socket{i}')
+                broadcaster.schedule(layer, 1, force=True)
+            await presence.join(2, 'socket')
+            broadcaster.schedule(layer, 2, force=True)
+            await asyncio.sleep(0.1)
+            # A heartbeat check with an unchanged count sends nothing
+            broadcaster.schedule(layer, 1)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        self.assertEqual(sorted(call.args for call in layer.group_send.call_args_list), [
+            ('note_1', {'type': 'user_count_update', 'count': 10}),
+            ('note_2', {'type': 'user_count_update', 'count': 1}),
+        ])
+
+
+@test_settings
+class PresenceBroadcastTests(RealtimeTestCase):
+    def setUp(self):
+        # Sockets on this worker and on a second one share the store
+        self.store = {}
+        super().setUp()
+        patch_presence(self, InMemoryPresence(store=self.store))
+
+    def test_user_count_includes_members_on_other_workers(self):
+        other_worker = InMemoryPresence(store=self.store)
+
+        async def scenario():
+            await other_worker.join(self.note.id, 'other-worker.socket')
+            first = await self.connect()
+            second = await self.connect()
+            counts = [(await self.receive(communicator, 'user_count'))['count'] for communicator in (first, second)]
+            await second.disconnect()
+            after_leave = (await self.receive(first, 'user_count'))['count']
+            await first.disconnect()
+            return counts, after_leave, await other_worker.count(self.note.id)
+
+        counts, after_leave, remaining = asyncio.run(scenario())
+        self.assertEqual(counts, [3, 3])
+        self.assertEqual(after_leave, 2)
+        self.assertEqual(remaining, 1)
@@ -0,0 +1,116 @@
+import random
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from notes.models import Note, NoteRevision
+from notes.revisions import apply_delta, get_revision_content, make_delta, record_revisions
+
+from .helpers import make_user, test_settings
+
+WORDS = ["note", "café", "<b>", "</b>", "<p>", "</p>", " ", "  ", "\n", "todo", "<a href='x'>", "</a>", "😀"]
+
+
+def random_edit(rng, text):
+    """`text` with a few words inserted, deleted or replaced somewhere."""
+    for _ in range(rng.randint(1, 4)):
+        start = rng.randint(0, len(text))
+        end = min(len(text), start + rng.randint(0, 12))
+        inserted = "".join(rng.choice(WORDS) for _ in range(rng.randint(0, 5)))
+        text = text[:start] + inserted + text[end:]
+    return text
+
+
+class DeltaTests(SimpleTestCase):
+    def test_random_edits_round_trip(self):
+        rng = random.Random(21)
+        text = "<p>" + " ".join(rng.choice(WORDS) for _ in range(200)) + "</p>"
+        for _ in range(500):
+            edited = random_edit(rng, text)
+            self.assertEqual(apply_delta(text, make_delta(text, edited)), edited)
+            text = edited
+
+    def test_local_edit_is_mostly_copies(self):
+        old = "<p>" + "word " * 1000 + "</p>"
+        new = old.replace("word", "WORD", 1)
+        ops = make_delta(old, new)
+        self.assertLess(sum(len(op) for op in ops if isinstance(op, str)), 10)
+        self.assertEqual(apply_delta(old, ops), new)
+
+    def test_unrelated_and_empty_texts(self):
+        for old, new in [("", "<p>new</p>"), ("<p>old</p>", ""), ("abc", "xyz"), ("", "")]:
+            self.assertEqual(apply_delta(old, make_delta(old, new)), new)
+
+
+@test_settings
+@override_settings(NOTE_REVISION_KEYFRAME_INTERVAL=5)
+class RevisionHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('notes.views.schedule_categorization')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = make_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def write_history(self, edits):
+        rng = random.Random(edits)
+        contents = ["<p>First draft</p>"]
+        note_id = self.client.post('/api/notes/', {'title': 'Draft', 'content': contents[0]}, format='json').data['id']
+        for _ in range(edits):
+            contents.append(random_edit(rng, contents[-1]))
+            self.client.patch(f'/api/notes/{note_id}/', {'content': contents[-1]}, format='json')
+        return note_id, contents
+
+    def test_every_revision_round_trips_across_keyframes(self):
+        note_id, contents = self.write_history(13)
+
+        self.assertEqual(list(NoteRevision.objects.filter(note_id=note_id, is_keyframe=True)
+                              .values_list('number', flat=True)), [1, 6, 11])
+        for number, content in enumerate(contents, start=1):
+            with self.subTest(revision=number), self.assertNumQueries(1):
+                revision, rebuilt = get_revision_content(note_id, number)
+            self.assertEqual(rebuilt, content)
+            self.assertEqual(revision.size, len(content))
+        self.assertIsNone(get_revision_content(note_id, len(contents) + 1))
+
+    def test_endpoints(self):
+        note_id, contents = self.write_history(6)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/notes/{note_id}/revisions/', {'page_size': 3})
+        self.assertEqual([entry['number'] for entry in response.data['results']], [7, 6, 5])
+        self.assertFalse(any('"data"' in query['sql'] for query in queries))
+
+        response = self.client.get(f'/api/notes/{note_id}/revisions/4/')
+        self.assertEqual(response.data['content'], contents[3])
+        self.assertEqual(self.client.get(f'/api/notes/{note_id}/revisions/99/').status_code, 404)
+
+        # Only readers of the note see its history
+        self.client.force_authenticate(make_user('bob'))
+        self.assertEqual(self.client.get(f'/api/notes/{note_id}/revisions/1/').status_code, 404)
+
+    def test_bulk_recorded_revisions_continue_each_chain(self):
+        notes = [Note.objects.create(user=self.user, content=f"<p>Note {i}</p>") for i in range(3)]
+        record_revisions([(note, None) for note in notes])
+        expected = {note.id: [note.content] for note in notes}
+        for i in range(6):
+            changes = []
+            for note in notes:
+                previous = note.content
+                note.content = f"{previous}<p>round {i}</p>"
+                expected[note.id].append(note.content)
+                changes.append((note, previous))
+            with self.assertNumQueries(2):
+                record_revisions(changes)
+
+        for note in notes:
+            for number, content in enumerate(expected[note.id], start=1):
+                self.assertEqual(get_revision_content(note.id, number)[1], content)
+            self.assertEqual(list(NoteRevision.objects.filter(note=note, is_keyframe=True)
+                                  .values_list('number', flat=True)), [1, 6])
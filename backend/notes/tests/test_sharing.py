@@ -0,0 +1,121 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from notes.models import Invite, Note, OutboxEmail, SharedNote
+from notes.sharing import bulk_share, resolve_users
+
+from .helpers import make_user, test_settings
+
+
+@test_settings
+class BulkShareTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('notes.outbox.get_email_dispatcher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.notes = [Note.objects.create(user=self.owner, title=f"Note {i}") for i in range(3)]
+        self.note_ids = [note.id for note in self.notes]
+
+    def statuses(self, report):
+        return {(entry['note_id'], entry['email']): entry['status'] for entry in report}
+
+    def test_addresses_match_existing_users_whatever_their_case(self):
+        alice = make_user('alice')
+        report = bulk_share(self.owner, self.note_ids[:1], ['ALICE@Example.com', 'alice@example.com'])
+
+        self.assertEqual(report, [{'note_id': self.note_ids[0], 'email': 'ALICE@Example.com', 'status': 'shared'}])
+        self.assertEqual(list(SharedNote.objects.values_list('user_id', flat=True)), [alice.id])
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_placeholder_accounts_are_created_once_and_normalized(self):
+        bulk_share(self.owner, self.note_ids[:1], ['New.Person@Example.com'])
+        report = bulk_share(self.owner, self.note_ids[:2], ['new.person@example.com'])
+
+        user = User.objects.get(email='new.person@example.com')
+        self.assertEqual(user.username, 'new.person@example.com')
+        self.assertEqual(SharedNote.objects.filter(user=user).count(), 2)
+        self.assertEqual(self.statuses(report), {
+            (self.note_ids[0], 'new.person@example.com'): 'already_shared',
+            (self.note_ids[1], 'new.person@example.com'): 'shared',
+        })
+
+    def test_taken_username_is_reported_instead_of_failing(self):
+        # An account named after the address, but with another email
+        User.objects.create(username='taken@example.com', email='other@example.com')
+        report = bulk_share(self.owner, self.note_ids[:1], ['taken@example.com', 'free@example.com'])
+
+        self.assertEqual(self.statuses(report), {
+            (self.note_ids[0], 'taken@example.com'): 'unresolved_email',
+            (self.note_ids[0], 'free@example.com'): 'shared',
+        })
+        self.assertEqual(OutboxEmail.objects.get().recipient, 'free@example.com')
+
+    def test_statuses_for_every_note_and_address(self):
+        SharedNote.objects.create(note=self.notes[0], user=make_user('bob'))
+        report = bulk_share(self.owner, [self.note_ids[0], 999], ['bob@example.com', 'owner@example.com', 'nope'])
+
+        self.assertEqual(self.statuses(report), {
+            (999, 'bob@example.com'): 'note_not_found',
+            (999, 'owner@example.com'): 'note_not_found',
+            (999, 'nope'): 'invalid_email',
+            (self.note_ids[0], 'nope'): 'invalid_email',
+            (self.note_ids[0], 'bob@example.com'): 'already_shared',
+            (self.note_ids[0], 'owner@example.com'): 'owner',
+        })
+
+    def test_invites_create_tokens_and_one_email_per_recipient(self):
+        report = bulk_share(self.owner, self.note_ids, ['a@example.com', 'b@example.com'], invite=True)
+        self.assertEqual(set(self.statuses(report).values()), {'invited'})
+        self.assertEqual(Invite.objects.count(), 6)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+        for email in OutboxEmail.objects.all():
+            self.assertEqual(email.body.count('?token='), 3)
+
+    def test_query_count_does_not_grow_with_notes_or_recipients(self):
+        notes = [Note.objects.create(user=self.owner) for _ in range(11)]
+        with CaptureQueriesContext(connection) as small:
+            bulk_share(self.owner, [notes[0].id], ['one@example.com'])
+        # Kept under the rows sqlite takes in a single INSERT
+        with CaptureQueriesContext(connection) as large:
+            bulk_share(self.owner, [note.id for note in notes[1:]], [f'user{i}@example.com' for i in range(10)])
+        self.assertEqual(len(small), len(large))
+
+
+@test_settings
+class ResolveUsersTests(TestCase):
+    def test_oldest_account_wins_for_a_shared_address(self):
+        first = User.objects.create(username='first', email='Same@example.com')
+        User.objects.create(username='second', email='same@example.com')
+        self.assertEqual(resolve_users(['SAME@example.com']), {'same@example.com': first})
+
+
+@test_settings
+class BulkShareEndpointTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('notes.outbox.get_email_dispatcher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = make_user('owner')
+        self.note = Note.objects.create(user=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_requests_are_validated(self):
+        for data in [{}, {'note_ids': [self.note.id]}, {'note_ids': ['x'], 'emails': ['a@example.com']}]:
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post('/api/notes/bulk_share/', data, format='json').status_code, 400)
+        with self.settings(BULK_SHARE_MAX_RECIPIENTS=1):
+            response = self.client.post('/api/notes/bulk_share/', {
+                'note_ids': [self.note.id], 'emails': ['a@example.com', 'b@example.com']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_results_are_returned(self):
+        response = self.client.post('/api/notes/bulk_share/', {
+            'note_ids': [self.note.id], 'emails': ['a@example.com']}, format='json')
+        self.assertEqual(response.data['results'], [{'note_id': self.note.id, 'email': 'a@example.com', 'status': 'shared'}])
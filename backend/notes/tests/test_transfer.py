@@ -0,0 +1,130 @@
+import io
+import json
+import tracemalloc
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from notes.models import Category, Note, NoteRevision
+from notes.transfer import EXPORT_ENTRY, export_records, import_notes, ndjson_chunks
+
+from .helpers import make_user, test_settings
+
+
+def note_content(i):
+    # Distinct text per note, so neither compression nor interning hides the size
+    return "<p>" + " ".join(f"word{i}-{j}" for j in range(400)) + "</p>"
+
+
+def peak_memory(chunks):
+    """Total bytes of `chunks` and the peak memory allocated while reading them."""
+    tracemalloc.start()
+    try:
+        total = sum(len(chunk) for chunk in chunks)
+        return total, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@test_settings
+@override_settings(NOTE_EXPORT_BATCH_SIZE=50, NOTE_IMPORT_BATCH_SIZE=50)
+class TransferTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def make_notes(self, count):
+        work = Category.objects.create(user=self.owner, name="Work")
+        ideas = Category.objects.create(user=self.owner, name="Ideas")
+        Note.objects.bulk_create(
+            Note(user=self.owner, title=f"Note {i}", content=note_content(i),
+                 user_updated_category=work if i % 2 else None, ai_generated_category=ideas)
+            for i in range(count))
+
+    def export(self, **params):
+        response = self.client.get('/api/notes/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def upload(self, user, data, name):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/notes/import/', {'file': SimpleUploadedFile(name, data)}, format='multipart')
+
+    def imported(self, user):
+        return [(note.title, note.content, note.user_updated_category and note.user_updated_category.name,
+                 note.ai_generated_category and note.ai_generated_category.name)
+                for note in Note.objects.filter(user=user).select_related(
+                    'user_updated_category', 'ai_generated_category').order_by('id')]
+
+    def test_export_memory_does_not_grow_with_the_notes(self):
+        self.make_notes(1000)
+        total, peak = peak_memory(ndjson_chunks(export_records(self.owner)))
+        self.assertGreater(total, 4_000_000)
+        # A few batches of rows and a chunk or two, never the whole export
+        self.assertLess(peak, total / 4)
+
+    def test_zip_export_streams_the_ndjson_entry(self):
+        self.make_notes(3)
+        ndjson = self.export()
+        response = self.client.get('/api/notes/export/', {'type': 'zip'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('.zip"', response['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.read(EXPORT_ENTRY), ndjson)
+
+    def test_export_holds_only_the_users_own_notes(self):
+        self.make_notes(2)
+        Note.objects.create(user=make_user('bob'), title="Bob's")
+        records = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([record['title'] for record in records], ["Note 0", "Note 1"])
+        self.assertEqual(records[1]['content'], note_content(1))
+        self.assertEqual((records[1]['category'], records[1]['ai_category']), ("Work", "Ideas"))
+
+    def test_ndjson_and_zip_exports_round_trip(self):
+        self.make_notes(120)
+        expected = self.imported(self.owner)
+        for kind, name in [('ndjson', 'notes.ndjson'), ('zip', 'notes.zip')]:
+            with self.subTest(kind=kind):
+                self.client.force_authenticate(self.owner)
+                data = self.export(type=kind)
+                user = make_user(f'{kind}-reader')
+                response = self.upload(user, data, name)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data['imported'], 120)
+                self.assertEqual(self.imported(user), expected)
+                self.assertEqual(NoteRevision.objects.filter(note__user=user).count(), 120)
+                self.assertEqual(set(Category.objects.filter(user=user).values_list('name', flat=True)),
+                                 {"Work", "Ideas"})
+
+    def test_import_queries_are_per_batch(self):
+        lines = [json.dumps({'title': f"Note {i}", 'content': "<p>x</p>", 'category': f"Cat {i % 3}"}).encode()
+                 for i in range(150)]
+        # Categories are looked up and created by the first batch only
+        with self.assertNumQueries(2 + 2 + 3 * 2):
+            self.assertEqual(import_notes(self.owner, lines), 150)
+        self.assertEqual(Category.objects.filter(user=self.owner).count(), 3)
+
+    def test_invalid_records_import_nothing(self):
+        Category.objects.create(user=self.owner, name="Work")
+        for data, message in [
+            (b'{"title": "Fine"}\nnot json\n', "Line 2 is not valid JSON."),
+            (b'[1, 2]\n', "Line 1 is not a JSON object."),
+            (b'{"title": 5}\n', "Line 1: 'title' must be a string of at most 255 characters."),
+        ]:
+            with self.subTest(data=data):
+                response = self.upload(self.owner, data, 'notes.ndjson')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['message'], message)
+        self.assertFalse(Note.objects.exists())
+        self.assertEqual(self.upload(self.owner, b'', 'notes.ndjson').data['imported'], 0)
+
+    def test_archive_without_the_entry_is_refused(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('other.txt', "hello")
+        response = self.upload(self.owner, buffer.getvalue(), 'notes.zip')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post('/api/notes/import/', {}, format='multipart').status_code, 400)
@@ -0,0 +1,93 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache of bearer tokens that already passed verification.
+
+    Entries are keyed by a SHA-256 digest of the token (the raw token is
+    never stored) and hold the decoded claims plus the resolved user, so a
+    repeat request skips both the RS256 check and the user query. Each
+    entry expires at the token's own `exp` claim. A plain lock guards the
+    dict; every operation is O(1), so it is safe to call from the event
+    loop as well as from request threads.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize if maxsize is not None else getattr(
+            settings, 'VERIFIED_TOKEN_CACHE_SIZE', 1024)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        """Returns `(claims, user)` for a cached token, or None."""
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            claims, user_id, user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        # Hand out a copy so per-request mutations never leak between requests
+        return claims, copy.copy(user)
+
+    def set(self, token, claims, user):
+        expires_at = claims.get("exp")
+        if not expires_at or self.maxsize <= 0:
+            return
+
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = (claims, user.pk, user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1] == user_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+token_cache = VerifiedTokenCache()
@@ -0,0 +1,198 @@
+import io
+import json
+import zipfile
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
+
+from .caching import invalidate_categories, invalidate_notes
+from .models import Category, Note, NoteRevision
+from .revisions import build_revision
+
+# Name of the NDJSON file inside zip exports
+EXPORT_ENTRY = 'notes.ndjson'
+# Bytes gathered before a chunk is handed to the response or file
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def export_records(user):
+    """The user's own notes as export records, read NOTE_EXPORT_BATCH_SIZE rows at a time."""
+    rows = (Note.objects
+            .filter(user=user)
+            .order_by('id')
+            .values_list('id', 'title', 'content', 'user_updated_category__name',
+                         'ai_generated_category__name', 'created_at', 'updated_at')
+            .iterator(chunk_size=settings.NOTE_EXPORT_BATCH_SIZE))
+    for note_id, title, content, category, ai_category, created_at, updated_at in rows:
+        yield {
+            "id": note_id,
+            "title": title,
+            "content": str(content),
+            "category": category,
+            "ai_category": ai_category,
+            "created_at": created_at.isoformat(),
+            "updated_at": updated_at.isoformat(),
+        }
+
+
+def ndjson_chunks(records):
+    """One JSON line per record, joined into chunks of about STREAM_CHUNK_SIZE bytes."""
+    buffer, size = [], 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False).encode() + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+class _ChunkWriter(io.RawIOBase):
+    """Unseekable file keeping what zipfile writes until it's taken."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_chunks(records):
+    """A zip archive holding the NDJSON export as EXPORT_ENTRY, compressed as it's streamed."""
+    output = _ChunkWriter()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        # The size isn't known up front, so allow for a large entry
+        with archive.open(EXPORT_ENTRY, 'w', force_zip64=True) as entry:
+            for chunk in ndjson_chunks(records):
+                entry.write(chunk)
+                data = output.take()
+                if data:
+                    yield data
+    yield output.take()
+
+
+def streaming_response(request, chunks, content_type, filename):
+    """
+    A download streaming `chunks`. Under ASGI Django would read a
+    synchronous iterator to the end before sending anything, so there each
+    chunk is produced in turn on the sync thread instead.
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = _iterate_async(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+async def _iterate_async(chunks):
+    # Always the same thread, which holds the cursor being read
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await step(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def open_export(file):
+    """The lines of an export file: NDJSON, or a zip archive as made by `zip_chunks`."""
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        try:
+            return zipfile.ZipFile(file).open(EXPORT_ENTRY)
+        except KeyError:
+            raise ImportFormatError(f"The archive has no {EXPORT_ENTRY}.")
+    file.seek(0)
+    return file
+
+
+def read_records(lines):
+    """`(line number, record)` for each non-blank NDJSON line, parsed as it's read."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ImportFormatError(f"Line {number} is not valid JSON.")
+        if not isinstance(record, dict):
+            raise ImportFormatError(f"Line {number} is not a JSON object.")
+        yield number, record
+
+
+def _text(record, number, key, max_length=None):
+    value = record.get(key)
+    if value is not None and (not isinstance(value, str) or (max_length and len(value) > max_length)):
+        limit = f" of at most {max_length} characters" if max_length else ""
+        raise ImportFormatError(f"Line {number}: '{key}' must be a string{limit}.")
+    return value
+
+
+def import_notes(user, lines):
+    """
+    Adds the notes in NDJSON `lines` (records as written by the export; ids
+    and timestamps are not kept) to the user's notes. Records are parsed as
+    they're read and inserted NOTE_IMPORT_BATCH_SIZE at a time: per batch,
+    one lookup and one insert of missing categories, one insert of notes
+    and one of their first revisions. Nothing is imported if any record is
+    invalid. Returns the number of notes imported.
+    """
+    categories = {}
+    imported = 0
+    records = read_records(lines)
+    with transaction.atomic():
+        while batch := list(islice(records, settings.NOTE_IMPORT_BATCH_SIZE)):
+            imported += _import_batch(user, batch, categories)
+        # Bulk inserts send no signals
+        invalidate_notes(user_ids=[user.id])
+        invalidate_categories(user.id)
+    return imported
+
+
+def _import_batch(user, batch, categories):
+    parsed = []
+    for number, record in batch:
+        title = _text(record, number, 'title', Note._meta.get_field('title').max_length)
+        content = _text(record, number, 'content') or ""
+        category = _text(record, number, 'category', Category._meta.get_field('name').max_length)
+        ai_category = _text(record, number, 'ai_category', Category._meta.get_field('name').max_length)
+        parsed.append((title if title is not None else "Untitled", content, category, ai_category))
+
+    # Categories are looked up by name for this batch, remembering them for the next
+    missing = {name for _, _, *names in parsed for name in names if name and name not in categories}
+    if missing:
+        for category in Category.objects.filter(user=user, name__in=missing).order_by('id'):
+            categories.setdefault(category.name, category)
+        created = Category.objects.bulk_create(
+            Category(user=user, name=name) for name in missing if name not in categories)
+        categories.update((category.name, category) for category in created)
+
+    notes = []
+    for title, content, category, ai_category in parsed:
+        note = Note(user=user, title=title, content=content,
+                    user_updated_category=categories.get(category),
+                    ai_generated_category=categories.get(ai_category))
+        note.fill_derived_fields()
+        notes.append(note)
+    Note.objects.bulk_create(notes)
+    NoteRevision.objects.bulk_create(build_revision(note, None, None) for note in notes)
+    return len(notes)
@@ -1,38 +1,42 @@
+import difflib
+import hashlib
 import json
+from functools import lru_cache
 
-import jwt
-import requests
+from jose import jwt
 
 from django.conf import settings
+from django.utils import timezone
 from openai import OpenAI
 from bs4 import BeautifulSoup
 from django.conf import settings
-from .models import Category
+from .caching import invalidate_categories
+from .jwks import jwks_store
+from .models import Category, CategoryCacheEntry
 from django.db.utils import IntegrityError
 import logging
 
-open_ai_client = OpenAI(
-    api_key=settings.OPENAI_API_KEY,
-)
-
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_open_ai_client():
+    """The OpenAI client is only created once something actually needs it."""
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+    )
+
+
 
 def jwt_decode_token(token):
     header = jwt.get_unverified_header(token)
-    jwks = requests.get(
-        'https://{}/.well-known/jwks.json'.format(settings.AUTH0_DOMAIN)).json()
-    public_key = None
-    for jwk in jwks['keys']:
-        if jwk['kid'] == header['kid']:
-            public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+    public_key = jwks_store.get_key(header.get('kid'))
 
     if public_key is None:
         raise Exception('Public key not found.')
 
     issuer = 'https://{}/'.format(settings.AUTH0_DOMAIN)
-    return jwt.decode(token, public_key, audience=settings['JWT_AUTH']['JWT_AUDIENCE'], issuer=issuer, algorithms=['RS256'])
+    return jwt.decode(token, public_key, audience=settings.API_IDENTIFIER, issuer=issuer, algorithms=['RS256'])
 
 
 
@@ -43,35 +47,124 @@ def extract_text_from_rich_content(rich_content):
     return soup.get_text(separator=" ", strip=True)
 
 
+def content_hash(plain_text):
+    """Hash of the text with case and whitespace differences normalized away."""
+    normalized = " ".join(plain_text.lower().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def needs_reclassification(categorized_text, plain_text):
+    """
+    True when `plain_text` differs from the text the current category was
+    assigned for by at least CATEGORY_RECLASSIFY_MIN_CHANGE (a 0-1 fraction
+    of words), so small edits keep the current category.
+    """
+    previous_words = (categorized_text or "").lower().split()
+    words = (plain_text or "").lower().split()
+    if previous_words == words:
+        return False
+    similarity = difflib.SequenceMatcher(None, previous_words, words).ratio()
+    return 1 - similarity >= settings.CATEGORY_RECLASSIFY_MIN_CHANGE
+
+
+def get_cached_category(plain_text, user):
+    entry = (CategoryCacheEntry.objects
+             .filter(user=user, content_hash=content_hash(plain_text))
+             .select_related('category')
+             .first())
+    if entry is None:
+        return None
+    CategoryCacheEntry.objects.filter(pk=entry.pk).update(last_used_at=timezone.now())
+    return entry.category
+
+
+def cache_category(plain_text, user, category):
+    CategoryCacheEntry.objects.update_or_create(
+        user=user, content_hash=content_hash(plain_text), defaults={'category': category})
+
+    # Keep only the most recently used entries for this user
+    stale_ids = (CategoryCacheEntry.objects
+                 .filter(user=user)
+                 .order_by('-last_used_at')
+                 .values_list('id', flat=True)[settings.CATEGORY_CACHE_MAX_ENTRIES:])
+    stale_ids = list(stale_ids)
+    if stale_ids:
+        CategoryCacheEntry.objects.filter(id__in=stale_ids).delete()
+
+
 def generate_or_get_category_from_content(rich_content, user):
-    """Generates a category name using OpenAI ChatCompletion or retrieves an existing category."""
-    return None  # Remove this line and implement the function
+    """Generates a category name with the configured classifier or retrieves an existing category."""
+    if not settings.AI_CATEGORIZATION_ENABLED:
+        return None
     plain_text_content = extract_text_from_rich_content(rich_content)
 
-    try:
-        # Generate category name using OpenAI's ChatCompletion API
-        response = open_ai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that categorizes note content."},
-                {"role": "user", "content": f"Categorize the following note content: '{plain_text_content}'"}
-            ],
-            max_tokens=10,
-            temperature=0.3
-        )
-        category_name = response.choices[0].message.content.strip()
+    cached_category = get_cached_category(plain_text_content, user)
+    if cached_category:
+        return cached_category
 
-    except Exception as e:
-        logger.error(f"OpenAI API error: {e}")
+    # Imported here because the classifiers build on the helpers in this module
+    from .classifiers import get_classifier
+
+    category_name, confidence = get_classifier().classify(plain_text_content, user)
+    if not category_name:
         return None  # Return None or handle the fallback in your application
 
     # Check if the category already exists for the user or create it
     try:
         category, created = Category.objects.get_or_create(name=category_name, user=user)
+        cache_category(plain_text_content, user, category)
         return category
     except IntegrityError as e:
         logger.error(f"Database error creating category '{category_name}' for user '{user.id}': {e}")
         return None  # Return None or handle the fallback in your application
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def generate_category_names(plain_texts):
+    """
+    Classifies several notes with a single ChatCompletion.
+    Returns one category name (or None) per text, in the same order.
+    """
+    numbered_notes = "\n".join(
+        f"{index + 1}. {' '.join(text.split())[:settings.CATEGORIZATION_BATCH_NOTE_CHARS]}"
+        for index, text in enumerate(plain_texts))
+
+    try:
+        response = get_open_ai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that categorizes note content. "
+                                              "Reply only with a JSON array containing one short category name per note, in order."},
+                {"role": "user", "content": f"Categorize the following notes:\n{numbered_notes}"}
+            ],
+            max_tokens=10 * len(plain_texts) + 10,
+            temperature=0.3
+        )
+        category_names = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        logger.error(f"OpenAI API error: {e}")
+        return [None] * len(plain_texts)
+
+    if not isinstance(category_names, list) or len(category_names) != len(plain_texts):
+        logger.error(f"Unexpected batch categorization reply: {category_names!r}")
+        return [None] * len(plain_texts)
+
+    return [str(name).strip()[:100] if name else None for name in category_names]
+
+
+def resolve_categories(user_id, category_names):
+    """Returns {name: Category} for the user, creating the missing ones in bulk."""
+    category_names = {name for name in category_names if name}
+    if not category_names:
+        return {}
+    categories = {category.name: category for category in
+                  Category.objects.filter(user_id=user_id, name__in=category_names)}
+
+    missing = [Category(name=name, user_id=user_id) for name in category_names if name not in categories]
+    if missing:
+        categories.update({category.name: category for category in
+                           Category.objects.bulk_create(missing)})
+        invalidate_categories(user_id)
+    return categories
@@ -1,18 +1,37 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
 from django.utils import timezone
-from django.core.mail import send_mail
+from django.utils.cache import get_conditional_response
+from django.db import transaction
 from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import viewsets
 from django.conf import settings
-from .models import Note, Invite, SharedNote, Category
+from .models import Note, Invite, SharedNote, Category, NoteTombstone, NoteRevision
 from django.contrib.auth.models import User
 import uuid
-from .serializers import NoteSerializer, CategorySerializer
-from .utils import generate_or_get_category_from_content
-from django.db.models import Q
+from .pagination import NoteCursorPagination, NoteSearchPagination, NoteRevisionPagination
+from .serializers import (NoteSerializer, NoteListSerializer, NoteSearchSerializer, CategorySerializer,
+                          CategoryCountSerializer, NoteRevisionSerializer)
+from .batch import apply_operations
+from .categorization import schedule_categorization
+from .deltas import reset_snapshots
+from .outbox import queue_email
+from .sharing import bulk_share
+from .revisions import get_revision_content, lock_stored_text, record_revision
+from .search import set_headlines
+from .transfer import (ImportFormatError, export_records, import_notes, ndjson_chunks, open_export,
+                       streaming_response, zip_chunks)
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, Exists, F, OuterRef, Q
 from rest_framework.exceptions import NotFound, PermissionDenied
 from .permissions import TokenOrIsAuthenticated
+from .invites import get_request_invite
+from .conditional import last_modified, note_etag, note_page_etag, set_validators
+from .access import check_note_access, visible_to
+from .caching import note_scope, response_cache, user_scope
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -22,6 +41,13 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Category.objects.filter(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        # Categories rarely change, so the list is cached until one of them does
+        data = response_cache.get_or_set(
+            'categories', [user_scope(request.user.id, 'categories')],
+            lambda: list(self.get_serializer(self.get_queryset(), many=True).data))
+        return Response(data)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -29,6 +55,16 @@ class CategoryViewSet(viewsets.ModelViewSet):
 class NoteViewSet(viewsets.ModelViewSet):
     serializer_class = NoteSerializer
     permission_classes = [TokenOrIsAuthenticated]
+    pagination_class = NoteCursorPagination
+    # Actions that serialize lean list entries rather than full notes
+    list_actions = ('list', 'search', 'sync')
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'sync'):
+            return NoteListSerializer
+        if self.action == 'search':
+            return NoteSearchSerializer
+        return NoteSerializer
 
     def get_queryset(self):
         user = self.request.user if self.request.user.is_authenticated else None
@@ -36,100 +72,322 @@ class NoteViewSet(viewsets.ModelViewSet):
 
         # If a valid token is provided, filter by invited notes
         if token:
-            try:
-                invite = Invite.objects.get(
-                    token=token, expires_at__gt=timezone.now())
-                # Return only the invited note if accessed via a valid invite token
-                return Note.objects.filter(id=invite.note_id)
-            except Invite.DoesNotExist:
+            invite = get_request_invite(self.request)
+            if invite is None:
                 raise NotFound("Invalid or expired token.")
-
-        # Default queryset if the user is authenticated (owned and shared notes)
-        if user:
-            queryset = Note.objects.filter(
-                Q(user=user) | Q(shared_with__user=user)
-            ).distinct()
+            # Return only the invited note if accessed via a valid invite token
+            queryset = self.base_queryset().filter(id=invite.note_id)
+
+        # Default queryset if the user is authenticated (owned and shared notes).
+        # A subquery rather than a join, so rows are never duplicated and no
+        # DISTINCT over the whole row is needed
+        elif user:
+            queryset = self.base_queryset().filter(visible_to(user))
         else:
             queryset = Note.objects.none()  # No results if unauthenticated and no token
 
         # Apply category filter if provided
         category_name = self.request.query_params.get('category')
         if category_name:
-            queryset = queryset.filter(
-                Q(user_updated_category__name=category_name) |
-                Q(ai_generated_category__name=category_name)
-            )
+            queryset = queryset.filter(effective_category__name=category_name)
+
+        # Lists only show the snippet and the history has its own copies of
+        # the content, so leave it behind. Search results keep the content:
+        # their headlines are built from it, and only the page's rows are
+        # ever read
+        if self.action in ('list', 'sync', 'revisions', 'revision'):
+            queryset = queryset.defer('content')
 
         return queryset
 
-    def get_object(self):
-        """Override get_object to allow token-based access."""
-        token = self.request.query_params.get("token")
-        if token:
-            try:
-                invite = Invite.objects.get(
-                    token=token, expires_at__gt=timezone.now())
-                return invite.note
-            except Invite.DoesNotExist:
+    def base_queryset(self):
+        # List entries only show the effective category, full notes show both.
+        # The search vector, the collaborative snapshot and the categorized
+        # text are never serialized, and leaving them unloaded means save()
+        # never writes back a stale copy over one just stored elsewhere
+        if self.action in self.list_actions:
+            related = ('effective_category',)
+        else:
+            related = ('user_updated_category', 'ai_generated_category')
+        return Note.objects.select_related(*related).defer('search_vector', 'content_delta', 'snapshot_version',
+                                                          'categorized_text')
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        # The page is fetched without content anyway, so it is its own
+        # validator; only serialization is skipped when it's unchanged.
+        # No Last-Modified: a note dropping off the page doesn't change it
+        etag = note_page_etag(page, request.user,
+                              (self.paginator.get_next_link(), self.paginator.get_previous_link()))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return set_validators(not_modified, etag)
+
+        serializer = self.get_serializer(page, many=True)
+        return set_validators(self.get_paginated_response(serializer.data), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        note_id = self.get_note_id()
+        note, store = response_cache.get('note', [note_scope(note_id)])
+        if note is None and ('HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META):
+            # Not cached: check the validators against a row without the
+            # content columns first, so an unchanged note is never read in
+            # full, serialized or cached
+            current = self.get_note(note_id, self.base_queryset().only(
+                'id', 'updated_at', 'user', 'user_updated_category__name', 'ai_generated_category__name'))
+            validators = {'etag': note_etag(current, request.user), 'last_modified': last_modified(current)}
+            not_modified = get_conditional_response(request, **validators)
+            if not_modified is not None:
+                return set_validators(not_modified, **validators)
+        if note is None:
+            note = self.get_note(note_id, self.base_queryset())
+            store(note)
+
+        validators = {'etag': note_etag(note, request.user), 'last_modified': last_modified(note)}
+        not_modified = get_conditional_response(request, **validators)
+        if not_modified is not None:
+            return set_validators(not_modified, **validators)
+
+        serializer = self.get_serializer(note)
+        return set_validators(Response(serializer.data), **validators)
+
+    def get_note_id(self):
+        """
+        The id of the note to retrieve, once access to it is decided for this
+        request: the invite's note for a token, otherwise ownership or a
+        share (check_note_access, whose entries are dropped whenever a share
+        changes). The note itself is shared by all of its readers through
+        the response cache, and `is_owner` is worked out at serialization.
+        """
+        pk = self.kwargs['pk']
+        if not str(pk).isdigit():
+            raise NotFound()
+        note_id = int(pk)
+
+        if self.request.query_params.get("token"):
+            invite = get_request_invite(self.request)
+            if invite is None:
                 raise NotFound("Invalid or expired token.")
-
-        # Fall back to the default get_object behavior (authentication-based)
-        return super().get_object()
+            allowed = invite.note_id == note_id
+        else:
+            allowed = check_note_access(note_id, self.request.user)
+        if not allowed:
+            raise NotFound()
+        return note_id
+
+    def get_note(self, note_id, queryset):
+        note = queryset.filter(pk=note_id).first()
+        if note is None:
+            raise NotFound()
+        self.check_object_permissions(self.request, note)
+        return note
 
     def perform_create(self, serializer):
         user = self.request.user
-        content = serializer.validated_data.get('content')
         user_category_id = serializer.validated_data.get(
             'user_updated_category')
 
-        if user_category_id:
-            ai_generated_category = None
-        else:
-            ai_generated_category = generate_or_get_category_from_content(
-                content, user)
+        with transaction.atomic():
+            note = serializer.save(user=user, ai_generated_category=None)
+            record_revision(note)
 
-        serializer.save(user=user, ai_generated_category=ai_generated_category)
+        # AI categorization runs in the background once the note is committed
+        if not user_category_id:
+            schedule_categorization(note)
 
     def perform_update(self, serializer):
         token = self.request.query_params.get("token")
         user = self.request.user if not token else None
 
         if token:
-            try:
-                invite = Invite.objects.get(
-                    token=token, expires_at__gt=timezone.now())
-                if invite.note != serializer.instance:
-                    raise PermissionDenied("Invalid token for this note.")
-            except Invite.DoesNotExist:
+            invite = get_request_invite(self.request)
+            if invite is None:
                 raise PermissionDenied("Invalid or expired token.")
+            if invite.note_id != serializer.instance.pk:
+                raise PermissionDenied("Invalid token for this note.")
         elif not user.is_authenticated:
             raise PermissionDenied(
                 "Authentication credentials were not provided.")
 
-        content = serializer.validated_data.get('content')
         user_category_id = serializer.validated_data.get(
             'user_updated_category')
 
-        if user_category_id:
-            ai_generated_category = None
-        else:
-            ai_generated_category = generate_or_get_category_from_content(
-                content, user)
-
-        serializer.save(ai_generated_category=ai_generated_category)
+        instance = serializer.instance
+        previous_content = instance.content
+        text_changed = any(field in serializer.validated_data and serializer.validated_data[field] != getattr(instance, field)
+                           for field in ('title', 'content'))
+        with transaction.atomic():
+            if text_changed:
+                # Lock the row so revisions are numbered and diffed in save order
+                previous_content = lock_stored_text(instance)
+            if user_category_id:
+                note = serializer.save(ai_generated_category=None)
+            else:
+                note = serializer.save()
+            if text_changed:
+                record_revision(note, previous_content)
+            if text_changed and str(note.content) != str(previous_content):
+                # The saved content is the document now; late joiners build on it
+                reset_snapshots([note.id])
+
+        if not user_category_id and 'content' in serializer.validated_data:
+            schedule_categorization(note)
+
+    @action(detail=True, methods=['get'])
+    def revisions(self, request, pk=None):
+        """The note's saved versions, newest first, without their content."""
+        note = self.get_object()
+        paginator = NoteRevisionPagination()
+        page = paginator.paginate_queryset(NoteRevision.objects.filter(note=note).defer('data'), request, view=self)
+        return paginator.get_paginated_response(NoteRevisionSerializer(page, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path=r'revisions/(?P<number>[0-9]+)')
+    def revision(self, request, pk=None, number=None):
+        """One saved version of the note, content included."""
+        note = self.get_object()
+        found = get_revision_content(note.id, int(number))
+        if found is None:
+            raise NotFound("Revision not found.")
+        revision, content = found
+        return Response({**NoteRevisionSerializer(revision).data, "content": content})
 
     @action(detail=False, methods=['get'])
-    def categories(self, request):
-        """Returns all categories available to the user (AI-generated and user-defined)"""
-        categories = Category.objects.filter(user=request.user)
-        user_categories = CategorySerializer(categories, many=True).data
-        ai_generated_categories = list(Note.objects.filter(user=request.user)
-                                       .values_list('ai_generated_category__name', flat=True).distinct())
+    def search(self, request):
+        """Full-text search over the notes the user can see, best matches first."""
+        terms = request.query_params.get('q', '').strip()
+        if not terms:
+            return Response({"message": "A search query is required."}, status=400)
+
+        query = SearchQuery(terms, search_type='websearch', config=settings.SEARCH_CONFIG)
+        queryset = (self.get_queryset()
+                    .filter(search_vector=query)
+                    .annotate(rank=SearchRank(F('search_vector'), query))
+                    .order_by('-rank', '-updated_at', '-id'))
+
+        paginator = NoteSearchPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        # Headlines only for the page, as the content is stored compressed
+        set_headlines(page, terms)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def sync(self, request):
+        """
+        Changes since `?since=<cursor>`: notes updated or newly shared after
+        it, and ids of notes deleted or unshared. Without a cursor every
+        note is returned. Each response carries the cursor for the next call.
+        """
+        now = timezone.now()
+        since = request.query_params.get('since')
+        queryset = self.filter_queryset(self.get_queryset())
+        deleted = set()
+        if since:
+            try:
+                since = datetime.fromtimestamp(float(since), tz=dt_timezone.utc)
+            except (ValueError, OverflowError):
+                return Response({"message": "Invalid sync cursor."}, status=400)
+            if since < now - timedelta(seconds=settings.NOTE_TOMBSTONE_RETENTION):
+                return Response({"message": "Sync cursor expired; reload all notes."}, status=410)
+
+            queryset = queryset.filter(
+                Q(updated_at__gt=since) |
+                Q(pk__in=SharedNote.objects.filter(user=request.user, created_at__gt=since).values('note'))
+            )
+            deleted = set(NoteTombstone.objects.filter(user_id=request.user.id, deleted_at__gt=since)
+                          .values_list('note_id', flat=True))
+
+        notes = list(queryset.order_by('-updated_at', '-id'))
+        # A note unshared and then shared again is back in the list
+        deleted -= {note.id for note in notes}
+        cursor = now - timedelta(seconds=settings.NOTE_SYNC_OVERLAP)
         return Response({
-            "user_categories": user_categories,
-            "ai_generated_categories": ai_generated_categories
+            "notes": self.get_serializer(notes, many=True).data,
+            "deleted": sorted(deleted),
+            "cursor": f"{cursor.timestamp():.6f}"
         })
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """
+        Downloads the user's own notes as NDJSON, or as a zip archive with
+        `?type=zip`, streamed while the rows are read.
+        """
+        records = export_records(request.user)
+        filename = f"notes-{timezone.now():%Y%m%d}"
+        if request.query_params.get('type') == 'zip':
+            return streaming_response(request, zip_chunks(records), 'application/zip', f"{filename}.zip")
+        return streaming_response(request, ndjson_chunks(records), 'application/x-ndjson', f"{filename}.ndjson")
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAuthenticated],
+            parser_classes=[MultiPartParser])
+    def import_notes(self, request):
+        """Adds the notes of an uploaded export (`file`, NDJSON or zip) to the user's notes."""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"message": "An export file is required."}, status=400)
+        try:
+            imported = import_notes(request.user, open_export(upload))
+        except ImportFormatError as e:
+            return Response({"message": str(e)}, status=400)
+        return Response({"imported": imported}, status=201)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def batch(self, request):
+        """
+        Applies a list of create, update, recategorize and delete operations
+        in one transaction and responds with a result for each.
+        """
+        operations = request.data.get("operations")
+        if not isinstance(operations, list) or not operations:
+            return Response({"message": "operations must be a non-empty list."}, status=400)
+        if len(operations) > settings.NOTE_BATCH_MAX_OPERATIONS:
+            return Response({"message": f"At most {settings.NOTE_BATCH_MAX_OPERATIONS} operations per request."},
+                            status=400)
+        return Response({"results": apply_operations(request.user, operations)})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk_share(self, request):
+        """
+        Shares several of the user's notes with several people at once, or
+        invites them as guests with `"invite": true`. Responds with a status
+        for every note and address.
+        """
+        note_ids = request.data.get("note_ids") or []
+        emails = request.data.get("emails") or []
+        if not isinstance(note_ids, list) or not isinstance(emails, list) or not note_ids or not emails:
+            return Response({"message": "note_ids and emails must be non-empty lists."}, status=400)
+        if len(note_ids) > settings.BULK_SHARE_MAX_NOTES or len(emails) > settings.BULK_SHARE_MAX_RECIPIENTS:
+            return Response({"message": f"At most {settings.BULK_SHARE_MAX_NOTES} notes and "
+                                        f"{settings.BULK_SHARE_MAX_RECIPIENTS} recipients per request."}, status=400)
+        try:
+            note_ids = list(dict.fromkeys(int(note_id) for note_id in note_ids))
+        except (TypeError, ValueError):
+            return Response({"message": "note_ids must be integers."}, status=400)
+
+        results = bulk_share(request.user, note_ids, emails, invite=bool(request.data.get("invite")))
+        return Response({"results": results})
+
+    @action(detail=False, methods=['get'])
+    def categories(self, request):
+        """Returns all categories available to the user (AI-generated and user-defined) with their note counts"""
+        def compute():
+            categories = list(Category.objects.filter(user=request.user)
+                              .annotate(note_count=Count('effective_notes'),
+                                        has_ai_notes=Exists(Note.objects.filter(ai_generated_category=OuterRef('pk'))))
+                              .order_by('name'))
+            return {
+                "user_categories": list(CategoryCountSerializer(categories, many=True).data),
+                "ai_generated_categories": [category.name for category in categories if category.has_ai_notes]
+            }
+
+        # Counts move with the user's notes as well as their categories
+        return Response(response_cache.get_or_set(
+            'category_counts',
+            [user_scope(request.user.id, 'categories'), user_scope(request.user.id, 'notes')],
+            compute))
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -145,23 +403,25 @@ def invite_guest(request, note_id):
         if note.user == user:
             return Response({"message": "User is the owner of the note."}, status=400)
 
-        # Create a guest invite with a unique token
-        invite = Invite.objects.create(
-            note=note, email=email, token=uuid.uuid4())
+        # The invite, the share and the email commit together; the email is
+        # sent by the outbox dispatcher, not by this request
+        with transaction.atomic():
+            # Create a guest invite with a unique token
+            invite = Invite.objects.create(
+                note=note, email=email, token=uuid.uuid4())
 
-        # Share the note with the user
-        SharedNote.objects.get_or_create(note=note, user=user)
+            # Share the note with the user
+            SharedNote.objects.get_or_create(note=note, user=user)
 
-        # Generate invite link
-        invite_link = f"{settings.FRONTEND_URL}/note/{note_id}/?token={invite.token}"
+            # Generate invite link
+            invite_link = f"{settings.FRONTEND_URL}/note/{note_id}/?token={invite.token}"
 
-        # Send the invitation email
-        send_mail(
-            subject="You've been invited to collaborate on a note!",
-            message=f"Hello,\n\nYou've been invited to collaborate on the note titled '{note.title}'. Access it using this link:\n{invite_link}\n\nBest regards,\nYour Team",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[email],
-        )
+            # Queue the invitation email
+            queue_email(
+                subject="You've been invited to collaborate on a note!",
+                message=f"Hello,\n\nYou've been invited to collaborate on the note titled '{note.title}'. Access it using this link:\n{invite_link}\n\nBest regards,\nYour Team",
+                recipient=email,
+            )
 
         return Response({"message": "Guest invitation sent!", "invite_link": invite_link})
     except Note.DoesNotExist:
@@ -185,22 +445,22 @@ def share_note_with_user(request, note_id):
         if note.user == user:
             return Response({"message": "User is the owner of the note."}, status=400)
 
-        # Check if the note has already been shared with this user
-        shared_note, shared_created = SharedNote.objects.get_or_create(
-            note=note, user=user)
-        if not shared_created:
-            return Response({"message": "User already has access to this note."}, status=400)
-
-        # Prepare the note link for the shared user
-        note_link = f"{settings.FRONTEND_URL}/note/{note_id}"
-
-        # Send a notification email to the shared user
-        send_mail(
-            subject="A note has been shared with you!",
-            message=f"Hello,\n\nA note titled '{note.title}' has been shared with you. Access it here:\n{note_link}\n\nBest regards,\nYour Team",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[email],
-        )
+        with transaction.atomic():
+            # Check if the note has already been shared with this user
+            shared_note, shared_created = SharedNote.objects.get_or_create(
+                note=note, user=user)
+            if not shared_created:
+                return Response({"message": "User already has access to this note."}, status=400)
+
+            # Prepare the note link for the shared user
+            note_link = f"{settings.FRONTEND_URL}/note/{note_id}"
+
+            # Queue a notification email for the shared user
+            queue_email(
+                subject="A note has been shared with you!",
+                message=f"Hello,\n\nA note titled '{note.title}' has been shared with you. Access it here:\n{note_link}\n\nBest regards,\nYour Team",
+                recipient=email,
+            )
 
         return Response({"message": "Note shared with user!"})
     except Note.DoesNotExist:
@@ -31,11 +31,9 @@ const AsyncCategorySelect: React.FC<AsyncCategorySelectProps> = ({
   const [localSelectedCategory, setLocalSelectedCategory] =
     useState(selectedCategory);
 
+  // Follow changes made outside the select, e.g. a background categorization
   useEffect(() => {
-    const intervalId = setInterval(() => {
-      setLocalSelectedCategory(selectedCategory);
-    }, 1000);
-    return () => clearInterval(intervalId);
+    setLocalSelectedCategory(selectedCategory);
   }, [selectedCategory]);
 
   const handleAddCategory = () => {
@@ -48,9 +46,14 @@ const AsyncCategorySelect: React.FC<AsyncCategorySelectProps> = ({
   return (
     <div className='space-y-4'>
       <Select
-        onValueChange={(value) => onCategoryChange(value)}
+        onValueChange={(value) => {
+          setLocalSelectedCategory(
+            categories.find((category) => category.value === value)
+          );
+          onCategoryChange(value);
+        }}
         // eslint-disable-next-line @typescript-eslint/no-explicit-any
-        defaultValue={(localSelectedCategory as any)?.value}>
+        value={(localSelectedCategory as any)?.value ?? ''}>
         <SelectTrigger className='w-32 text-sm border-gray-300'>
           <SelectValue placeholder='Select Category' />
         </SelectTrigger>
@@ -60,11 +60,9 @@ const NoteItem: React.FC<NoteItemProps> = ({
                 WebkitBoxOrient: 'vertical',
                 WebkitLineClamp: 3,
                 overflow: 'hidden',
-              }}
-              dangerouslySetInnerHTML={{
-                __html: note.content,
-              }}
-            />
+              }}>
+              {note.snippet}
+            </div>
           </>
         )}
       </CardContent>
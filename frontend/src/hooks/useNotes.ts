@@ -10,7 +10,7 @@ export const useNotes = () => {
     setLoading(true);
     try {
       const response = await api('/notes/');
-      setNotes(response.data);
+      setNotes(response.data.results);
     } finally {
       setLoading(false);
     }
@@ -52,14 +52,21 @@ const NoteEditorPage: React.FC = () => {
   } = useFetchCategories();
 
   const [socket, setSocket] = useState<WebSocket>();
+  const syncVersionRef = useRef<number>(0); // Last operation version applied
   // eslint-disable-next-line @typescript-eslint/no-explicit-any
   const quillRef = useRef<any>(null);
   const [noteContent, setNoteContent] = useState('');
   const noteTitleRef = useRef<string>(''); // Ref for note title
+  const titleInputRef = useRef<HTMLInputElement>(null);
   const selectedCategoryRef = useRef<object>({
     label: '',
     value: '',
   }); // Ref for selected category
+  // Category shown in the select: the user's pick, else the AI one
+  const [displayedCategory, setDisplayedCategory] = useState<object>({
+    label: '',
+    value: '',
+  });
   const [activeUsers, setActiveUsers] = useState<number>(0);
   const [loading, setLoading] = useState(true); // Loading state for note data
   const [noteFetchError, setNoteFetchError] = useState<string | null>(null);
@@ -70,38 +77,65 @@ const NoteEditorPage: React.FC = () => {
     fetchCategories();
   }, [fetchCategories]);
 
+  // A category the AI categorizer just created isn't in the list yet
+  useEffect(() => {
+    const value = (displayedCategory as any)?.value;
+    if (
+      value &&
+      !categoriesLoading &&
+      !categories.some((category) => category.value === value)
+    ) {
+      fetchCategories();
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [displayedCategory]);
+
+  // Read the note over REST, as a guest when there's an invite token
+  const fetchNote = useCallback(async () => {
+    const token = router.query.token;
+    const response = token
+      ? await api(
+          `/notes/${noteId}/?token=${token}`,
+          { method: 'GET' },
+          true
+        )
+      : await api(`/notes/${noteId}/`, { method: 'GET' });
+    return response.data;
+  }, [noteId, api, router.query.token]);
+
+  const applyCategory = useCallback((note: any) => {
+    selectedCategoryRef.current = {
+      label: note?.user_updated_category?.name,
+      value: String(note?.user_updated_category?.id),
+    };
+    const category = note?.user_updated_category ?? note?.ai_generated_category;
+    setDisplayedCategory({
+      label: category?.name ?? '',
+      value: category ? String(category.id) : '',
+    });
+  }, []);
+
   // Fetch note data if editing an existing note
   useEffect(() => {
     if (noteId !== 'new' && noteId) {
-      const fetchNote = async () => {
+      const loadNote = async () => {
         try {
-          const token = router.query.token;
-          const response = token
-            ? await api(
-                `/notes/${noteId}/?token=${token}`,
-                { method: 'GET' },
-                true
-              )
-            : await api(`/notes/${noteId}/`, { method: 'GET' });
-
-          setNoteContent(response.data.content);
-          setIsNoteOwner(response.data.is_owner);
-          noteTitleRef.current = response.data.title || '';
-          selectedCategoryRef.current = {
-            label: response.data?.user_updated_category?.name,
-            value: String(response.data?.user_updated_category?.id),
-          };
+          const note = await fetchNote();
+          setNoteContent(note.content);
+          setIsNoteOwner(note.is_owner);
+          noteTitleRef.current = note.title || '';
+          applyCategory(note);
         } catch {
           setNoteFetchError('Failed to fetch note data');
         } finally {
           setLoading(false);
         }
       };
-      fetchNote();
+      loadNote();
     } else {
       setLoading(false); // No loading state needed for a new note
     }
-  }, [noteId, api, router.query.token]);
+  }, [noteId, fetchNote, applyCategory]);
 
   // Set up WebSocket for real-time collaboration
   useEffect(() => {
@@ -120,6 +154,14 @@ const NoteEditorPage: React.FC = () => {
         const data = JSON.parse(event.data);
         if (data?.type === 'user_count') {
           setActiveUsers(data?.count);
+        } else if (data?.type === 'category') {
+          // Categorized in the background; a category the user picked wins
+          if (!/^\d+$/.test((selectedCategoryRef.current as any)?.value)) {
+            setDisplayedCategory({
+              label: data?.category?.name ?? '',
+              value: data?.category ? String(data.category.id) : '',
+            });
+          }
         } else if (
           data?.type === 'message' &&
           data?.clientId !== clientId &&
@@ -127,6 +169,74 @@ const NoteEditorPage: React.FC = () => {
           data?.delta
         ) {
           quillRef.current?.getEditor()?.updateContents(data?.delta, 'api');
+        } else if (data?.type === 'sync' && quillRef.current) {
+          const editor = quillRef.current?.getEditor();
+          syncVersionRef.current = data?.version ?? 0;
+          if (data?.snapshot) {
+            // Catch up from the server snapshot plus the operations after it
+            editor?.setContents(data.snapshot, 'api');
+            data?.ops?.forEach((delta: Delta) =>
+              editor?.updateContents(delta, 'api')
+            );
+          } else {
+            // No snapshot: the content loaded over REST is the document
+            // before these operations, and the result becomes the base
+            data?.ops?.forEach((delta: Delta) =>
+              editor?.updateContents(delta, 'api')
+            );
+            socket.send(
+              JSON.stringify({
+                type: 'snapshot',
+                delta: editor?.getContents(),
+                version: data?.version,
+              })
+            );
+          }
+        } else if (data?.type === 'note' && data?.deleted) {
+          // Deleted through the batch endpoint; guests have no list of
+          // notes to go back to
+          if (router.query.token) {
+            setNoteFetchError('This note has been deleted');
+          } else {
+            router.replace('/notes');
+          }
+        } else if (data?.type === 'note' && data?.changed) {
+          // Changed through the batch endpoint: only the fields named are
+          // taken from the server, so other local edits are kept
+          fetchNote()
+            .then((note) => {
+              if (data.changed.includes('title')) {
+                noteTitleRef.current = note.title || '';
+                if (titleInputRef.current) {
+                  titleInputRef.current.value = noteTitleRef.current;
+                }
+              }
+              if (data.changed.includes('content')) {
+                setNoteContent(note.content);
+                // 'api' source, so the new content isn't saved or sent back
+                quillRef.current
+                  ?.getEditor()
+                  ?.clipboard.dangerouslyPasteHTML(note.content ?? '', 'api');
+              }
+              if (data.changed.includes('category')) {
+                applyCategory(note);
+              }
+            })
+            .catch(() => setNoteFetchError('Failed to fetch note data'));
+        } else if (
+          data?.type === 'batch' &&
+          quillRef.current &&
+          // Skip batches already included in the sync we caught up from
+          !(data?.version && data.version <= syncVersionRef.current)
+        ) {
+          // Deltas coalesced by the server, in the order they were received
+          data?.messages?.forEach((message: any) => {
+            if (message?.clientId !== clientId && message?.delta) {
+              quillRef.current
+                ?.getEditor()
+                ?.updateContents(message.delta, 'api');
+            }
+          });
         }
       };
 
@@ -138,7 +248,8 @@ const NoteEditorPage: React.FC = () => {
         socket.close();
       };
     }
-  }, [authToken, noteId, router.query.token]);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [authToken, noteId, router.query.token, fetchNote, applyCategory]);
 
   // Debounced function to save the note
   const saveNote = useCallback(
@@ -201,6 +312,7 @@ const NoteEditorPage: React.FC = () => {
     const existingCategory = categories.find((cat) => cat?.value === category);
     if (existingCategory) {
       selectedCategoryRef.current = existingCategory;
+      setDisplayedCategory(existingCategory);
     }
     saveNote(noteContent); // Save note with updated category
   };
@@ -213,6 +325,7 @@ const NoteEditorPage: React.FC = () => {
           <Skeleton className='h-8 w-3/4 mb-2' />
         ) : (
           <input
+            ref={titleInputRef}
             type='text'
             defaultValue={noteTitleRef.current}
             onChange={handleTitleChange}
@@ -238,7 +351,7 @@ const NoteEditorPage: React.FC = () => {
                 ) : (
                   <AsyncCategorySelect
                     categories={categories}
-                    selectedCategory={selectedCategoryRef.current}
+                    selectedCategory={displayedCategory}
                     onCategoryChange={handleCategoryChange}
                     onAddCategory={createCategory}
                   />
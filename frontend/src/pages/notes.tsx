@@ -12,6 +12,10 @@ import {
 } from '@heroicons/react/24/outline';
 import { useAuth0 } from '@auth0/auth0-react';
 
+// The API returns absolute `next` links; keep only the cursor query string
+const getCursorQuery = (next: string | null) =>
+  next ? new URL(next).search : null;
+
 const NotesPage: React.FC = () => {
   const { logout } = useAuth0();
   const { api } = useApi();
@@ -21,6 +25,7 @@ const NotesPage: React.FC = () => {
     router.query.category
   );
   const [notes, setNotes] = useState<Note[]>([]);
+  const [nextPage, setNextPage] = useState<string | null>(null); // Cursor query for the next page
   const [loading, setLoading] = useState(true);
   const [categoriesLoading, setCategoriesLoading] = useState(true);
   const [isSidebarOpen, setIsSidebarOpen] = useState(false);
@@ -52,7 +57,8 @@ const NotesPage: React.FC = () => {
             ? '/notes'
             : `/notes?category=${selectedCategory}`;
         const response = await api(endpoint);
-        setNotes(response.data);
+        setNotes(response.data.results);
+        setNextPage(getCursorQuery(response.data.next));
       } finally {
         setLoading(false);
       }
@@ -60,6 +66,14 @@ const NotesPage: React.FC = () => {
     fetchNotes();
   }, [api, selectedCategory]);
 
+  // Append the next page of notes
+  const handleLoadMore = async () => {
+    if (!nextPage) return;
+    const response = await api(`/notes/${nextPage}`);
+    setNotes((current) => [...current, ...response.data.results]);
+    setNextPage(getCursorQuery(response.data.next));
+  };
+
   // Update selected category in state and URL query parameter
   const handleCategoryChange = (category: string) => {
     setSelectedCategory(category);
@@ -140,6 +154,15 @@ const NotesPage: React.FC = () => {
           onDelete={handleDelete}
           isLoading={loading || categoriesLoading}
         />
+
+        {!loading && nextPage && (
+          <Button
+            onClick={handleLoadMore}
+            variant='ghost'
+            className='mt-4 self-center'>
+            Load more
+          </Button>
+        )}
       </div>
     </div>
   );
@@ -2,7 +2,10 @@
 export interface Note {
   id: string;
   title: string;
-  content: string;
+  content?: string;
+  snippet?: string;
+  category?: string | null;
+  updated_at?: string;
   ownerId?: string;
   sharedWith?: string[];
   is_owner?: boolean;